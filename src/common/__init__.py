@@ -22,12 +22,26 @@ MQTT_CUBIEMEDIA = "cubiemedia"
 STATE_UNKNOWN = 'unknown'
 
 DEVICES_CAN_BE_ADDED = 'devices_can_be_added'
+SAVE_DELAY = 'save_delay'
+OFFLINE_SPILL_FILE = 'offline_spill_file'
+PUBLISH_REFRESH = 'publish_refresh'
 
 # numbers
 VERSION = "0.7.0"
 
 # devices #
 ENOCEAN_PORT = "/dev/ttyAMA0"
+ENOCEAN_RECEIVE_BATCH = 64
+ENOCEAN_LONG_PUSH = 0.8
+ENOCEAN_SHORT_PUSH_RELEASE = 0.5
+ENOCEAN_DIMMER_STEP = 0.5
+ARBITRATION_HYSTERESIS = 6
+ARBITRATION_HOLD_TIME = 30
+ARBITRATION_MIN_SAMPLES = 3
+ARBITRATION_STALE = 600
+ARBITRATION_ALPHA = 0.2
+ARBITRATION_REPORT_DELTA = 2
+ARBITRATION_INTERVAL = 30
 SONAR_PORT = "/dev/serial0"
 
 # files
@@ -50,6 +64,13 @@ DEFAULT_MQTT_PASSWORD = "autoInstall"
 DEFAULT_LEARN_MODE = True
 DEFAULT_TOPIC_COMMAND = MQTT_CUBIEMEDIA + "/command"
 DEFAULT_TOPIC_ANNOUNCE = MQTT_CUBIEMEDIA + "/" + CUBIE_ANNOUNCE
+ENOCEAN_TOPIC_ARBITRATION = MQTT_CUBIEMEDIA + "/" + CUBIE_ENOCEAN + "/arbitration"
+OFFLINE_QUEUE_EVENTS = 1000
+OFFLINE_QUEUE_RETAINED = 10000
+OFFLINE_SPILL_EVENTS = 100000
+OFFLINE_DRAIN_RATE = 200
+OFFLINE_DRAIN_BATCH = 20
+PUBLISH_CACHE_SIZE = 10000
 
 # Victron
 EXPORT_CORRECTION_FACTOR = 'export_correction_factor'
@@ -58,16 +79,53 @@ IMPORT_CORRECTION_FACTOR = 'import_correction_factor'
 # Relayboard #
 RELAY_USERNAME = 'admin'
 RELAY_PASSWORD = 'password'
+RELAY_POOL_SIZE = 8
+# seconds, a board which does not answer is retried after RELAY_BACKOFF doubled per failure
+RELAY_CONNECT_TIMEOUT = 1
+RELAY_READ_TIMEOUT = 3
+RELAY_SWEEP_DEADLINE = 1
+RELAY_BACKOFF = 5
+RELAY_MAX_BACKOFF = 300
+# commands for a board within this window are sent together
+RELAY_COMMAND_WINDOW = 0.05
+RELAY_COMBINE_COMMANDS = "combine_commands"
+
+# Balboa #
+BALBOA_PORT = 4257
+# seconds, the spa sends a status update several times a second
+BALBOA_CONNECT_TIMEOUT = 3
+BALBOA_READ_TIMEOUT = 5
+# a spa which does not answer is connected again after BALBOA_BACKOFF doubled per failure
+BALBOA_BACKOFF = 5
+BALBOA_MAX_BACKOFF = 300
+# seconds per service in which a changed value is published at most once, e.g. {"current_temperature": 60}
+BALBOA_RATE_LIMIT_KEY = "rate_limit"
 
 # GPIO #
 GPIO_PIN_TYPE_IN = "in"
 GPIO_PIN_TYPE_OUT = "out"
+GPIO_PIN_TYPE_COUNTER = "counter"
+GPIO_POLL_INTERVAL = 0.2
+# milliseconds, can be set per pin with "bouncetime"
+GPIO_BOUNCETIME = 20
+GPIO_BOUNCETIME_KEY = "bouncetime"
+# S0 pulse counter, "impulses" per kWh and the publish "interval" in seconds can be set per pin
+GPIO_IMPULSES = 1000
+GPIO_IMPULSES_KEY = "impulses"
+GPIO_COUNTER_INTERVAL = 60
+GPIO_COUNTER_INTERVAL_KEY = "interval"
+GPIO_PULSES_KEY = "pulses"
+GPIO_COUNTER_SAVE_INTERVAL = 600
 
 # Timeouts #
 TIMEOUT_UPDATE_AVAILABILITY = 180
-TIMEOUT_UPDATE_SPA = 60
 TIMEOUT_UPDATE_RELAY = 60
 TIMEOUT_UPDATE_MIFLORA = 3600
+TIMEOUT_UPDATE_IDLE = 30
+TIMEOUT_SAVE_CONFIGURATION = 5
+TIMEOUT_PUBLISH_REFRESH = 180
+METRICS_INTERVAL = 60
+WEBTOOL_CONFIGURATION_MAX_AGE = 5
 
 # Colors for Logging #
 COLOR_YELLOW = "\x1b[33;20m"
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import bisect
+import json
+import time
+from collections import deque
+
+from common import ARBITRATION_HYSTERESIS, ARBITRATION_HOLD_TIME, ARBITRATION_MIN_SAMPLES, ARBITRATION_STALE, \
+    ARBITRATION_ALPHA, ARBITRATION_REPORT_DELTA
+
+SIGNAL_WINDOW = 8
+
+
+class SignalStatistic:
+    """Rolling signal strength of one device as seen by one gateway."""
+    __slots__ = ('ewma', 'median', 'count', 'updated', '_window', '_sorted')
+
+    def __init__(self):
+        self.ewma = None
+        self.median = None
+        self.count = 0
+        self.updated = 0.0
+        self._window = deque()
+        self._sorted = []
+
+    def add(self, dbm: float, now: float, alpha: float = ARBITRATION_ALPHA):
+        self.ewma = dbm if self.ewma is None else self.ewma + alpha * (dbm - self.ewma)
+        self.count += 1
+        self.updated = now
+
+        if len(self._window) == SIGNAL_WINDOW:
+            self._sorted.pop(bisect.bisect_left(self._sorted, self._window.popleft()))
+        self._window.append(dbm)
+        bisect.insort(self._sorted, dbm)
+        self.median = self.percentile(50)
+
+    def set(self, ewma: float, median: float, now: float):
+        # summary reported by another gateway, which only reports devices with enough samples
+        self.ewma = ewma
+        self.median = median
+        self.count = max(self.count, ARBITRATION_MIN_SAMPLES)
+        self.updated = now
+
+    def percentile(self, percent: float) -> float:
+        if not self._sorted:
+            return self.median
+        position = min(len(self._sorted) - 1, int(len(self._sorted) * percent / 100))
+        return self._sorted[position]
+
+
+class GatewayArbiter:
+    """Decides which gateway owns a device from the signal strength all gateways report.
+
+    Every gateway keeps the same table of signal statistics per device and gateway and applies the
+    same rule: the owner only changes when another gateway is better by the hysteresis, with its
+    average and its median, for the hold time. Gateways exchange compact deltas which only contain
+    the statistics that changed noticeably and the devices they took over.
+    """
+
+    def __init__(self, client_id: str, hysteresis: float = ARBITRATION_HYSTERESIS,
+                 hold_time: float = ARBITRATION_HOLD_TIME, min_samples: int = ARBITRATION_MIN_SAMPLES,
+                 stale_after: float = ARBITRATION_STALE):
+        self.client_id = client_id
+        self.hysteresis = hysteresis
+        self.hold_time = hold_time
+        self.min_samples = min_samples
+        self.stale_after = stale_after
+        self.owners = {}
+        self.signals = {}
+        self._candidates = {}
+        self._first_seen = {}
+        self._reported = {}
+        self._claims = set()
+
+    def set_owner(self, device_id: str, client_id: str):
+        self.owners[device_id] = client_id
+        self._candidates.pop(device_id, None)
+
+    def remove(self, device_id: str):
+        self.owners.pop(device_id, None)
+        self.signals.pop(device_id, None)
+        self._candidates.pop(device_id, None)
+        self._first_seen.pop(device_id, None)
+        self._reported.pop(device_id, None)
+        self._claims.discard(device_id)
+
+    def observe(self, device_id: str, dbm: float, now: float = None) -> str:
+        # local reading, returns the owner after this reading
+        now = time.monotonic() if now is None else now
+        self._first_seen.setdefault(device_id, now)
+        signal = self.signals.setdefault(device_id, {}).get(self.client_id)
+        if signal is None:
+            signal = self.signals[device_id][self.client_id] = SignalStatistic()
+        signal.add(dbm, now)
+        return self.evaluate(device_id, now)
+
+    def evaluate(self, device_id: str, now: float = None) -> str:
+        now = time.monotonic() if now is None else now
+        owner = self.owners.get(device_id)
+        signals = {client_id: signal for client_id, signal in self.signals.get(device_id, {}).items()
+                   if signal.count >= self.min_samples and now - signal.updated < self.stale_after}
+        if not signals:
+            return owner
+
+        best = max(signals, key=lambda client_id: (signals[client_id].ewma, client_id))
+        if owner is None or (owner not in signals and now - self._first_seen.get(device_id, now) >= self.stale_after):
+            # nobody or a gateway which did not report for a long time owns the device, the best
+            # gateway takes it at once
+            return self._hand_over(device_id, best)
+        if owner not in signals:
+            return owner
+        if best == owner:
+            self._candidates.pop(device_id, None)
+            return owner
+
+        if signals[best].ewma >= signals[owner].ewma + self.hysteresis and \
+                signals[best].median >= signals[owner].median + self.hysteresis:
+            candidate, since = self._candidates.get(device_id, (None, now))
+            if candidate != best:
+                self._candidates[device_id] = (best, now)
+            elif now - since >= self.hold_time:
+                return self._hand_over(device_id, best)
+        else:
+            self._candidates.pop(device_id, None)
+        return owner
+
+    def create_delta(self, now: float = None) -> str:
+        # None if nothing changed since the last delta, unchanged values are repeated before they get stale
+        now = time.monotonic() if now is None else now
+        signals = {}
+        for device_id, device_signals in self.signals.items():
+            signal = device_signals.get(self.client_id)
+            if signal is None or signal.count < self.min_samples:
+                continue
+            reported, reported_at = self._reported.get(device_id, (None, now))
+            if reported is None or abs(reported - signal.ewma) >= ARBITRATION_REPORT_DELTA or \
+                    now - reported_at >= self.stale_after / 2:
+                signals[device_id] = [round(signal.ewma), round(signal.median)]
+                self._reported[device_id] = (signal.ewma, now)
+
+        if not signals and not self._claims:
+            return None
+        delta = {'g': self.client_id, 's': signals}
+        if self._claims:
+            delta['c'] = sorted(self._claims)
+            self._claims.clear()
+        return json.dumps(delta, separators=(',', ':'))
+
+    def apply_delta(self, payload, now: float = None) -> {}:
+        # returns the devices which changed their owner with the delta
+        now = time.monotonic() if now is None else now
+        delta = json.loads(payload)
+        client_id = delta['g']
+        if client_id == self.client_id:
+            return {}
+
+        for device_id, (ewma, median) in delta.get('s', {}).items():
+            self._first_seen.setdefault(device_id, now)
+            signal = self.signals.setdefault(device_id, {}).get(client_id)
+            if signal is None:
+                signal = self.signals[device_id][client_id] = SignalStatistic()
+            signal.set(ewma, median, now)
+
+        changed = {}
+        for device_id in delta.get('c', []):
+            if self.owners.get(device_id) != client_id:
+                self.set_owner(device_id, client_id)
+                self._claims.discard(device_id)
+                changed[device_id] = client_id
+        return changed
+
+    def _hand_over(self, device_id: str, client_id: str) -> str:
+        if self.owners.get(device_id) != client_id:
+            self.set_owner(device_id, client_id)
+            if client_id == self.client_id:
+                self._claims.add(device_id)
+        return client_id
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import logging
+import select
+import socket
+import struct
+import threading
+import time
+
+from common import BALBOA_PORT, BALBOA_CONNECT_TIMEOUT, BALBOA_BACKOFF, BALBOA_MAX_BACKOFF
+
+FRAME_DELIMITER = 0x7E
+# length byte, message type and checksum, the length counts everything between the delimiters
+MIN_FRAME_LENGTH = 5
+STATUS_UPDATE = b'\xff\xaf\x13'
+RECEIVE_SIZE = 1024
+
+# commands of the wifi module to the spa
+TOGGLE_ITEM = b'\x0a\xbf\x11'
+SET_TEMPERATURE = b'\x0a\xbf\x20'
+SET_TIME = b'\x0a\xbf\x21'
+SETTINGS_REQUEST = b'\x0a\xbf\x22'
+SET_FILTER_CYCLES = b'\x0a\xbf\x23'
+
+# items of TOGGLE_ITEM
+PUMP_1 = 0x04
+PUMP_2 = 0x05
+PUMP_3 = 0x06
+BLOWER = 0x0c
+MISTER = 0x0e
+LIGHT_1 = 0x11
+LIGHT_2 = 0x12
+AUX_1 = 0x16
+AUX_2 = 0x17
+HOLD = 0x3c
+TEMPERATURE_RANGE = 0x50
+HEATING_MODE = 0x51
+
+# payloads of SETTINGS_REQUEST
+PANEL_CONFIGURATION = b'\x00\x00\x01'
+FILTER_CYCLES = b'\x01\x00\x00'
+SYSTEM_INFORMATION = b'\x02\x00\x00'
+FAULT_LOG = b'\x20\xff\x00'
+
+# CRC-8 with polynomial 0x07, the spa starts with 0x02 and xors the result with 0x02
+CRC_POLYNOMIAL = 0x07
+CRC_INIT = 0x02
+
+
+def _crc_table() -> bytes:
+    table = []
+    for value in range(256):
+        for _ in range(8):
+            value = ((value << 1) ^ CRC_POLYNOMIAL if value & 0x80 else value << 1) & 0xff
+        table.append(value)
+    return bytes(table)
+
+
+CRC_TABLE = _crc_table()
+
+
+def compute_checksum(data) -> int:
+    # data is everything between the start delimiter and the checksum, starting with the length
+    crc = CRC_INIT
+    for value in data:
+        crc = CRC_TABLE[crc ^ value]
+    return crc ^ CRC_INIT
+
+
+def encode_frame(message_type: bytes, payload: bytes = b'') -> bytes:
+    content = bytes([MIN_FRAME_LENGTH + len(payload)]) + message_type + payload
+    return bytes([FRAME_DELIMITER]) + content + bytes([compute_checksum(content), FRAME_DELIMITER])
+
+
+def encode_toggle(item: int) -> bytes:
+    return encode_frame(TOGGLE_ITEM, bytes([item, 0x00]))
+
+
+def encode_temperature(temperature: float) -> bytes:
+    # half degrees celsius
+    return encode_frame(SET_TEMPERATURE, bytes([int(round(temperature * 2))]))
+
+
+def encode_time(hour: int, minute: int, twenty_four_hours: bool = True) -> bytes:
+    return encode_frame(SET_TIME, bytes([hour | 0x80 if twenty_four_hours else hour, minute]))
+
+
+def encode_filter_cycles(first: tuple, second: tuple = None) -> bytes:
+    # (start hour, start minute, duration hours, duration minutes) per cycle, the second cycle is optional
+    payload = bytes(first)
+    if second:
+        payload += bytes([second[0] | 0x80]) + bytes(second[1:])
+    else:
+        payload += bytes(4)
+    return encode_frame(SET_FILTER_CYCLES, payload)
+
+
+def encode_request(request: bytes) -> bytes:
+    return encode_frame(SETTINGS_REQUEST, request)
+
+
+class Frame:
+    """Message of a spa, the message type is channel, 0xAF or 0xBF and type."""
+
+    def __init__(self, message_type: bytes, payload: bytes):
+        self.message_type = message_type
+        self.payload = payload
+
+    def __eq__(self, other):
+        return isinstance(other, Frame) and (self.message_type, self.payload) == (other.message_type, other.payload)
+
+    def __repr__(self):
+        return f"Frame({self.message_type.hex(' ')}, {self.payload.hex(' ')})"
+
+
+class StatusDecoder:
+    """Decodes all fields of a status update with one precompiled struct unpack.
+
+    fields maps a name to its byte offset in the payload and a formula of that byte. Formulas are evaluated
+    for all 256 byte values up front, decoding a frame only looks the values up.
+    """
+
+    def __init__(self, fields: dict):
+        offsets = sorted({offset for offset, _ in fields.values()})
+        struct_format = ">"
+        previous = -1
+        for offset in offsets:
+            struct_format += f"{offset - previous - 1}xB"
+            previous = offset
+        self.struct = struct.Struct(struct_format)
+        position = {offset: index for index, offset in enumerate(offsets)}
+        self.fields = tuple((name, position[offset], tuple(formula(value) for value in range(256)))
+                            for name, (offset, formula) in fields.items())
+
+    def decode(self, payload: bytes) -> dict:
+        try:
+            values = self.struct.unpack_from(payload)
+        except struct.error as e:
+            raise ValueError(f"status update with [{len(payload)}] bytes, expected [{self.struct.size}]") from e
+        return {name: table[values[position]] for name, position, table in self.fields}
+
+
+class FrameReader:
+    """Splits the byte stream of a spa into frames, however it is chunked by the socket.
+
+    Bytes outside of 0x7E delimiters are skipped. A frame with a wrong length, end delimiter or checksum
+    is dropped and the search resynchronizes on the next delimiter after its start.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.dropped = 0
+
+    def feed(self, data: bytes) -> list:
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        start = 0
+        while True:
+            start = buffer.find(FRAME_DELIMITER, start)
+            if start < 0:
+                start = len(buffer)
+                break
+            if len(buffer) - start < 2:
+                break
+            length = buffer[start + 1]
+            if length < MIN_FRAME_LENGTH or length == FRAME_DELIMITER:
+                # end delimiter of a frame we did not see the start of, frames are shorter than 0x7E
+                start += 1
+                continue
+            end = start + length + 1
+            if end >= len(buffer):
+                break
+            if buffer[end] != FRAME_DELIMITER or compute_checksum(buffer[start + 1:end - 1]) != buffer[end - 1]:
+                logging.debug(f"... ... dropping invalid frame [{buffer[start:end + 1].hex(' ')}]")
+                self.dropped += 1
+                start += 1
+                continue
+            frames.append(Frame(bytes(buffer[start + 2:start + 5]), bytes(buffer[start + 5:end - 1])))
+            start = end + 1
+        del buffer[:start]
+        return frames
+
+
+class SpaConnection:
+    """TCP connection to the wifi module of one spa, kept open between reads and commands.
+
+    Received frames are dispatched to the handler registered for their message type. The connection is
+    opened again on the next call after it was lost, a read which failed is closed and should not be retried
+    before retry_at.
+    """
+
+    def __init__(self, ip: str, port: int = BALBOA_PORT, timeout: float = BALBOA_CONNECT_TIMEOUT,
+                 backoff: float = BALBOA_BACKOFF, max_backoff: float = BALBOA_MAX_BACKOFF):
+        self.ip = str(ip)
+        self.port = port
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.handlers = {}
+        self.reader = FrameReader()
+        self.socket = None
+        self.connects = 0
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_read = None
+        self._lock = threading.Lock()
+
+    def on(self, message_type: bytes, handler):
+        self.handlers[message_type] = handler
+
+    def is_connected(self) -> bool:
+        return self.socket is not None
+
+    def connect(self) -> socket.socket:
+        if self.socket is None:
+            logging.debug(f"... ... connecting to spa [{self.ip}:{self.port}]")
+            self.socket = socket.create_connection((self.ip, self.port), self.timeout)
+            self.reader = FrameReader()
+            self.connects += 1
+        return self.socket
+
+    def close(self):
+        spa_socket, self.socket = self.socket, None
+        if spa_socket is not None:
+            logging.debug(f"... ... closing connection to spa [{self.ip}]")
+            try:
+                # wakes up a read waiting on another thread
+                spa_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            spa_socket.close()
+
+    def send(self, message: bytes, connect: bool = True):
+        # without connect a lost connection is not opened again, e.g. it is left to the reader
+        with self._lock:
+            if not connect and self.socket is None:
+                raise ConnectionError(f"not connected to spa [{self.ip}]")
+            try:
+                self.connect().sendall(message)
+            except OSError:
+                self.close()
+                raise
+
+    def read(self, message_type: bytes, timeout: float) -> bool:
+        # dispatches everything received so far, waits up to timeout if no frame of message_type was among it
+        try:
+            received = self._read(message_type, timeout)
+        except (OSError, ValueError):
+            self._failed()
+            raise
+        if received:
+            self.failures = 0
+            self.retry_at = 0.0
+            self.last_read = time.monotonic()
+        else:
+            self._failed()
+        return received
+
+    def dispatch(self, frame: Frame):
+        handler = self.handlers.get(frame.message_type)
+        if handler:
+            handler(frame)
+        else:
+            logging.debug(f"... ... ignoring {frame} from spa [{self.ip}]")
+
+    def _read(self, message_type: bytes, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        received = False
+        while True:
+            wait = 0 if received else deadline - time.monotonic()
+            if wait < 0:
+                return False
+            frames = self._receive(wait)
+            if frames is None:
+                if received:
+                    return True
+                continue
+            for frame in frames:
+                received |= frame.message_type == message_type
+                self.dispatch(frame)
+
+    def _failed(self):
+        self.close()
+        self.failures += 1
+        self.retry_at = time.monotonic() + min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+
+    def _receive(self, timeout: float):
+        with self._lock:
+            spa_socket = self.connect()
+        try:
+            if not select.select([spa_socket], [], [], timeout)[0]:
+                return None
+            data = spa_socket.recv(RECEIVE_SIZE)
+        except (OSError, ValueError):
+            self.close()
+            raise
+        if not data:
+            self.close()
+            raise ConnectionError(f"connection closed by spa [{self.ip}]")
+        return self.reader.feed(data)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Decoders for the EnOcean equipment profiles (EEP) used by the gateway. The profiles are taken
+# from EEP.xml of the enocean library and compiled into lookup tables indexed by the data byte,
+# so a telegram is decoded without parsing the profile again. Every decoder is registered with
+# its (RORG, FUNC, TYPE), the profile of a device is learned from its teach-in telegram.
+
+from common.homeassistant import MQTT_CONFIG_TOPIC, MQTT_UNIT, MQTT_STATE_CLASS, MQTT_DEVICE_CLASS, \
+    MQTT_SENSOR, MQTT_BINARY_SENSOR, MQTT_MEASUREMENT, MQTT_TOTAL_INCREASING, MQTT_TEMPERATURE, MQTT_POWER, \
+    MQTT_ENERGY
+
+RORG_RPS = 0xF6
+RORG_BS1 = 0xD5
+RORG_BS4 = 0xA5
+RORG_UTE = 0xD4
+
+RPS_DATA = 1
+BS1_DATA = 1
+BS4_DATA = 1
+# DB0 of 1BS and 4BS telegrams, a cleared learn bit marks a teach-in
+LEARN_BIT = 0x08
+BS4_CONTAINS_EEP = 0x80
+UTE_REQUEST_DELETION = 1
+
+# F6-02-01 rocker actions in the order of the EEP (AI, AO, BI, BO)
+ROCKER_CHANNELS = ('a2', 'a1', 'b2', 'b1')
+
+
+def _decode_rocker(data: int) -> {}:
+    # F6-02-01, R1 (bits 7-5), EB (bit 4), R2 (bits 3-1), SA (bit 0), None for undefined actions
+    first_action = data >> 5
+    energy_bow = (data >> 4) & 0x01
+    second_action = (data >> 1) & 0x07
+    second_action_valid = data & 0x01
+    if first_action >= len(ROCKER_CHANNELS) or second_action >= len(ROCKER_CHANNELS):
+        return None
+
+    if not energy_bow:
+        return {'a1': 0, 'a2': 0, 'b1': 0, 'b2': 0}
+    state = {ROCKER_CHANNELS[first_action]: 1}
+    if second_action_valid and second_action >= 2:
+        state[ROCKER_CHANNELS[second_action]] = 1
+    return state
+
+
+def _decode_push_button(data: int) -> {}:
+    # F6-01-01, PB (bit 4), also used by door and window contacts
+    if (data >> 4) & 0x01:
+        return {'a1': 1}
+    return {'a1': 0}
+
+
+def _decode_rps(data: int) -> {}:
+    state = _decode_rocker(data)
+    return state if state is not None else _decode_push_button(data)
+
+
+def _decode_temperature(raw_value: int, minimum: float, maximum: float) -> float:
+    # same formula as the enocean library (range 255..0), so the rounded values are identical
+    return round((maximum - minimum) / (0.0 - 255.0) * (raw_value - 255.0) + minimum, 1)
+
+
+def _decode_linear(raw_value: int, maximum: float, digits: int = 1) -> float:
+    # raw range 0..250 scaled to 0..maximum
+    return round(raw_value * maximum / 250.0, digits)
+
+
+RPS_STATES = tuple(_decode_rps(data) for data in range(256))
+PUSH_BUTTON_STATES = tuple(_decode_push_button(data) for data in range(256))
+TEMPERATURE_A5_02_05 = tuple(_decode_temperature(raw_value, 0.0, 40.0) for raw_value in range(256))
+HUMIDITY_A5_04_01 = tuple(_decode_linear(raw_value, 100.0) for raw_value in range(256))
+TEMPERATURE_A5_04_01 = tuple(_decode_linear(raw_value, 40.0) for raw_value in range(256))
+VOLTAGE_A5_07_01 = tuple(_decode_linear(raw_value, 5.0, 2) for raw_value in range(256))
+METER_DIVISOR = (1, 10, 100, 1000)
+
+
+class EEPDecoder:
+    """Decoder of one profile, services describe the values of the state for the discovery."""
+
+    def __init__(self, profile: tuple, device_type: str, decode, services: {}):
+        self.profile = profile
+        self.name = format_profile(profile)
+        self.rorg = profile[0]
+        self.device_type = device_type
+        self.decode = decode
+        self.services = services
+
+
+DECODERS = {}
+
+
+def register_decoder(profile: tuple, device_type: str, services: {} = None):
+    def register(decode):
+        DECODERS[profile] = EEPDecoder(profile, device_type, decode, services or {})
+        return decode
+
+    return register
+
+
+def format_profile(profile: tuple) -> str:
+    return "-".join(f"{value:02X}" for value in profile)
+
+
+def parse_profile(name: str) -> tuple:
+    try:
+        profile = tuple(int(value, 16) for value in str(name).split("-"))
+    except ValueError:
+        return None
+    return profile if len(profile) == 3 else None
+
+
+def get_decoder(name: str) -> EEPDecoder:
+    # decoder of a stored profile name like "A5-02-05", None if it is unknown
+    return DECODERS.get(parse_profile(name))
+
+
+def get_teach_in(data: list) -> tuple:
+    # packet.data of a radio telegram, returns (RORG, FUNC, TYPE) of a teach-in telegram, None for
+    # data telegrams and () for a teach-in without profile
+    rorg = data[0]
+    if rorg == RORG_BS4:
+        status = data[BS4_DATA + 3]
+        if status & LEARN_BIT:
+            return None
+        if not status & BS4_CONTAINS_EEP:
+            return ()
+        return RORG_BS4, data[BS4_DATA] >> 2, ((data[BS4_DATA] & 0x03) << 5) | (data[BS4_DATA + 1] >> 3)
+    if rorg == RORG_BS1:
+        return None if data[BS1_DATA] & LEARN_BIT else (RORG_BS1, 0x00, 0x01)
+    if rorg == RORG_UTE:
+        # DB6 request type, DB2 type, DB1 func and DB0 rorg of the profile
+        if (data[1] >> 4) & 0x03 == UTE_REQUEST_DELETION:
+            return ()
+        return data[7], data[6], data[5]
+    return None
+
+
+@register_decoder((RORG_RPS, 0x02, 0x01), "RPS")
+def decode_rps(data: list) -> {}:
+    # packet.data of an RPS telegram: rorg, data byte, sender id, status
+    return RPS_STATES[data[RPS_DATA]].copy()
+
+
+@register_decoder((RORG_RPS, 0x01, 0x01), "RPS")
+def decode_push_button(data: list) -> {}:
+    return PUSH_BUTTON_STATES[data[RPS_DATA]].copy()
+
+
+@register_decoder((RORG_BS4, 0x02, 0x05), "TEMP", {
+    "value": {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        MQTT_UNIT: "°C",
+        MQTT_STATE_CLASS: MQTT_MEASUREMENT,
+        MQTT_DEVICE_CLASS: MQTT_TEMPERATURE
+    }
+})
+def decode_temperature(data: list) -> {}:
+    # packet.data of an A5-02-05 telegram: rorg, 4 data bytes (temperature in DB1), sender id, status
+    return {"value": TEMPERATURE_A5_02_05[data[BS4_DATA + 2]]}
+
+
+@register_decoder((RORG_BS4, 0x04, 0x01), "HUMIDITY", {
+    "humidity": {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        MQTT_UNIT: "%",
+        MQTT_STATE_CLASS: MQTT_MEASUREMENT,
+        MQTT_DEVICE_CLASS: "humidity"
+    },
+    MQTT_TEMPERATURE: {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        MQTT_UNIT: "°C",
+        MQTT_STATE_CLASS: MQTT_MEASUREMENT,
+        MQTT_DEVICE_CLASS: MQTT_TEMPERATURE
+    }
+})
+def decode_humidity(data: list) -> {}:
+    # humidity in DB2, temperature in DB1 if TSN (DB0 bit 1) is set
+    state = {"humidity": HUMIDITY_A5_04_01[data[BS4_DATA + 1]]}
+    if data[BS4_DATA + 3] & 0x02:
+        state[MQTT_TEMPERATURE] = TEMPERATURE_A5_04_01[data[BS4_DATA + 2]]
+    return state
+
+
+@register_decoder((RORG_BS4, 0x07, 0x01), "OCCUPANCY", {
+    "occupancy": {
+        MQTT_CONFIG_TOPIC: MQTT_BINARY_SENSOR,
+        MQTT_DEVICE_CLASS: "occupancy"
+    },
+    "voltage": {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        MQTT_UNIT: "V",
+        MQTT_STATE_CLASS: MQTT_MEASUREMENT,
+        MQTT_DEVICE_CLASS: "voltage"
+    }
+})
+def decode_occupancy(data: list) -> {}:
+    # PIR status in DB1 bit 7, supply voltage in DB3 if SVA (DB0 bit 0) is set
+    state = {"occupancy": data[BS4_DATA + 2] >> 7}
+    if data[BS4_DATA + 3] & 0x01:
+        state["voltage"] = VOLTAGE_A5_07_01[data[BS4_DATA]]
+    return state
+
+
+@register_decoder((RORG_BS1, 0x00, 0x01), "CONTACT", {
+    "opening": {
+        MQTT_CONFIG_TOPIC: MQTT_BINARY_SENSOR,
+        MQTT_DEVICE_CLASS: "opening"
+    }
+})
+def decode_contact(data: list) -> {}:
+    # CO (DB0 bit 0) is 0 for an open contact
+    return {"opening": 0 if data[BS1_DATA] & 0x01 else 1}
+
+
+@register_decoder((RORG_BS4, 0x12, 0x01), "METER", {
+    MQTT_ENERGY: {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        MQTT_UNIT: "kWh",
+        MQTT_STATE_CLASS: MQTT_TOTAL_INCREASING,
+        MQTT_DEVICE_CLASS: MQTT_ENERGY
+    },
+    MQTT_POWER: {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        MQTT_UNIT: "W",
+        MQTT_STATE_CLASS: MQTT_MEASUREMENT,
+        MQTT_DEVICE_CLASS: MQTT_POWER
+    }
+})
+def decode_meter(data: list) -> {}:
+    # meter reading in DB3..DB1, DB0: DT (bit 2) current value in W or cumulative value in kWh,
+    # DIV (bits 1-0) decimal divisor, the tariff info is not used
+    reading = (data[BS4_DATA] << 16) | (data[BS4_DATA + 1] << 8) | data[BS4_DATA + 2]
+    status = data[BS4_DATA + 3]
+    value = reading / METER_DIVISOR[status & 0x03]
+    return {MQTT_POWER: value} if status & 0x04 else {MQTT_ENERGY: value}
+
+
+# decoders of devices without teach-in, keyed by the RORG of the telegram
+DEFAULT_DECODERS = {
+    RORG_RPS: DECODERS[(RORG_RPS, 0x02, 0x01)],
+    RORG_BS4: DECODERS[(RORG_BS4, 0x02, 0x05)],
+    RORG_BS1: DECODERS[(RORG_BS1, 0x00, 0x01)],
+}
+DEVICE_TYPES = {decoder.device_type for decoder in DECODERS.values()}
@@ -1,3 +1,7 @@
+import json
+import threading
+from collections import OrderedDict
+
 from common import VERSION, CUBIEMEDIA
 
 MQTT_QOS = "qos"
@@ -40,6 +44,7 @@ MQTT_ENERGY = "energy"
 MQTT_MEASUREMENT = "measurement"
 MQTT_TOTAL_INCREASING = "total_increasing"
 VICTRON_MQTT_TOPIC = "victron_mqtt_topic"
+DISCOVERY_CACHE_SIZE = 4096
 
 PAYLOAD_SPA_ACTOR = {
     MQTT_NAME: "SERVICE_NAME",
@@ -148,3 +153,65 @@ PAYLOAD_SPECIAL_SENSOR = {
         MQTT_MANUFACTURER: CUBIEMEDIA
     }
 }
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _get_cache_key(template: {}, attributes: {}, device: {}) -> tuple:
+    try:
+        key = (id(template), tuple(attributes.items()), tuple(device.items()) if device else None)
+        hash(key)
+        return key
+    except TypeError:
+        return id(template), _freeze(attributes), _freeze(device)
+
+
+class DiscoveryPayloadBuilder:
+    """Renders discovery configs from the PAYLOAD_* templates without changing the templates.
+
+    Every rendered config is cached as json bytes, keyed by the template and the attributes of the
+    entity, so announcing an unchanged entity again is a dict lookup.
+    """
+
+    def __init__(self, max_size: int = DISCOVERY_CACHE_SIZE):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, template: {}, attributes: {}, device: {} = None) -> bytes:
+        key = _get_cache_key(template, attributes, device)
+        with self._lock:
+            cached = self._cache.get(key)
+            # the template is part of the entry, an id can be reused after a template has gone
+            if cached is not None and cached[0] is template:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        payload = json.dumps(self._build(template, attributes, device)).encode()
+        with self._lock:
+            self._cache[key] = (template, payload)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def _build(template: {}, attributes: {}, device: {} = None) -> {}:
+        # only copies what gets changed, the result is serialized right away
+        payload = {**template, **attributes}
+        if device:
+            payload[MQTT_DEVICE] = {**template[MQTT_DEVICE], **device}
+        return payload
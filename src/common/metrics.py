@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import bisect
+import functools
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from common import MQTT_CUBIEMEDIA, METRICS_INTERVAL
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INSTRUMENTED_METHODS = ['update', 'action', 'send', 'announce']
+METRICS_FILE_PREFIX = "cubiemedia-"
+METRICS_FILE_SUFFIX = ".prom"
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: str) -> list:
+        return [f"{name}{labels} {_format_value(self.value)}"]
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def samples(self, name: str, labels: str) -> list:
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        samples = []
+        cumulative = 0
+        for bucket, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            samples.append(f"{name}_bucket{_add_label(labels, 'le', _format_value(bucket))} {cumulative}")
+        samples.append(f"{name}_sum{labels} {_format_value(total)}")
+        samples.append(f"{name}_count{labels} {count}")
+        return samples
+
+    def snapshot(self) -> {}:
+        with self._lock:
+            return {'count': self.count, 'avg_ms': round(self.sum / self.count * 1000, 3) if self.count else 0,
+                    'max_ms': round(self.max * 1000, 3)}
+
+
+class Callback:
+    # value is read when the metrics are collected, e.g. the depth of a queue
+    def __init__(self, callback):
+        self.callback = callback
+
+    def samples(self, name: str, labels: str) -> list:
+        return [f"{name}{labels} {_format_value(self.snapshot())}"]
+
+    def snapshot(self):
+        try:
+            return self.callback()
+        except Exception as e:
+            logging.debug(f"... ... could not collect metric: {e}")
+            return 0
+
+
+class MetricsRegistry:
+    """Metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.constant_labels = {}
+        self._families = OrderedDict()
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, **labels) -> Counter:
+        return self._get(name, 'counter', documentation, labels, Counter)
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get(name, 'histogram', documentation, labels, lambda: Histogram(buckets))
+
+    def callback(self, name: str, documentation: str, callback, metric_type: str = 'gauge', **labels):
+        metric = self._get(name, metric_type, documentation, labels, lambda: Callback(callback))
+        metric.callback = callback
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            families = [(name, family[0], family[1], list(family[2].items()))
+                        for name, family in self._families.items()]
+        for name, metric_type, documentation, metrics in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, metric in metrics:
+                lines.extend(metric.samples(name, self._format_labels(labels)))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> {}:
+        snapshot = {}
+        with self._lock:
+            families = [(name, list(family[2].items())) for name, family in self._families.items()]
+        for name, metrics in families:
+            short_name = name[len(MQTT_CUBIEMEDIA) + 1:] if name.startswith(MQTT_CUBIEMEDIA + "_") else name
+            for labels, metric in metrics:
+                key = "_".join([short_name] + [value for _, value in labels])
+                snapshot[key] = metric.snapshot()
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._families.clear()
+
+    def _get(self, name: str, metric_type: str, documentation: str, labels: {}, factory):
+        key = tuple(sorted((label, str(value)) for label, value in labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (metric_type, documentation, OrderedDict())
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = factory()
+            return metric
+
+    def _format_labels(self, labels: tuple) -> str:
+        all_labels = list(self.constant_labels.items()) + list(labels)
+        if not all_labels:
+            return ""
+        return "{" + ",".join(f'{label}="{_escape(value)}"' for label, value in all_labels) + "}"
+
+
+REGISTRY = MetricsRegistry()
+SUBPROCESS_SPAWNS = REGISTRY.counter(f"{MQTT_CUBIEMEDIA}_subprocess_spawns_total",
+                                     "Processes started by execute_command")
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _add_label(labels: str, label: str, value: str) -> str:
+    if not labels:
+        return f'{{{label}="{value}"}}'
+    return f'{labels[:-1]},{label}="{value}"}}'
+
+
+def _timed(function, errors: Counter, duration: Histogram):
+    # the number of calls is the count of the histogram, one lock per call keeps the overhead low
+    perf_counter = time.perf_counter
+    observe = duration.observe
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except BaseException:
+            errors.inc()
+            raise
+        finally:
+            observe(perf_counter() - start)
+
+    return wrapper
+
+
+def instrument(system, registry: MetricsRegistry = REGISTRY):
+    registry.constant_labels = {'mode': system.execution_mode}
+    for method in INSTRUMENTED_METHODS:
+        setattr(system, method, _timed(getattr(system, method), *_create_call_metrics(registry, method)))
+    system.mqtt_client.publish = _timed(system.mqtt_client.publish, *_create_call_metrics(registry, 'publish'))
+
+    registry.callback(f"{MQTT_CUBIEMEDIA}_devices", "Devices in the configuration", lambda: len(system.config))
+    offline_queue = system.mqtt_client.offline_queue
+    registry.callback(f"{MQTT_CUBIEMEDIA}_offline_queue_depth", "Messages waiting for the broker",
+                      offline_queue.depth)
+    registry.callback(f"{MQTT_CUBIEMEDIA}_offline_queue_dropped_total", "Messages dropped while offline",
+                      lambda: offline_queue.dropped, 'counter')
+    publish_cache = system.mqtt_client.publish_cache
+    registry.callback(f"{MQTT_CUBIEMEDIA}_publish_cache_hits_total", "Unchanged messages not published again",
+                      lambda: publish_cache.hits, 'counter')
+    registry.callback(f"{MQTT_CUBIEMEDIA}_publish_cache_misses_total", "Messages checked and published",
+                      lambda: publish_cache.misses, 'counter')
+    for key in system.get_statistics():
+        registry.callback(f"{MQTT_CUBIEMEDIA}_system_{key}", f"System specific value [{key}]",
+                          functools.partial(_get_statistic, system, key))
+
+
+def _create_call_metrics(registry: MetricsRegistry, method: str) -> tuple:
+    return (registry.counter(f"{MQTT_CUBIEMEDIA}_call_errors_total", "Calls of system methods which raised",
+                             method=method),
+            registry.histogram(f"{MQTT_CUBIEMEDIA}_call_duration_seconds", "Duration of system method calls",
+                               method=method))
+
+
+def _get_statistic(system, key: str):
+    return system.get_statistics().get(key, 0)
+
+
+def get_metrics_directory() -> str:
+    return os.environ.get('SNAP_DATA', tempfile.gettempdir())
+
+
+def get_metrics_file(execution_mode: str) -> str:
+    return os.path.join(get_metrics_directory(), f"{METRICS_FILE_PREFIX}{execution_mode}{METRICS_FILE_SUFFIX}")
+
+
+def write_metrics_file(path: str, registry: MetricsRegistry = REGISTRY):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as file:
+        file.write(registry.render())
+    os.replace(temp_path, path)
+
+
+def read_metrics_files(directory: str = None) -> str:
+    # all clients write their own file, families with the same name have to be merged
+    families = OrderedDict()
+    pattern = os.path.join(directory or get_metrics_directory(), f"{METRICS_FILE_PREFIX}*{METRICS_FILE_SUFFIX}")
+    for path in sorted(glob.glob(pattern)):
+        try:
+            with open(path) as file:
+                lines = file.read().splitlines()
+        except OSError as e:
+            logging.warning(f"... could not read metrics from [{path}]: {e}")
+            continue
+
+        family = None
+        for line in lines:
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, {'header': [], 'samples': []})
+                if line not in family['header']:
+                    family['header'].append(line)
+            elif line and family is not None:
+                family['samples'].append(line)
+
+    lines = []
+    for family in families.values():
+        lines.extend(family['header'])
+        lines.extend(family['samples'])
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class MetricsReporter:
+    """Writes the metrics file for the webtool and publishes a retained stats topic periodically."""
+
+    def __init__(self, system, interval: float = METRICS_INTERVAL, registry: MetricsRegistry = REGISTRY):
+        self.system = system
+        self.interval = interval
+        self.registry = registry
+        self.path = get_metrics_file(system.execution_mode)
+        self._event = threading.Event()
+        self._thread = threading.Thread()
+
+    def start(self):
+        self._event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.report()
+
+    def report(self):
+        try:
+            write_metrics_file(self.path, self.registry)
+        except OSError as e:
+            logging.warning(f"... could not write metrics to [{self.path}]: {e}")
+        self.system.mqtt_client.publish(
+            f"{MQTT_CUBIEMEDIA}/{self.system.execution_mode}/{self.system.string_ip}/stats",
+            json.dumps(self.registry.snapshot()), True)
+
+    def _run(self):
+        while not self._event.wait(self.interval):
+            self.report()
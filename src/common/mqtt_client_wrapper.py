@@ -3,11 +3,201 @@
 
 import json
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
 
 from paho.mqtt import client as mqtt
 
 from common import CUBIE_ANNOUNCE, DEFAULT_TOPIC_COMMAND, CUBIE_RESET, QOS, CUBIE_RELOAD, \
-    MQTT_CUBIEMEDIA
+    MQTT_CUBIEMEDIA, OFFLINE_QUEUE_EVENTS, OFFLINE_QUEUE_RETAINED, OFFLINE_SPILL_EVENTS, OFFLINE_DRAIN_RATE, \
+    OFFLINE_DRAIN_BATCH, PUBLISH_CACHE_SIZE, TIMEOUT_PUBLISH_REFRESH
+from common.python import invalidate_configuration
+from common.topic_router import TopicRouter
+
+
+def decode_payload(payload: bytes) -> str:
+    return payload.decode().replace("False", "false").replace("True", "true").strip()
+
+
+class OfflinePublishQueue:
+    """Bounded store and forward buffer for messages published while the broker is not reachable.
+
+    Retained messages are state, only the latest payload per topic is kept. All other messages are
+    events and kept in order in a ring buffer. If the ring buffer is full the oldest events are
+    moved to the spill file (if one is configured) or dropped.
+    """
+
+    def __init__(self, max_events: int = OFFLINE_QUEUE_EVENTS, max_retained: int = OFFLINE_QUEUE_RETAINED,
+                 spill_file: str = None, max_spilled: int = OFFLINE_SPILL_EVENTS):
+        self.max_events = max_events
+        self.max_retained = max_retained
+        self.max_spilled = max_spilled
+        self.retained = OrderedDict()
+        self.events = deque()
+        self.spilled = 0
+        self.dropped = 0
+        self._spill_file = None
+        self._spill_offset = 0
+        self._lock = threading.RLock()
+        self.spill_file = spill_file
+
+    @property
+    def spill_file(self) -> str:
+        return self._spill_file
+
+    @spill_file.setter
+    def spill_file(self, spill_file: str):
+        with self._lock:
+            if spill_file == self._spill_file:
+                return
+            self._spill_file = spill_file
+            self._spill_offset = 0
+            self.spilled = 0
+            if spill_file and os.path.isfile(spill_file):
+                # events left over from the last run are sent as well
+                with open(spill_file, 'rb') as file:
+                    self.spilled = sum(1 for _ in file)
+                logging.info(f"... found [{self.spilled}] spilled messages in [{spill_file}]")
+
+    def put(self, topic: str, payload, retain: bool):
+        with self._lock:
+            if retain:
+                if topic not in self.retained and len(self.retained) >= self.max_retained:
+                    self.dropped += 1
+                    return
+                self.retained[topic] = payload
+                self.retained.move_to_end(topic)
+            else:
+                if len(self.events) >= self.max_events:
+                    self._spill(self.events.popleft())
+                self.events.append((topic, payload))
+
+    def depth(self) -> int:
+        return len(self.retained) + len(self.events) + self.spilled
+
+    def __len__(self):
+        return self.depth()
+
+    def stats(self) -> {}:
+        with self._lock:
+            return {'depth': self.depth(), 'retained': len(self.retained), 'events': len(self.events),
+                    'spilled': self.spilled, 'dropped': self.dropped}
+
+    def drain(self, publish, max_messages: int = None) -> int:
+        # oldest events first, the latest state last; stops as soon as publish fails
+        sent = 0
+        with self._lock:
+            while max_messages is None or sent < max_messages:
+                if self.spilled:
+                    if not self._drain_spilled(publish):
+                        break
+                elif self.events:
+                    topic, payload = self.events[0]
+                    if not publish(topic, payload, False):
+                        break
+                    self.events.popleft()
+                elif self.retained:
+                    topic, payload = next(iter(self.retained.items()))
+                    if not publish(topic, payload, True):
+                        break
+                    del self.retained[topic]
+                else:
+                    break
+                sent += 1
+        return sent
+
+    def _spill(self, event: tuple):
+        if not self._spill_file or self.spilled >= self.max_spilled:
+            self.dropped += 1
+            return
+        topic, payload = event
+        line = {'topic': topic, 'payload': payload}
+        if isinstance(payload, bytes):
+            line = {'topic': topic, 'payload': payload.decode('latin-1'), 'bytes': True}
+        try:
+            with open(self._spill_file, 'a') as file:
+                file.write(json.dumps(line) + '\n')
+            self.spilled += 1
+        except (OSError, TypeError) as e:
+            logging.warning(f"... ... could not spill message for [{topic}] to [{self._spill_file}]: {e}")
+            self.dropped += 1
+
+    def _drain_spilled(self, publish) -> bool:
+        try:
+            with open(self._spill_file, 'rb') as file:
+                file.seek(self._spill_offset)
+                raw_line = file.readline()
+        except OSError as e:
+            logging.warning(f"... ... could not read spilled messages from [{self._spill_file}]: {e}")
+            raw_line = b''
+
+        if raw_line:
+            try:
+                line = json.loads(raw_line)
+                payload = line['payload'].encode('latin-1') if line.get('bytes') else line['payload']
+                if not publish(line['topic'], payload, False):
+                    return False
+            except (ValueError, KeyError):
+                logging.warning(f"... ... dropping broken spilled message [{raw_line}]")
+                self.dropped += 1
+            self._spill_offset += len(raw_line)
+            self.spilled -= 1
+
+        if not raw_line or self.spilled <= 0:
+            self.spilled = 0
+            self._spill_offset = 0
+            try:
+                os.remove(self._spill_file)
+            except OSError:
+                pass
+        return True
+
+
+class PublishCache:
+    """Last value per topic for retained messages and availability topics.
+
+    Publishing the same payload again within the refresh interval does not change anything for a
+    subscriber, so it is suppressed. After the refresh interval the value is sent again anyway.
+    """
+
+    def __init__(self, refresh_interval: float = TIMEOUT_PUBLISH_REFRESH, max_size: int = PUBLISH_CACHE_SIZE):
+        self.refresh_interval = refresh_interval
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def should_publish(self, topic: str, payload, retain: bool) -> bool:
+        if not retain and not topic.endswith("/online"):
+            # e.g. a short push is sent unretained and released retained, the next release is a change again
+            with self._lock:
+                self._values.pop(topic, None)
+            return True
+
+        # the type is part of the value, True and 1 are sent differently
+        value = (type(payload), payload)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._values.get(topic)
+            if cached is not None and cached[0] == value and now - cached[1] < self.refresh_interval:
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._values[topic] = (value, now)
+            self._values.move_to_end(topic)
+            if len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def stats(self) -> {}:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._values)}
 
 
 class CubieMediaMQTTClient:
@@ -15,6 +205,16 @@ class CubieMediaMQTTClient:
 
     def __init__(self, client_id):
         self.client_id = client_id
+        self.subscriptions = {}
+        self.router = TopicRouter()
+        self.offline_queue = OfflinePublishQueue()
+        self.publish_cache = PublishCache()
+        self._drain_thread = threading.Thread()
+        self.control_payloads = {
+            CUBIE_ANNOUNCE.encode(): self._announce,
+            CUBIE_RESET.encode(): self._reset,
+            CUBIE_RELOAD.encode(): self._reload
+        }
         self.mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id,
                                        clean_session=True,
                                        userdata=None, transport="tcp")
@@ -38,77 +238,119 @@ class CubieMediaMQTTClient:
         self.mqtt_client.loop_stop()
 
     def publish(self, topic, payload: str, retain: bool = False):
-        self.mqtt_client.publish(topic, payload, 0, retain)
+        if not self.publish_cache.should_publish(topic, payload, retain):
+            return
+        # queued messages have to go out first, otherwise old state would overwrite new state
+        if self.offline_queue.depth() > 0 or not self._send(topic, payload, retain):
+            self.offline_queue.put(topic, payload, retain)
+            if self.mqtt_client.is_connected():
+                self._start_drain()
+
+    def _send(self, topic, payload, retain: bool) -> bool:
+        return self.mqtt_client.publish(topic, payload, 0, retain).rc == mqtt.MQTT_ERR_SUCCESS
+
+    def _start_drain(self):
+        if self.offline_queue.depth() > 0 and not self._drain_thread.is_alive():
+            self._drain_thread = threading.Thread(target=self._drain, daemon=True)
+            self._drain_thread.start()
 
-    def subscribe(self, topic, qos):
-        self.mqtt_client.subscribe(topic, qos)
+    def _drain(self):
+        logging.info(f"... sending [{self.offline_queue.depth()}] messages queued while offline")
+        while self.mqtt_client.is_connected() and self.offline_queue.depth() > 0:
+            if self.offline_queue.drain(self._send, OFFLINE_DRAIN_BATCH) == 0:
+                break
+            time.sleep(OFFLINE_DRAIN_BATCH / OFFLINE_DRAIN_RATE)
+        logging.info(f"... ... offline queue drained, [{self.offline_queue.depth()}] messages left")
+
+    def subscribe(self, topic, qos, handler=None):
+        if handler is not None:
+            self.router.add(topic, handler)
+        # subscriptions are kept by the broker for the whole session, no need to send them again
+        if self.subscriptions.get(topic) == qos:
+            return
+        result = self.mqtt_client.subscribe(topic, qos)
+        if result[0] == mqtt.MQTT_ERR_SUCCESS:
+            self.subscriptions[topic] = qos
 
     def on_message(self, client, userdata, msg):
-        msg_payload = str(msg.payload.decode()).replace("False", "false").replace("True",
-                                                                                  "true").strip()
-        logging.debug(f"... ... mqtt message [{msg_payload}] on topic [{msg.topic}]")
-        if msg_payload == CUBIE_ANNOUNCE:
-            self.system.announce()
-        elif msg_payload == CUBIE_RESET:
-            self.system.reset()
-        elif msg_payload == CUBIE_RELOAD:
-            self.system.load()
-        else:
-            try:
-                if msg.topic == DEFAULT_TOPIC_COMMAND:
-                    message_data = json.loads(msg_payload)
-                    if "type" in message_data and message_data["type"] == self.system.execution_mode:
-                        if "mode" in message_data:
-                            message_mode = message_data["mode"]
-                            if message_mode == "update":
-                                if "device" in message_data:
-                                    new_device = message_data["device"]
-                                    self.system.save(new_device)
-                                else:
-                                    logging.warning("WARNING: no device data given with update")
-                            elif message_mode == "delete":
-                                if "device" in message_data:
-                                    new_device = message_data["device"]
-                                    self.system.delete(new_device)
-                                else:
-                                    logging.warning(
-                                        f"WARNING: no device data given [{message_data}] for deletion")
-                            elif message_mode == 'values':
-                                logging.info(f"... send data with [{msg.topic}]: {msg_payload}")
-                                self.system.send(message_data)
-                            else:
-                                logging.warning(f"WARNING: unknown mode [{message_mode}]")
-                        else:
-                            logging.warning(
-                                f"WARNING: no mode given, doing nothing on msg [{message_data}]")
+        logging.debug("... ... mqtt message [%s] on topic [%s]", msg.payload, msg.topic)
+        control = self.control_payloads.get(msg.payload.strip())
+        if control is not None:
+            control()
+        elif not self.router.dispatch(msg.topic, msg.payload):
+            if msg.topic.endswith("/command"):
+                self.system.on_command(tuple(msg.topic.split("/")), msg.payload)
+            else:
+                logging.warning(f"... ... unknown topic [{msg.topic}]")
+        # commands may change what the next update has to report, wake up the main loop
+        self.system.notify_update()
+
+    def on_default_command(self, path: tuple, payload: bytes):
+        msg_payload = decode_payload(payload)
+        try:
+            message_data = json.loads(msg_payload)
+        except json.JSONDecodeError as json_error:
+            logging.warning(f"... could not decode message[{msg_payload}] with [{json_error}]")
+            return
+
+        if "type" in message_data and message_data["type"] == self.system.execution_mode:
+            if "mode" in message_data:
+                message_mode = message_data["mode"]
+                if message_mode == "update":
+                    if "device" in message_data:
+                        new_device = message_data["device"]
+                        self.system.save(new_device)
                     else:
-                        logging.debug(f"wrong or no type given, ignore message [{message_data}]")
-                else:
-                    if msg.topic.endswith("/command"):
-                        topic_array = msg.topic.split("/")
-                        if len(topic_array) > 3:
-                            message_data = {'ip': topic_array[2].replace("_", "."),
-                                            'id': topic_array[3],
-                                            'state': msg_payload}
-                            self.system.send(message_data)
+                        logging.warning("WARNING: no device data given with update")
+                elif message_mode == "delete":
+                    if "device" in message_data:
+                        new_device = message_data["device"]
+                        self.system.delete(new_device)
                     else:
-                        logging.warning(f"... ... unknown topic [{msg.topic}]")
-            except json.JSONDecodeError as json_error:
-                logging.warning(f"... could not decode message[{msg_payload}] with [{json_error}]")
+                        logging.warning(
+                            f"WARNING: no device data given [{message_data}] for deletion")
+                elif message_mode == 'values':
+                    logging.info(f"... send data with [{'/'.join(path)}]: {msg_payload}")
+                    self.system.send(message_data)
+                else:
+                    logging.warning(f"WARNING: unknown mode [{message_mode}]")
+            else:
+                logging.warning(
+                    f"WARNING: no mode given, doing nothing on msg [{message_data}]")
+        else:
+            logging.debug(f"wrong or no type given, ignore message [{message_data}]")
+
+    def _announce(self):
+        self.system.reset_discovery()
+        self.system.announce()
+
+    def _reset(self):
+        self.system.reset()
+
+    def _reload(self):
+        invalidate_configuration()
+        self.system.load()
 
     def on_connect(self, client, userdata, flags, rc):
         logging.info(
             f"... connected to Server [{self.system.get_mqtt_server()}] as client [{self.client_id}]")
         if rc == 0:
+            if not flags.get('session present'):
+                # new session, the broker does not know any subscription and maybe lost its retained
+                # messages (e.g. after a restart without persistence), so everything is sent again
+                self.subscriptions = {}
+                self.publish_cache.clear()
+                self.system.reset_discovery()
             logging.info(f"... ... subscribe to channel [{DEFAULT_TOPIC_COMMAND}]")
-            self.mqtt_client.subscribe(DEFAULT_TOPIC_COMMAND, QOS)
+            self.subscribe(DEFAULT_TOPIC_COMMAND, QOS, self.on_default_command)
             mode_specific_command_topic = f"{MQTT_CUBIEMEDIA}/{self.system.execution_mode}/command"
             logging.info(f"... ... subscribe to channel [{mode_specific_command_topic}]")
-            self.mqtt_client.subscribe(mode_specific_command_topic, QOS)
+            self.subscribe(mode_specific_command_topic, QOS, self.system.on_command)
             device_specific_command_topic = f"{MQTT_CUBIEMEDIA}/{self.system.execution_mode}/{self.system.string_ip}/command"
             logging.info(f"... ... subscribe to channel [{device_specific_command_topic}]")
-            self.mqtt_client.subscribe(device_specific_command_topic, QOS)
+            self.subscribe(device_specific_command_topic, QOS, self.system.on_command)
             self.system.announce()
+            self._start_drain()
         else:
             logging.info("... bad connection please check login data")
 
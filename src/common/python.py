@@ -1,15 +1,25 @@
+import copy
 import json
 import logging
+import os
 import subprocess
+import tempfile
+import threading
+import time
 from functools import lru_cache
 from json import JSONDecodeError
 from os.path import exists
 
 import common
 from common import CUBIE_SYSTEM
+from common.metrics import SUBPROCESS_SPAWNS
 
 USER_MESSAGE_SHOULD_BE_SHOWN = True
 
+_configuration_cache = {}
+_configuration_cache_lock = threading.Lock()
+_configuration_cache_max_age = None
+
 CONFIG_DICT = {
     common.CUBIE_SYSTEM: common.DEFAULT_CONFIGURATION_FILE_CUBIEMEDIA,
     common.CUBIE_SERIAL: common.DEFAULT_CONFIGURATION_FILE_SERIAL,
@@ -23,10 +33,14 @@ CONFIG_DICT = {
 }
 
 
-def exit_gracefully(system, *args):
+def exit_gracefully(system, *args, metrics_reporter=None):
     logging.info("... shutdown mqtt client")
     system.RUN = False
+    system.notify_update()
 
+    if metrics_reporter:
+        # the last stats have to be published while the client is still connected
+        metrics_reporter.stop()
     system.shutdown()
     if system.mqtt_client:
         logging.info('... stopping MQTT Client...')
@@ -34,6 +48,7 @@ def exit_gracefully(system, *args):
 
 
 def execute_command(command: []) -> str:
+    SUBPROCESS_SPAWNS.inc()
     try:
         result = subprocess.check_output(command, stderr=subprocess.STDOUT).decode()
 
@@ -66,8 +81,7 @@ def get_config_file_for(config_name: str) -> str:
     return CONFIG_DICT.get(config_name, f"Missing Config File for [{config_name}]")
 
 
-def get_default_configuration_for(config_name: str) -> str:
-    logging.debug('... get default configuration from config file for [%s]', config_name)
+def find_config_file(config_name: str) -> str:
     config_file = get_config_file_for(config_name)
 
     if not exists(config_file):
@@ -76,9 +90,16 @@ def get_default_configuration_for(config_name: str) -> str:
             config_file = "../" + config_file
             if not exists(config_file):
                 raise FileNotFoundError(f"could not find config file [{config_file}]")
+    return config_file
+
+
+def get_default_configuration_for(config_name: str) -> str:
+    logging.debug('... get default configuration from config file for [%s]', config_name)
+    config_file = find_config_file(config_name)
+
     try:
-        file = open(config_file, encoding='utf-8')
-        config = json.load(file)
+        with open(config_file, encoding='utf-8') as file:
+            config = json.load(file)
     except JSONDecodeError:
         config = []
     return config
@@ -86,19 +107,51 @@ def get_default_configuration_for(config_name: str) -> str:
 
 def set_default_configuration(config_name: str, config: []):
     logging.debug('... set default configuration to config file for [%s]', config_name)
-    config_file = get_config_file_for(config_name)
+    config_file = find_config_file(config_name)
 
-    if not exists(config_file):
-        config_file = "../" + config_file
-        if not exists(config_file):
-            config_file = "../" + config_file
-            if not exists(config_file):
-                raise FileNotFoundError(("could not find config file [%s]", config_file))
-    with open(config_file, 'w', encoding='utf-8') as file:
-        json.dump(config, file, indent=2, sort_keys=True)
+    # write to a temporary file next to the config file and rename it, readers never see half a file
+    file_name = os.path.basename(config_file)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(os.path.abspath(config_file)),
+                                     prefix=f".{file_name}.", suffix=".tmp", delete=False) as file:
+        try:
+            json.dump(config, file, indent=2, sort_keys=True)
+            file.flush()
+            os.fsync(file.fileno())
+            os.chmod(file.name, os.stat(config_file).st_mode & 0o777)
+        except BaseException:
+            file.close()
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, config_file)
 
 
 def get_configuration(config_name: str) -> []:
+    with _configuration_cache_lock:
+        entry = _configuration_cache.get(config_name)
+
+    if entry is None or not _is_cached_configuration_valid(entry):
+        value, config_file = _load_configuration(config_name)
+        entry = _cache_configuration(config_name, value, config_file)
+    # every caller gets its own copy, the cached value must not be changed from outside
+    return json.loads(entry['value'])
+
+
+def invalidate_configuration(config_name: str = None):
+    with _configuration_cache_lock:
+        if config_name is None:
+            logging.debug('... invalidate all cached configurations')
+            _configuration_cache.clear()
+        else:
+            _configuration_cache.pop(config_name, None)
+
+
+def set_configuration_cache_max_age(max_age: float = None):
+    # seconds a configuration from snap is served from memory, None keeps it until invalidated
+    global _configuration_cache_max_age
+    _configuration_cache_max_age = max_age
+
+
+def _load_configuration(config_name: str) -> (str, str):
     value = execute_command(["snapctl", "get", "-d", config_name]).strip()
     if 'error' in value:
         value = execute_command(["snap", "get", "-d", "cubiemedia-mqtt-client", config_name])
@@ -108,9 +161,41 @@ def get_configuration(config_name: str) -> []:
             "%sseems to be a non snap environment, could not load config [%s]\n"
             "Try to install Snap locally to create config or login to Ubuntu with [snap login]%s",
             common.COLOR_YELLOW, config_name, common.COLOR_DEFAULT)
-        return get_default_configuration_for(config_name)
-    else:
-        return json.loads(value)
+        logging.debug('... get default configuration from config file for [%s]', config_name)
+        config_file = find_config_file(config_name)
+        with open(config_file, encoding='utf-8') as file:
+            value = file.read()
+        try:
+            json.loads(value)
+        except JSONDecodeError:
+            value = "[]"
+        return value, config_file
+
+    json.loads(value)
+    return value, None
+
+
+def _cache_configuration(config_name: str, value: str, config_file: str = None) -> {}:
+    entry = {'value': value, 'file': config_file, 'loaded': time.time(),
+             'modified': _get_modification_stamp(config_file) if config_file else None}
+    with _configuration_cache_lock:
+        _configuration_cache[config_name] = entry
+    return entry
+
+
+def _is_cached_configuration_valid(entry: {}) -> bool:
+    if entry['file']:
+        # non snap environment, watch the json file for changes from other processes
+        return entry['modified'] is not None and _get_modification_stamp(entry['file']) == entry['modified']
+    return _configuration_cache_max_age is None or time.time() - entry['loaded'] < _configuration_cache_max_age
+
+
+def _get_modification_stamp(config_file: str):
+    try:
+        stat = os.stat(config_file)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
 
 
 def get_mqtt_configuration() -> {}:
@@ -128,12 +213,112 @@ def get_system_configuration() -> {}:
 
 
 def set_configuration(config_name: str, config: []):
-    result = execute_command(["snapctl", "set", f"{config_name}={json.dumps(config)}"])
+    value = json.dumps(config)
+    result = execute_command(["snapctl", "set", f"{config_name}={value}"])
     if 'error' in result:
         result = execute_command(
-            ["snap", "set", "cubiemedia-mqtt-client", f"{config_name}={json.dumps(config)}"])
+            ["snap", "set", "cubiemedia-mqtt-client", f"{config_name}={value}"])
     if 'error' in result:
         set_default_configuration(config_name, config)
+        # the file is read again (and watched) on next access
+        invalidate_configuration(config_name)
+    else:
+        _cache_configuration(config_name, value)
+
+
+class ConfigurationWriter:
+    """Write behind persistence for configurations.
+
+    Changes are coalesced per configuration and written in a background thread after no change
+    happened for [delay] seconds, but at the latest [max_delay] seconds after the first change.
+    The configuration is copied when it is scheduled, later changes need another schedule. Writes are
+    serialized, flush returns after a write which was already running is done.
+    """
+
+    def __init__(self, delay: float = common.TIMEOUT_SAVE_CONFIGURATION, max_delay: float = None):
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending = {}
+        self._condition = threading.Condition()
+        # taken before the condition, entries are popped and written under it, so an older snapshot can
+        # not be written after a newer one
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, config_name: str, config: []):
+        with self._condition:
+            # the systems keep changing their configuration while the writer serializes it
+            config = copy.deepcopy(config)
+            now = time.time()
+            if config_name in self._pending:
+                self._pending[config_name]['config'] = config
+                self._pending[config_name]['changed'] = now
+            else:
+                self._pending[config_name] = {'config': config, 'first_change': now, 'changed': now}
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def flush(self, config_name: str = None):
+        with self._write_lock:
+            for name, entry in self._pop(config_name).items():
+                self._write(name, entry)
+
+    def discard(self, config_name: str = None):
+        # e.g. the configuration was changed by the webtool and is loaded again
+        with self._write_lock:
+            pending = self._pop(config_name)
+        if pending:
+            logging.info(f"... discarding pending configuration writes [{', '.join(pending)}]")
+
+    def has_pending(self, config_name: str = None) -> bool:
+        with self._condition:
+            return len(self._pending) > 0 if config_name is None else config_name in self._pending
+
+    def _pop(self, config_name: str = None) -> {}:
+        with self._condition:
+            if config_name is None:
+                pending = self._pending
+                self._pending = {}
+            elif config_name in self._pending:
+                pending = {config_name: self._pending.pop(config_name)}
+            else:
+                pending = {}
+        return pending
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._pending) == 0:
+                    self._condition.wait()
+
+                now = time.time()
+                due = {name: self._get_due_time(entry) for name, entry in self._pending.items()}
+                if min(due.values()) > now:
+                    self._condition.wait(min(due.values()) - now)
+                    continue
+
+            with self._write_lock:
+                with self._condition:
+                    # flush or discard could have taken the entries in the meantime
+                    now = time.time()
+                    pending = {name: self._pending.pop(name) for name, entry in list(self._pending.items())
+                               if self._get_due_time(entry) <= now}
+                for name, entry in pending.items():
+                    self._write(name, entry)
+
+    def _get_due_time(self, entry: {}) -> float:
+        max_delay = self.max_delay if self.max_delay is not None else self.delay * 10
+        return min(entry['changed'] + self.delay, entry['first_change'] + max_delay)
+
+    def _write(self, config_name: str, entry: {}):
+        logging.debug(f"... writing configuration [{config_name}]")
+        try:
+            set_configuration(config_name, entry['config'])
+        except OSError as e:
+            logging.error(f"could not write configuration [{config_name}]: {e}")
 
 
 @lru_cache(10)
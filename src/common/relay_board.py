@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import logging
+import threading
+import time
+from xml.parsers import expat
+
+import requests
+
+from common import RELAY_USERNAME, RELAY_PASSWORD, RELAY_CONNECT_TIMEOUT, RELAY_READ_TIMEOUT, RELAY_BACKOFF, \
+    RELAY_MAX_BACKOFF, STATE_UNKNOWN, RELAY_COMMAND_WINDOW
+from common.timers import TimerScheduler
+
+RESPONSE_TAG = "response"
+RELAY_TAG = "relay"
+DIGITAL_INPUT_TAG = "input"
+ANALOG_INPUT_TAG = "ad"
+STATUS_CHUNK_SIZE = 512
+
+
+class StatusError(ValueError):
+    pass
+
+
+class RelayStatus:
+    """Relays, digital inputs and analog inputs reported by status.xml, keyed by their index."""
+
+    def __init__(self):
+        self.relays = {}
+        self.digital_inputs = {}
+        self.analog_inputs = {}
+
+
+class StatusParser:
+    """Parses status.xml incrementally while the response bytes arrive.
+
+    The document has to be well-formed with <response> as root, values of unknown elements are ignored.
+    """
+
+    def __init__(self):
+        self.status = RelayStatus()
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text
+        self._depth = 0
+        self._has_root = False
+        self._value = ""
+
+    def feed(self, data: bytes):
+        self._parse(data, False)
+
+    def close(self) -> RelayStatus:
+        self._parse(b"", True)
+        if not self._has_root:
+            raise StatusError("status without <response>")
+        return self.status
+
+    def _parse(self, data: bytes, final: bool):
+        try:
+            self._parser.Parse(data, final)
+        except expat.ExpatError as e:
+            raise StatusError(f"malformed status: {e}") from e
+
+    def _start(self, tag: str, attributes: dict):
+        self._depth += 1
+        if self._depth == 1:
+            if tag != RESPONSE_TAG:
+                raise StatusError(f"unexpected root <{tag}>")
+            self._has_root = True
+        elif self._depth > 2:
+            raise StatusError(f"unexpected nested <{tag}>")
+        self._value = ""
+
+    def _text(self, data: str):
+        self._value += data
+
+    def _end(self, tag: str):
+        self._depth -= 1
+        if self._depth == 1:
+            self._add_value(tag, self._value.strip())
+
+    def _add_value(self, tag: str, value: str):
+        prefix = tag.rstrip("0123456789")
+        index = tag[len(prefix):]
+        if not index:
+            return
+        if prefix == RELAY_TAG:
+            if value == "1" or value == "0":
+                self.status.relays[index] = value
+            else:
+                self.status.relays[index] = STATE_UNKNOWN
+                logging.warning("... ... WARN: state [%s] unknown" % value)
+        elif prefix == DIGITAL_INPUT_TAG:
+            self.status.digital_inputs[index] = value if value in ("0", "1") else STATE_UNKNOWN
+        elif prefix == ANALOG_INPUT_TAG:
+            try:
+                self.status.analog_inputs[index] = int(value)
+            except ValueError:
+                logging.warning(f"... ... WARN: analog input [{tag}] with value [{value}]")
+
+
+def parse_status(content: bytes) -> RelayStatus:
+    parser = StatusParser()
+    parser.feed(content)
+    return parser.close()
+
+
+def get_command(relay_id, state, toggle: bool = False) -> str:
+    command = "DOA" if state == b'1' or str(state) == "1" else "DOI"
+    command += str(relay_id)
+    if toggle:
+        command += '=30'  # + str(int(toggle) * 10)
+    return command
+
+
+class CommandCoalescer:
+    """Collects the commands for a board which arrive within the window and hands them over at once.
+
+    A later command for the same relay replaces an earlier one, toggles are all kept. flush is
+    called on the scheduler thread with the board and its commands.
+    """
+
+    def __init__(self, flush, scheduler: TimerScheduler, window: float = RELAY_COMMAND_WINDOW):
+        self.flush = flush
+        self.scheduler = scheduler
+        self.window = window
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, ip, relay_id, state, toggle: bool = False):
+        command = (relay_id, state, toggle)
+        with self._lock:
+            commands = self.pending.get(ip)
+            if commands is None:
+                self.pending[ip] = [command]
+                self.scheduler.schedule(self.window, self._flush, ip)
+                return
+            if not toggle:
+                commands[:] = [pending for pending in commands
+                               if pending[2] or str(pending[0]) != str(relay_id)]
+            commands.append(command)
+
+    def _flush(self, ip):
+        with self._lock:
+            commands = self.pending.pop(ip, None)
+        if commands:
+            self.flush(ip, commands)
+
+
+class RelayBoard:
+    """HTTP client of one ETH008 relay board.
+
+    The connection is kept alive between requests. Requests are serialized per board, a board which
+    does not answer is not asked again until its backoff is over.
+    """
+
+    def __init__(self, ip: str, timeout: tuple = (RELAY_CONNECT_TIMEOUT, RELAY_READ_TIMEOUT),
+                 backoff: float = RELAY_BACKOFF, max_backoff: float = RELAY_MAX_BACKOFF):
+        self.ip = str(ip)
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.retry_at = 0.0
+        self.session = requests.Session()
+        self.session.auth = (RELAY_USERNAME, RELAY_PASSWORD)
+        self.status = None
+        self._lock = threading.Lock()
+
+    def is_available(self, now: float = None) -> bool:
+        return (time.monotonic() if now is None else now) >= self.retry_at
+
+    def read_status(self) -> dict:
+        # relays of the board, the whole status is kept in status
+        with self._lock:
+            response = self._request("/status.xml", stream=True)
+            parser = StatusParser()
+            try:
+                for chunk in response.iter_content(STATUS_CHUNK_SIZE):
+                    parser.feed(chunk)
+                self.status = parser.close()
+            except (requests.RequestException, StatusError):
+                self._failed()
+                raise
+            finally:
+                response.close()
+        return self.status.relays
+
+    def set_status(self, relay_id, state, toggle: bool = False):
+        self._get("/io.cgi?" + get_command(relay_id, state, toggle))
+
+    def set_statuses(self, commands: list, combine: bool = False):
+        # (relay_id, state, toggle) commands in one io.cgi request if the firmware accepts that,
+        # otherwise one after the other over the kept alive connection
+        with self._lock:
+            if combine:
+                self._request("/io.cgi?" + "&".join(get_command(*command) for command in commands))
+            else:
+                for command in commands:
+                    self._request("/io.cgi?" + get_command(*command))
+
+    def close(self):
+        self.session.close()
+
+    def _get(self, path: str) -> requests.Response:
+        with self._lock:
+            return self._request(path)
+
+    def _request(self, path: str, stream: bool = False) -> requests.Response:
+        response = None
+        try:
+            response = self.session.get(f"http://{self.ip}{path}", timeout=self.timeout, stream=stream)
+            # e.g. 401 after the password of the board was changed
+            response.raise_for_status()
+        except requests.RequestException:
+            if response is not None:
+                response.close()
+            self._failed()
+            raise
+        self.failures = 0
+        self.retry_at = 0.0
+        return response
+
+    def _failed(self):
+        self.failures += 1
+        self.retry_at = time.monotonic() + min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import logging
+import os
+import queue
+import selectors
+import threading
+import time
+
+
+class UpdateScheduler:
+    """Blocks the main loop until a system reports work.
+
+    A system is ready when another thread called notify() (e.g. a queue received data), when one of
+    its file descriptors became readable or when its next update deadline has been reached.
+    """
+
+    def __init__(self):
+        self._selector = None
+        self._wakeup_reader = None
+        self._wakeup_writer = None
+        self._notified = threading.Event()
+        self._file_descriptors = set()
+
+    def notify(self):
+        self._notified.set()
+        wakeup_writer = self._wakeup_writer
+        if wakeup_writer is not None:
+            try:
+                os.write(wakeup_writer, b'\x00')
+            except OSError:
+                # pipe is full or closed, the notified flag is enough in both cases
+                pass
+
+    def wait(self, deadline: float, file_descriptors=()) -> list:
+        if self._selector is None:
+            self._open()
+        self._register(file_descriptors)
+
+        timeout = 0 if self._notified.is_set() else max(0.0, deadline - time.time())
+        ready = []
+        for key, _ in self._selector.select(timeout):
+            if key.fileobj == self._wakeup_reader:
+                self._drain()
+            else:
+                ready.append(key.fileobj)
+        self._notified.clear()
+        return ready
+
+    def close(self):
+        if self._selector is not None:
+            wakeup_reader, wakeup_writer = self._wakeup_reader, self._wakeup_writer
+            self._wakeup_reader = self._wakeup_writer = None
+            self._selector.close()
+            self._selector = None
+            self._file_descriptors = set()
+            os.close(wakeup_reader)
+            os.close(wakeup_writer)
+
+    def _open(self):
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = os.pipe()
+        os.set_blocking(self._wakeup_reader, False)
+        os.set_blocking(self._wakeup_writer, False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+
+    def _register(self, file_descriptors):
+        wanted = set(file_descriptors)
+        for file_descriptor in self._file_descriptors - wanted:
+            try:
+                self._selector.unregister(file_descriptor)
+            except (KeyError, ValueError, OSError):
+                pass
+        for file_descriptor in wanted - self._file_descriptors:
+            try:
+                self._selector.register(file_descriptor, selectors.EVENT_READ)
+            except (KeyError, ValueError, OSError) as e:
+                logging.debug(f"... ... could not watch file descriptor [{file_descriptor}]: {e}")
+                wanted.discard(file_descriptor)
+        self._file_descriptors = wanted
+
+    def _drain(self):
+        try:
+            while os.read(self._wakeup_reader, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class NotifyingQueue(queue.Queue):
+    """Queue that calls the given callback whenever an item has been put into it."""
+
+    def __init__(self, callback, maxsize=0):
+        super().__init__(maxsize)
+        self._callback = callback
+        self.max_depth = 0
+
+    def _put(self, item):
+        super()._put(item)
+        if len(self.queue) > self.max_depth:
+            self.max_depth = len(self.queue)
+        self._callback()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class ScheduledTimer:
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline: float, callback, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerScheduler:
+    """Runs delayed callbacks for all channels on one shared thread.
+
+    Timers are kept in a heap ordered by their deadline, cancelled timers stay in the heap and are
+    skipped when they are due. Callbacks run on the scheduler thread and must not block.
+    """
+
+    def __init__(self, name: str = "timer-scheduler"):
+        self.name = name
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = True
+
+    def schedule(self, delay: float, callback, *args) -> ScheduledTimer:
+        timer = ScheduledTimer(time.monotonic() + delay, callback, args)
+        with self._condition:
+            if not self._running:
+                timer.cancel()
+                return timer
+            heapq.heappush(self._heap, (timer.deadline, next(self._sequence), timer))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            elif self._heap[0][2] is timer:
+                # new earliest deadline, wake up the thread to shorten its wait
+                self._condition.notify()
+        return timer
+
+    def pending(self) -> int:
+        with self._condition:
+            return sum(1 for _, _, timer in self._heap if not timer.cancelled)
+
+    def shutdown(self):
+        with self._condition:
+            self._running = False
+            self._heap.clear()
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                timer = self._next_due()
+                if timer is None:
+                    return
+
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logging.error(f"... ... timer [{getattr(timer.callback, '__name__', timer.callback)}] failed: {e}")
+
+    def _next_due(self):
+        while self._running:
+            if not self._heap:
+                self._condition.wait()
+                continue
+            deadline, _, timer = self._heap[0]
+            if timer.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                self._condition.wait(remaining)
+                continue
+            heapq.heappop(self._heap)
+            return timer
+        return None
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import logging
+import threading
+
+SINGLE_LEVEL_WILDCARD = '+'
+MULTI_LEVEL_WILDCARD = '#'
+MATCH_CACHE_SIZE = 4096
+
+
+class _Node:
+    __slots__ = ('children', 'handlers')
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+class TopicRouter:
+    """Dispatches mqtt messages to the handlers registered for matching topic filters.
+
+    Topic filters are stored in a trie with one level per topic level, '+' and '#' work like on
+    the broker. The handlers found for a topic are cached, so a known topic costs one dict lookup.
+    Handlers are called with the topic levels as tuple and the raw payload.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def add(self, topic_filter: str, handler):
+        with self._lock:
+            node = self._root
+            for level in topic_filter.split('/'):
+                node = node.children.setdefault(level, _Node())
+            if handler not in node.handlers:
+                node.handlers.append(handler)
+            self._cache = {}
+
+    def remove(self, topic_filter: str, handler=None):
+        with self._lock:
+            node = self._root
+            for level in topic_filter.split('/'):
+                node = node.children.get(level)
+                if node is None:
+                    return
+            if handler is None:
+                node.handlers.clear()
+            elif handler in node.handlers:
+                node.handlers.remove(handler)
+            self._cache = {}
+
+    def clear(self):
+        with self._lock:
+            self._root = _Node()
+            self._cache = {}
+
+    def match(self, topic: str) -> tuple:
+        cached = self._cache.get(topic)
+        if cached is not None:
+            return cached
+
+        path = tuple(topic.split('/'))
+        handlers = []
+        with self._lock:
+            self._collect(self._root, path, 0, handlers)
+            cached = (path, tuple(handlers))
+            if len(self._cache) >= MATCH_CACHE_SIZE:
+                self._cache = {}
+            self._cache[topic] = cached
+        return cached
+
+    def dispatch(self, topic: str, payload: bytes) -> bool:
+        path, handlers = self.match(topic)
+        for handler in handlers:
+            try:
+                handler(path, payload)
+            except Exception as e:
+                logging.error(f"... ... handler for topic [{topic}] failed: {e}")
+        return len(handlers) > 0
+
+    def _collect(self, node: _Node, path: tuple, position: int, handlers: list):
+        if position == 0 and path[0].startswith('$'):
+            # wildcards do not match system topics like $SYS
+            child = node.children.get(path[0])
+            if child is not None:
+                self._collect(child, path, 1, handlers)
+            return
+
+        multi_level = node.children.get(MULTI_LEVEL_WILDCARD)
+        if multi_level is not None:
+            # '#' includes the parent level, 'a/#' also matches 'a'
+            handlers.extend(multi_level.handlers)
+        if position == len(path):
+            handlers.extend(node.handlers)
+            return
+
+        level = path[position]
+        child = node.children.get(level)
+        if child is not None:
+            self._collect(child, path, position + 1, handlers)
+        single_level = node.children.get(SINGLE_LEVEL_WILDCARD)
+        if single_level is not None:
+            self._collect(single_level, path, position + 1, handlers)
@@ -4,12 +4,12 @@ import argparse
 import logging
 import signal
 import sys
-import time
 import warnings
 from argparse import ArgumentParser
 from functools import partial
 
 import common
+from common.metrics import instrument, MetricsReporter
 from common.python import exit_gracefully
 
 
@@ -81,12 +81,15 @@ def main(arguments):
         logging.info("Starting Cubie MQTT Client with mode [%s]", arguments.mode)
 
         system = get_system(arguments.mode)
+        instrument(system)
         system.init()
+        metrics_reporter = MetricsReporter(system)
+        metrics_reporter.start()
 
         # noinspection PyTypeChecker
-        signal.signal(signal.SIGINT, partial(exit_gracefully, system))
+        signal.signal(signal.SIGINT, partial(exit_gracefully, system, metrics_reporter=metrics_reporter))
         # noinspection PyTypeChecker
-        signal.signal(signal.SIGTERM, partial(exit_gracefully, system))
+        signal.signal(signal.SIGTERM, partial(exit_gracefully, system, metrics_reporter=metrics_reporter))
 
         system.RUN = True
         while system.RUN:
@@ -97,8 +100,9 @@ def main(arguments):
                 for device in devices:
                     system.action(device)
 
-            time.sleep(.2)
+            system.wait_for_update()
 
+        system.scheduler.close()
         logging.info('all done, exit program')
     except RuntimeError as exception:
         logging.error(exception)
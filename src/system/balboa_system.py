@@ -1,18 +1,20 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
-import json
 import logging
 import socket
 import threading
 import time
+from collections import deque
 
 from common import MQTT_CUBIEMEDIA, TIMEOUT_UPDATE_AVAILABILITY, CUBIE_TYPE, QOS, \
-    MQTT_HOMEASSISTANT_PREFIX, CUBIE_BALBOA, TIMEOUT_UPDATE_SPA
+    MQTT_HOMEASSISTANT_PREFIX, CUBIE_BALBOA, BALBOA_PORT, BALBOA_READ_TIMEOUT, BALBOA_RATE_LIMIT_KEY
+from common.balboa import SpaConnection, StatusDecoder, STATUS_UPDATE, LIGHT_1, PUMP_1, BLOWER, TEMPERATURE_RANGE, \
+    encode_toggle, encode_temperature
 from common.homeassistant import MQTT_NAME, MQTT_COMMAND_TOPIC, MQTT_STATE_TOPIC, \
     MQTT_AVAILABILITY_TOPIC, \
     MQTT_UNIQUE_ID, \
-    MQTT_DEVICE, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION, PAYLOAD_SENSOR, MQTT_TEMPERATURE, \
+    MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION, PAYLOAD_SENSOR, MQTT_TEMPERATURE, \
     MQTT_UNIT, MQTT_STATE_CLASS, MQTT_DEVICE_CLASS, MQTT_MEASUREMENT, MQTT_SWITCH, MQTT_LIGHT, \
     MQTT_CONFIG_TOPIC, \
     MQTT_BINARY_SENSOR, MQTT_SENSOR, PAYLOAD_SPECIAL_SENSOR, MQTT_UNIT_OF_MEASUREMENT, \
@@ -20,12 +22,12 @@ from common.homeassistant import MQTT_NAME, MQTT_COMMAND_TOPIC, MQTT_STATE_TOPIC
     MQTT_SUGGESTED_DISPLAY_PRECISION, MQTT_CLIMATE, PAYLOAD_SPA_ACTOR
 from system.base_system import BaseSystem
 
-VALID_PACKAGE_START = b'\xff\xaf\x13'
-
 BALBOA_READ_BYTE = "balboa_read_byte"
 BALBOA_WRITE_VALUE = "balboa_write_byte"
 BALBOA_READ_FORMULA = "balboa_read_formula"
 BALBOA_WRITE_FORMULA = "balboa_write_formula"
+# seconds in which a service is published at most once
+BALBOA_RATE_LIMIT = "balboa_rate_limit"
 
 DISCOVERY_MESSAGE = "DISCOVER_RELAIS_MODULE".encode()
 DESTINATION_ADDRESS = ('<broadcast>', 30303)
@@ -33,6 +35,9 @@ DESTINATION_ADDRESS = ('<broadcast>', 30303)
 TEMPERATURE_RANGE_MAX = 40
 TEMPERATURE_RANGE_MIN = 10
 
+HEATING_MODES = ("ready", "rest", "ready_in_rest", None)
+PUMP_SPEEDS = ("off", "low", "high", None)
+
 
 def is_light_enable(value) -> int:
     return 1 if value & 0x03 != 0 else 0
@@ -58,49 +63,63 @@ def get_operation_mode(value) -> str:
     return 'heat' if (value & 0x04 != 0) else 'off'
 
 
+def is_priming(value) -> int:
+    return 1 if value & 0x01 != 0 else 0
+
+
+def get_heating_mode(value) -> str:
+    return HEATING_MODES[value & 0x03]
+
+
+def get_pump_1_speed(value) -> str:
+    return PUMP_SPEEDS[value & 0x03]
+
+
+def get_pump_2_speed(value) -> str:
+    return PUMP_SPEEDS[(value >> 2) & 0x03]
+
+
+def get_temperature_range(value) -> str:
+    return 'performance' if value & 0x04 != 0 else 'eco'
+
+
+def get_temperature_scale(value) -> str:
+    return '°C' if value & 0x01 != 0 else '°F'
+
+
+def get_time_scale(value) -> str:
+    return '24h' if value & 0x02 != 0 else '12h'
+
+
 def correct_value(value):
+    # half degrees celsius, 0xFF while the spa is priming
     temperature = float(value) / 2
     if TEMPERATURE_RANGE_MIN <= temperature <= TEMPERATURE_RANGE_MAX:
         return temperature
-    logging.warning(f"temperature value [{temperature}] out of range")
     return None
 
 
-def send_toggle_message(value):
-    # 0x04 - pump 1
-    # 0x05 - pump 2
-    # 0x0c - blower
-    # 0x11 - light 1
-    # 0x51 - heating mode
-    # 0x50 - operation mode
-    return b'\x0a\xbf\x11', bytes([value]) + b'\x00'
-
-
-def send_temp_value(value):
-    return b'\x0a\xbf\x20', bytes([value])
-
-
 SERVICES = {
     "light": {
         MQTT_CONFIG_TOPIC: MQTT_LIGHT,
         BALBOA_READ_BYTE: 14,
-        BALBOA_WRITE_VALUE: 0x11,
+        BALBOA_WRITE_VALUE: LIGHT_1,
         BALBOA_READ_FORMULA: is_light_enable,
-        BALBOA_WRITE_FORMULA: send_toggle_message
+        BALBOA_WRITE_FORMULA: encode_toggle
     },
     "jets": {
         MQTT_CONFIG_TOPIC: MQTT_SWITCH,
         BALBOA_READ_BYTE: 11,
-        BALBOA_WRITE_VALUE: 0x04,
+        BALBOA_WRITE_VALUE: PUMP_1,
         BALBOA_READ_FORMULA: is_jets_enable,
-        BALBOA_WRITE_FORMULA: send_toggle_message
+        BALBOA_WRITE_FORMULA: encode_toggle
     },
     "blower": {
         MQTT_CONFIG_TOPIC: MQTT_SWITCH,
         BALBOA_READ_BYTE: 13,
-        BALBOA_WRITE_VALUE: 0x0c,
+        BALBOA_WRITE_VALUE: BLOWER,
         BALBOA_READ_FORMULA: is_blower_enable,
-        BALBOA_WRITE_FORMULA: send_toggle_message
+        BALBOA_WRITE_FORMULA: encode_toggle
     },
     "circulation_pump": {
         MQTT_CONFIG_TOPIC: MQTT_BINARY_SENSOR,
@@ -115,9 +134,9 @@ SERVICES = {
     "temperature_control": {
         MQTT_CONFIG_TOPIC: MQTT_CLIMATE,
         BALBOA_READ_BYTE: 10,
-        BALBOA_WRITE_VALUE: 0x50,
+        BALBOA_WRITE_VALUE: TEMPERATURE_RANGE,
         BALBOA_READ_FORMULA: get_operation_mode,
-        BALBOA_WRITE_FORMULA: send_toggle_message,
+        BALBOA_WRITE_FORMULA: encode_toggle,
     },
     "current_temperature": {
         MQTT_CONFIG_TOPIC: MQTT_SENSOR,
@@ -126,7 +145,8 @@ SERVICES = {
         MQTT_SUGGESTED_DISPLAY_PRECISION: 1,
         MQTT_STATE_CLASS: MQTT_MEASUREMENT,
         MQTT_DEVICE_CLASS: MQTT_TEMPERATURE,
-        BALBOA_READ_FORMULA: correct_value
+        BALBOA_READ_FORMULA: correct_value,
+        BALBOA_RATE_LIMIT: 60
     },
     "target_temperature": {
         MQTT_CONFIG_TOPIC: MQTT_SENSOR,
@@ -136,10 +156,87 @@ SERVICES = {
         MQTT_STATE_CLASS: MQTT_MEASUREMENT,
         MQTT_DEVICE_CLASS: MQTT_TEMPERATURE,
         BALBOA_READ_FORMULA: correct_value,
-        BALBOA_WRITE_FORMULA: send_temp_value,
+        BALBOA_WRITE_FORMULA: encode_temperature,
+    },
+    "priming": {
+        MQTT_CONFIG_TOPIC: MQTT_BINARY_SENSOR,
+        BALBOA_READ_BYTE: 1,
+        BALBOA_READ_FORMULA: is_priming,
+    },
+    "heating_mode": {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        BALBOA_READ_BYTE: 5,
+        BALBOA_READ_FORMULA: get_heating_mode,
+    },
+    "pump_1": {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        BALBOA_READ_BYTE: 11,
+        BALBOA_READ_FORMULA: get_pump_1_speed,
+    },
+    "pump_2": {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
+        BALBOA_READ_BYTE: 11,
+        BALBOA_READ_FORMULA: get_pump_2_speed,
+    },
+    "clock": {
+        MQTT_CONFIG_TOPIC: MQTT_SENSOR,
     }
 }
 
+# every documented field of the status update, fields which are no service are only decoded
+STATUS_FIELDS = {
+    **{service: (attributes[BALBOA_READ_BYTE], attributes[BALBOA_READ_FORMULA])
+       for service, attributes in SERVICES.items() if BALBOA_READ_BYTE in attributes},
+    "hour": (3, int),
+    "minute": (4, int),
+    "temperature_scale": (9, get_temperature_scale),
+    "time_scale": (9, get_time_scale),
+    "temperature_range": (10, get_temperature_range),
+}
+STATUS_DECODER = StatusDecoder(STATUS_FIELDS)
+
+
+class ServiceRateLimiter:
+    """Publishes a changed service at most once within its rate limit.
+
+    A value changed within the limit is held back, the latest held value is released when the limit is
+    over unless the service went back to the published value in the meantime.
+    """
+
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self.published = {}
+        self.published_at = {}
+        self.held = {}
+
+    def filter(self, changes: dict, now: float) -> dict:
+        released = {}
+        for service, value in changes.items():
+            if now - self.published_at.get(service, float('-inf')) >= self.limits.get(service, 0):
+                released[service] = value
+            elif service not in self.published or value != self.published[service]:
+                self.held[service] = value
+            else:
+                self.held.pop(service, None)
+        self._publish(released, now)
+        return released
+
+    def release(self, now: float) -> dict:
+        released = {service: value for service, value in self.held.items()
+                    if now - self.published_at[service] >= self.limits[service]}
+        self._publish(released, now)
+        return released
+
+    def next_release(self) -> float:
+        return min((self.published_at[service] + self.limits[service] for service in self.held),
+                   default=float('inf'))
+
+    def _publish(self, released: dict, now: float):
+        for service, value in released.items():
+            self.published[service] = value
+            self.published_at[service] = now
+            self.held.pop(service, None)
+
 
 class BalboaSystem(BaseSystem):
     _spa_dict = {}
@@ -149,26 +246,28 @@ class BalboaSystem(BaseSystem):
     _scan_thread_event = threading.Event()
     _discovery_socket = None
 
-    _error_message_shown = False
-
     def __init__(self):
         self.execution_mode = CUBIE_BALBOA
+        self.events = deque()
+        # status updates decoded by the spa workers, applied to the known state on the main loop
+        self.status_updates = deque()
+        self._workers_event = threading.Event()
         super().__init__()
 
     def action(self, device: {}) -> bool:
         if {'id', 'state'}.issubset(device):
-            for known_device in self.config:
-                if device['id'] == known_device['id']:
-                    for service, value in device['state'].items():
-                        if service == 'temperature_control' and 'auto' in known_device['state'] and \
-                                known_device['state']['auto']:
-                            value = 'auto'
-
-                        logging.info(f"... ... action for Spa [{device['id']}] with service [{service}] -> [{value}]")
-                        self.mqtt_client.publish(
-                            f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device['id'].replace('.', '_')}/{service}",
-                            value, True)
-                    self.save()
+            known_device = self.config.get(device['id'])
+            if known_device is not None:
+                for service, value in device['state'].items():
+                    if service == 'temperature_control' and 'auto' in known_device['state'] and \
+                            known_device['state']['auto']:
+                        value = 'auto'
+
+                    logging.info(f"... ... action for Spa [{device['id']}] with service [{service}] -> [{value}]")
+                    self.mqtt_client.publish(
+                        f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device['id'].replace('.', '_')}/{service}",
+                        value, True)
+                self.save()
                 return True
         else:
             logging.warning(f"... received action with wrong data [{device}]")
@@ -180,10 +279,7 @@ class BalboaSystem(BaseSystem):
             attributes = SERVICES[service]
             new_state = data['state']
             spa_ip = data['ip']
-            known_device = None
-            for temp_device in self.config:
-                if spa_ip == temp_device['id']:
-                    known_device = temp_device
+            known_device = self.config.get(spa_ip)
             if known_device:
                 old_state = known_device['state'][service]
                 if service == "temperature_control":
@@ -191,30 +287,23 @@ class BalboaSystem(BaseSystem):
                         known_device['state']['auto'] = True
                     elif known_device['state']['auto']:
                         known_device['state']['auto'] = False
-                    self.last_update = 0
+                    # the mode is published as 'auto' while it is set, the spa itself does not change
+                    self.events.append((spa_ip, {service: old_state}))
+                    self.notify_update()
                 logging.info(f"... send service [{service}] - old state[{old_state}] -> new state[{new_state}]")
 
                 if new_state != old_state and 'auto' != new_state:
                     if BALBOA_WRITE_FORMULA in attributes:
                         if BALBOA_WRITE_VALUE in attributes:
-                            msg_type, payload = attributes[BALBOA_WRITE_FORMULA](
-                                attributes[BALBOA_WRITE_VALUE])
+                            message = attributes[BALBOA_WRITE_FORMULA](attributes[BALBOA_WRITE_VALUE])
                         else:
-                            msg_type, payload = attributes[BALBOA_WRITE_FORMULA](
-                                int(float(data['state']) * 2))
-                        length = 5 + len(payload)
-                        checksum = compute_checksum(bytes([length]), msg_type + payload)
-                        prefix = b'\x7e'
-                        message = prefix + bytes([length]) + msg_type + payload + bytes(
-                            [checksum]) + prefix
-
-                        spa_socket = self._get_spa_socket(spa_ip)
+                            message = attributes[BALBOA_WRITE_FORMULA](float(data['state']))
+                        # the effect arrives with the next status frame of the spa, a spa which is not
+                        # connected is left to its worker and the command is dropped
                         try:
-                            spa_socket.send(message)
+                            self._get_connection(spa_ip).send(message, connect=False)
                         except Exception as e:
-                            logging.error(f"could not send message to spa [{data}]", e)
-                        self._remove_socket(spa_ip)
-                        self.last_update = 0
+                            logging.error(f"could not send message to spa [{data}] [{e}]")
                     else:
                         logging.warning(
                             f"could not write value for data [{data}], no write schema defined")
@@ -230,57 +319,51 @@ class BalboaSystem(BaseSystem):
     def update(self):
         data = {}
 
-        if self.last_update < time.time() - TIMEOUT_UPDATE_SPA and len(self._spa_dict) > 0:
-            for spa_ip, values in self._spa_dict.items():
-                logging.info(f"... updating spa [{spa_ip}]")
-                known_device = None
-                for temp_device in self.config:
-                    if spa_ip == temp_device['id']:
-                        known_device = temp_device
-                        break
-
-                spa_json = {'id': str(spa_ip), CUBIE_TYPE: CUBIE_BALBOA,
-                            'client_id': self.client_id,
-                            'state': {}}
-                if known_device:
-                    try:
-                        spa_socket = self._get_spa_socket(spa_ip)
-                        len_chunk = spa_socket.recv(2)
-                        if len_chunk == b'' or len(len_chunk) == 0:
-                            return False
-                        length = len_chunk[1]
-                        if int(length) == 0:
-                            return False
-                        spa_data = spa_socket.recv(length)
-
-                        if spa_data and spa_data[0:3] == VALID_PACKAGE_START:
-                            spa_json['state'] = get_state_from(spa_data, known_device)
-
-                        self.mqtt_client.publish(
-                            f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{spa_ip.replace('.', '_')}/online", "true")
-                        self._error_message_shown = False
-
-                        data['devices'] = [spa_json]
-                        self._remove_socket(spa_ip)
-                    except Exception as e:
-                        if not self._error_message_shown:
-                            logging.error(
-                                f"Connection to {spa_ip} not possible [{e}], is something else connected to your Spa?")
-                            self._error_message_shown = True
-                        self.mqtt_client.publish(
-                            f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{spa_ip.replace('.', '_')}/online", "false")
-                        self._remove_socket(spa_ip)
+        if self.last_update < 0:
+            # spas found by the scan thread
+            for spa_ip in list(self._spa_dict):
+                if self.config.get(spa_ip) is None:
+                    self.save({'id': str(spa_ip), CUBIE_TYPE: CUBIE_BALBOA, 'client_id': self.client_id, 'state': {}})
+                    # not added while the system is locked
+                    if self.config.get(spa_ip) is not None:
+                        self.announce()
+                        self._start_worker(spa_ip)
+            self.last_update = time.time()
+
+        states = {}
+        while self.events:
+            spa_ip, changes = self.events.popleft()
+            states.setdefault(spa_ip, {}).update(changes)
+        now = time.time()
+        while self.status_updates:
+            spa_ip, status = self.status_updates.popleft()
+            changes = self._apply_status(spa_ip, status, now)
+            if changes:
+                states.setdefault(spa_ip, {}).update(changes)
+        for spa_ip, spa in list(self._spa_dict.items()):
+            if 'limiter' in spa:
+                released = spa['limiter'].release(now)
+                if released:
+                    states.setdefault(spa_ip, {}).update(released)
+
+        if states:
+            data['devices'] = [{'id': str(spa_ip), CUBIE_TYPE: CUBIE_BALBOA, 'client_id': self.client_id,
+                                'state': state} for spa_ip, state in states.items()]
+        return data
 
-                else:
-                    self.save(spa_json)
-                    self.announce()
+    def next_update(self) -> float:
+        if self.events or self.status_updates or self.last_update < 0:
+            return time.time()
+        return min([spa['limiter'].next_release() for spa in list(self._spa_dict.values()) if 'limiter' in spa] +
+                   [super().next_update()])
 
-                if self.last_update < 0:
-                    self.last_update = time.time() - int(TIMEOUT_UPDATE_SPA * 0.99)
-                else:
-                    self.last_update = time.time()
-
-        return data
+    def get_statistics(self) -> {}:
+        spas = list(self._spa_dict.values())
+        connections = [spa['connection'] for spa in spas if 'connection' in spa]
+        now = time.monotonic()
+        return {'spas_online': sum(1 for spa in spas if spa.get('online')),
+                'spas_in_backoff': sum(1 for connection in connections if connection.retry_at > now),
+                'spa_connects': sum(connection.connects for connection in connections)}
 
     def set_availability(self, state: bool):
         super().set_availability(state)
@@ -290,10 +373,10 @@ class BalboaSystem(BaseSystem):
                 str(state).lower())
 
     def init(self):
-        self.last_update = time.time() - int(TIMEOUT_UPDATE_SPA * 0.98)
+        # load starts a worker per known spa
+        self._workers_event = threading.Event()
         super().init()
 
-        socket.setdefaulttimeout(5)
         self._discovery_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._discovery_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         self._discovery_socket.settimeout(3)
@@ -312,6 +395,14 @@ class BalboaSystem(BaseSystem):
             self._scan_thread_event.set()
             self._scan_thread.join()
 
+        logging.info("... stopping spa workers...")
+        self._workers_event.set()
+        spas = list(self._spa_dict.items())
+        for spa_ip, _ in spas:
+            self._close_connection(spa_ip)
+        for _, spa in spas:
+            if 'worker' in spa:
+                spa['worker'].join()
         super().shutdown()
 
     def announce(self):
@@ -323,12 +414,7 @@ class BalboaSystem(BaseSystem):
         should_save = False
         if device:
             if device[CUBIE_TYPE] == CUBIE_BALBOA and self.system_config['devices_can_be_added']:
-                add = True
-                for known_device in self.config:
-                    if device['id'] == known_device['id']:
-                        add = False
-                        break
-                if add:
+                if self.config.get(device['id']) is None:
                     self.config.append(device)
                     should_save = True
         else:
@@ -339,10 +425,17 @@ class BalboaSystem(BaseSystem):
 
     def load(self):
         super().load()
-        self._spa_dict = {}
+        # the old workers end quietly once their spa is replaced, they are done before the new ones connect
+        spas, self._spa_dict = self._spa_dict, {}
+        for spa in spas.values():
+            if 'connection' in spa:
+                spa['connection'].close()
+        for spa in spas.values():
+            if 'worker' in spa:
+                spa['worker'].join()
         for device in self.config:
             self._spa_dict[device['id']] = {}
-        self.update()
+            self._start_worker(device['id'])
 
     def _run(self):
         self._scan_thread_event = threading.Event()
@@ -361,6 +454,7 @@ class BalboaSystem(BaseSystem):
                         logging.info(f"... ... found new spa [{address[0]}]")
                         self._spa_dict[address[0]] = {}
                         self.last_update = -1
+                        self.notify_update()
                         continue
                 else:
                     logging.debug(f"ignore unknown device [{buf}] with [{address}]")
@@ -372,46 +466,98 @@ class BalboaSystem(BaseSystem):
         self._discovery_socket.close()
         return True
 
-    def _get_spa_socket(self, spa_ip) -> socket.socket:
-        if spa_ip in self._spa_dict:
-            spa_socket = self._spa_dict[spa_ip]['socket'] if 'socket' in self._spa_dict[
-                spa_ip] else None
-            if spa_socket:
-                logging.debug(f"... ... reuse socket for spa [{self._spa_dict[spa_ip]}]")
-                return spa_socket
+    def _start_worker(self, spa_ip):
+        spa = self._spa_dict[spa_ip]
+        if 'worker' not in spa and not self._workers_event.is_set():
+            logging.info(f"... starting worker for spa [{spa_ip}]")
+            spa['worker'] = threading.Thread(target=self._read, args=(spa_ip, spa), daemon=True)
+            spa['worker'].start()
+
+    def _read(self, spa_ip, spa):
+        # worker of one spa, its timeouts and backoff do not hold up the other spas
+        # it ends on shutdown or when load replaced the spa
+        connection = self._get_connection(spa_ip)
+        while not self._workers_event.is_set() and self._spa_dict.get(spa_ip) is spa:
+            wait = connection.retry_at - time.monotonic()
+            if wait > 0:
+                self._workers_event.wait(min(wait, 1))
             else:
-                logging.debug(f"... ... creating new socket for spa [{spa_ip}]")
-                spa_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                spa_socket.connect((spa_ip, 4257))
-                self._spa_dict[spa_ip]['socket'] = spa_socket
-                if 'socket_count' in self._spa_dict[spa_ip]:
-                    self._spa_dict[spa_ip]['socket_count'] += 1
-                else:
-                    self._spa_dict[spa_ip]['socket_count'] = 1
-
-                return spa_socket
-        raise ValueError(f"Could not find Spa [{spa_ip}]")
+                self._read_spa(spa_ip, spa, connection)
+        connection.close()
+        return True
 
-    def _remove_socket(self, spa_ip):
-        if spa_ip in self._spa_dict:
-            if 'socket_count' in self._spa_dict[spa_ip]:
-                self._spa_dict[spa_ip]['socket_count'] -= 1
+    def _read_spa(self, spa_ip, spa, connection) -> bool:
+        try:
+            if not connection.read(STATUS_UPDATE, BALBOA_READ_TIMEOUT):
+                raise TimeoutError(f"no status update within {BALBOA_READ_TIMEOUT} seconds")
+            if not spa.get('online'):
+                logging.info(f"... ... spa [{spa_ip}] is online")
+                spa['online'] = True
+                self.mqtt_client.publish(
+                    f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{spa_ip.replace('.', '_')}/online", "true")
+            return True
+        except Exception as e:
+            if self._workers_event.is_set() or self._spa_dict.get(spa_ip) is not spa:
+                return False
+            if spa.get('online', True):
+                logging.error(f"Connection to {spa_ip} not possible [{e}], is something else connected to your Spa?")
+                spa['online'] = False
+                self.mqtt_client.publish(
+                    f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{spa_ip.replace('.', '_')}/online", "false")
             else:
-                self._spa_dict[spa_ip]['socket_count'] = 0
+                logging.debug(f"... ... spa [{spa_ip}] still not available [{e}], retry in "
+                              f"[{connection.retry_at - time.monotonic():.0f}] seconds")
+            return False
+
+    def _on_status(self, spa_ip, frame):
+        # runs on the worker of the spa, the known state and the limiter belong to the main loop
+        spa = self._spa_dict.get(spa_ip)
+        # the spa repeats the same status several times a second
+        if spa is None or frame.payload == spa.get('status'):
+            return
+        try:
+            status = decode_status(frame.payload)
+        except ValueError as e:
+            logging.debug(f"... ... ignoring status of spa [{spa_ip}] [{e}]")
+            return
+        spa['status'] = frame.payload
+        self.status_updates.append((spa_ip, status))
+        self.notify_update()
+
+    def _apply_status(self, spa_ip, status: dict, now: float) -> dict:
+        spa = self._spa_dict.get(spa_ip)
+        known_device = self.config.get(spa_ip)
+        if spa is None or known_device is None:
+            return {}
+        state = update_state(known_device, status)
+        if 'limiter' not in spa:
+            limits = {service: attributes[BALBOA_RATE_LIMIT] for service, attributes in SERVICES.items()
+                      if BALBOA_RATE_LIMIT in attributes}
+            limits.update(known_device.get(BALBOA_RATE_LIMIT_KEY, {}))
+            spa['limiter'] = ServiceRateLimiter(limits)
+        return spa['limiter'].filter(state, now)
+
+    def _get_connection(self, spa_ip) -> SpaConnection:
+        if spa_ip in self._spa_dict:
+            connection = self._spa_dict[spa_ip].get('connection')
+            if connection is None:
+                logging.debug(f"... ... creating connection for spa [{spa_ip}]")
+                connection = self._spa_dict[spa_ip]['connection'] = SpaConnection(spa_ip, BALBOA_PORT)
+                connection.on(STATUS_UPDATE, lambda frame: self._on_status(spa_ip, frame))
+            return connection
+        raise ValueError(f"Could not find Spa [{spa_ip}]")
 
-            if self._spa_dict[spa_ip]['socket_count'] <= 0:
-                spa_socket = self._spa_dict[spa_ip]['socket'] if 'socket' in self._spa_dict[spa_ip] else None
-                if spa_socket:
-                    logging.debug(f"... ... closing socket for spa [{spa_ip}]")
-                    del self._spa_dict[spa_ip]['socket']
-                    spa_socket.close()
+    def _close_connection(self, spa_ip):
+        connection = self._spa_dict.get(spa_ip, {}).get('connection')
+        if connection:
+            connection.close()
 
     def _announce_device(self, device):
         string_id = device['id'].replace('.', '_')
         device_name = f"Balboa Spa ({device['id']})"
         service_specific_command_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{string_id}/+/command"
         logging.info(f"... ... subscribe to channel [{service_specific_command_topic}]")
-        self.mqtt_client.subscribe(service_specific_command_topic, QOS)
+        self.mqtt_client.subscribe(service_specific_command_topic, QOS, self.on_command)
 
         logging.info("... ... announce spa [%s] with all actors and sensors", device['id'])
         availability_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{string_id}/online"
@@ -421,81 +567,58 @@ class BalboaSystem(BaseSystem):
             unique_id = f"spa-{string_id}-{service}"
             config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{attributes[MQTT_CONFIG_TOPIC]}/spa-{string_id}-{service}/config"
 
-            if attributes[MQTT_CONFIG_TOPIC] == MQTT_SENSOR:
-                payload = PAYLOAD_SPECIAL_SENSOR
-                payload[MQTT_SUGGESTED_DISPLAY_PRECISION] = attributes[
-                    MQTT_SUGGESTED_DISPLAY_PRECISION]
-                payload[MQTT_UNIT_OF_MEASUREMENT] = attributes[MQTT_UNIT]
-                payload[MQTT_STATE_CLASS] = attributes[MQTT_STATE_CLASS]
-                payload[MQTT_DEVICE_CLASS] = attributes[MQTT_DEVICE_CLASS]
-            elif attributes[MQTT_CONFIG_TOPIC] == MQTT_BINARY_SENSOR:
-                payload = PAYLOAD_SENSOR
+            entity = {
+                MQTT_NAME: service.replace('_', ' ').title(),
+                MQTT_STATE_TOPIC: state_topic,
+                MQTT_AVAILABILITY_TOPIC: availability_topic,
+                MQTT_UNIQUE_ID: unique_id
+            }
+            if attributes[MQTT_CONFIG_TOPIC] == MQTT_SENSOR and MQTT_UNIT in attributes:
+                template = PAYLOAD_SPECIAL_SENSOR
+                entity[MQTT_SUGGESTED_DISPLAY_PRECISION] = attributes[MQTT_SUGGESTED_DISPLAY_PRECISION]
+                entity[MQTT_UNIT_OF_MEASUREMENT] = attributes[MQTT_UNIT]
+                entity[MQTT_STATE_CLASS] = attributes[MQTT_STATE_CLASS]
+                entity[MQTT_DEVICE_CLASS] = attributes[MQTT_DEVICE_CLASS]
+            elif attributes[MQTT_CONFIG_TOPIC] in (MQTT_BINARY_SENSOR, MQTT_SENSOR):
+                # text sensors take the plain template, home assistant drops the payload on/off
+                template = PAYLOAD_SENSOR
             elif attributes[MQTT_CONFIG_TOPIC] == MQTT_CLIMATE:
-                payload = PAYLOAD_SPA_ACTOR
-                payload[MQTT_COMMAND_TOPIC] = state_topic + "/command"
+                template = PAYLOAD_SPA_ACTOR
+                spa_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{string_id}"
+                entity[MQTT_COMMAND_TOPIC] = state_topic + "/command"
+                entity["action_topic"] = f"{spa_topic}/heating"
+                entity["mode_command_topic"] = f"{spa_topic}/temperature_control/command"
+                entity["mode_state_topic"] = f"{spa_topic}/temperature_control"
+                entity["current_temperature_topic"] = f"{spa_topic}/current_temperature"
+                entity["temperature_state_topic"] = f"{spa_topic}/target_temperature"
+                entity["temperature_command_topic"] = f"{spa_topic}/target_temperature/command"
             else:
-                payload = PAYLOAD_SWITCH_ACTOR
-                payload[MQTT_COMMAND_TOPIC] = state_topic + "/command"
-
-            payload[MQTT_NAME] = service.replace('_', ' ').title()
-            payload[MQTT_STATE_TOPIC] = state_topic
-            payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-            payload[MQTT_UNIQUE_ID] = unique_id
-            payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = device[
-                'id']  # f"{self.execution_mode}-{string_id}"
-            payload[MQTT_DEVICE][MQTT_NAME] = device_name
-            payload[MQTT_DEVICE][MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
-
-            self.mqtt_client.publish(config_topic, json.dumps(payload), retain=True)
-
-    # unused still needed for documentation
-    def _handle_status_update(self, byte_array):
-        if 0x50 >= byte_array[2] >= 0x14:
-            self._current_temp = byte_array[2]
-        else:
-            # _LOGGER.warning(f"value out of range {byte_array[2]}")
-            return
-        self._priming = byte_array[1] & 0x01 == 1
-
-        self._hour = byte_array[3]
-        self._minute = byte_array[4]
-        self._heating_mode = \
-            ("Ready", "Rest", "Ready in Rest")[byte_array[5]]
-        time_scale = byte_array[9]
-        self._temp_scale = "°F" if (time_scale & 0x01 == 0) else "°C"
-        self._time_scale = "12 Hr" if (time_scale & 0x02 == 0) else "24 Hr"
-        self._heating = byte_array[10] & 0x30 != 0
-        self._temp_range = "eco" if (byte_array[10] & 0x04 == 0) else "performance"
-        pump_status = byte_array[11]
-        self._pump1 = ("Off", "Low", "High")[pump_status & 0x03]
-        self._pump2 = ("Off", "Low", "High")[pump_status & 0x12]
-        self._circulation_pump = byte_array[13] & 0x02 != 0
-        self._light = byte_array[14] & 0x03 != 0
-        self._target_temp = byte_array[20]
-
-
-def get_state_from(chunk, known_device):
-    response = chunk[3:]
-    service_json = {}
-    for service, attributes in SERVICES.items():
-        formula = attributes[BALBOA_READ_FORMULA]
-        data_byte = response[attributes[BALBOA_READ_BYTE]]
-        value = formula(data_byte)
-        if value is None:
-            value = known_device['state'][service]
-        if (service not in known_device['state'] or value != known_device['state'][service]
-                or service == 'temperature_control'):
-            service_json[service] = value
-            known_device['state'][service] = value
-    return service_json
+                template = PAYLOAD_SWITCH_ACTOR
+                entity[MQTT_COMMAND_TOPIC] = state_topic + "/command"
+
+            payload = self.discovery.render(template, entity, {
+                MQTT_DEVICE_IDS: device['id'],  # f"{self.execution_mode}-{string_id}"
+                MQTT_NAME: device_name,
+                MQTT_DEVICE_DESCRIPTION: f"via Gateway ({self.ip_address})"
+            })
+
+            self.publish_discovery(config_topic, payload)
+
 
+def decode_status(response) -> dict:
+    status = STATUS_DECODER.decode(response)
+    status['clock'] = f"{status['hour']:02d}:{status['minute']:02d}"
+    return status
 
-def compute_checksum(len_bytes, data):
-    import crc8
-    hash_value = crc8.crc8()
-    hash_value._sum = 0x02
-    hash_value.update(len_bytes)
-    hash_value.update(data)
-    checksum = hash_value.digest()[0]
-    checksum = checksum ^ 0x02
-    return checksum
+
+def get_state_from(response, known_device):
+    return update_state(known_device, decode_status(response))
+
+
+def update_state(known_device, status: dict) -> dict:
+    # services which changed against the known state, a service without a valid value keeps its state
+    state = known_device['state']
+    service_json = {service: status[service] for service in SERVICES
+                    if status[service] is not None and status[service] != state.get(service)}
+    state.update(service_json)
+    return service_json
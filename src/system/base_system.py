@@ -1,15 +1,20 @@
 import abc
-import json
+import hashlib
 import logging
+import os
+import time
 
-from common import MQTT_CUBIEMEDIA, MQTT_HOMEASSISTANT_PREFIX, CUBIE_ENOCEAN, CUBIE_RELAY, QOS
+from common import MQTT_CUBIEMEDIA, MQTT_HOMEASSISTANT_PREFIX, CUBIE_ENOCEAN, CUBIE_RELAY, QOS, \
+    TIMEOUT_UPDATE_IDLE, SAVE_DELAY, TIMEOUT_SAVE_CONFIGURATION, OFFLINE_SPILL_FILE, PUBLISH_REFRESH, \
+    TIMEOUT_PUBLISH_REFRESH
 from common.homeassistant import MQTT_BUTTON, PAYLOAD_BUTTON, MQTT_NAME, MQTT_AVAILABILITY_TOPIC, \
     MQTT_COMMAND_TOPIC, MQTT_UNIQUE_ID, \
-    MQTT_DEVICE, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION
-from common.mqtt_client_wrapper import CubieMediaMQTTClient
+    MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION, DiscoveryPayloadBuilder
+from common.mqtt_client_wrapper import CubieMediaMQTTClient, decode_payload
 from common.network import get_ip_address
-from common.python import get_configuration, set_configuration, get_mqtt_configuration, get_system_configuration, \
-    execute_command
+from common.python import get_configuration, get_mqtt_configuration, get_system_configuration, \
+    execute_command, ConfigurationWriter
+from common.scheduler import UpdateScheduler
 
 EXECUTION_MODE_BASE = "base"
 
@@ -24,6 +29,115 @@ def system_reset(system):
     system.reset()
 
 
+def normalize_device_id(device_id) -> str:
+    return str(device_id).upper()
+
+
+def get_spill_file(spill_file: str, execution_mode: str):
+    # every gateway process spills to its own file, e.g. offline.jsonl -> offline-enocean.jsonl
+    if not spill_file:
+        return None
+    root, extension = os.path.splitext(spill_file)
+    return f"{root}-{execution_mode}{extension}"
+
+
+class DeviceRegistry(list):
+    """Ordered device list as it is persisted, with an index on the normalized device id.
+
+    Lookups by id are O(1). The index follows all list operations, only if the id of a stored
+    device is changed in place reindex() has to be called.
+    """
+
+    def __init__(self, devices=()):
+        super().__init__(devices)
+        self._index = {}
+        self.reindex()
+
+    def get(self, device_id, default=None):
+        return self._index.get(normalize_device_id(device_id), default)
+
+    def put(self, device: {}):
+        # replaces the known device with the same id in place or appends a new one
+        known_device = self.get(device['id'])
+        if known_device is None:
+            self.append(device)
+        elif known_device is not device:
+            super().__setitem__(self._position_of(known_device), device)
+            self._index[normalize_device_id(device['id'])] = device
+        return known_device
+
+    def remove_device(self, device_id):
+        known_device = self.get(device_id)
+        if known_device is not None:
+            self.remove(known_device)
+        return known_device
+
+    def reindex(self):
+        self._index = {}
+        for device in self:
+            self._add_to_index(device)
+
+    def append(self, device):
+        super().append(device)
+        self._add_to_index(device)
+
+    def extend(self, devices):
+        devices = list(devices)
+        super().extend(devices)
+        for device in devices:
+            self._add_to_index(device)
+
+    def __iadd__(self, devices):
+        self.extend(devices)
+        return self
+
+    def insert(self, position, device):
+        super().insert(position, device)
+        self.reindex()
+
+    def remove(self, device):
+        super().remove(device)
+        self._remove_from_index(device)
+
+    def pop(self, position=-1):
+        device = super().pop(position)
+        self._remove_from_index(device)
+        return device
+
+    def clear(self):
+        super().clear()
+        self._index = {}
+
+    def __setitem__(self, position, device):
+        super().__setitem__(position, device)
+        self.reindex()
+
+    def __delitem__(self, position):
+        super().__delitem__(position)
+        self.reindex()
+
+    def _position_of(self, device) -> int:
+        for position, known_device in enumerate(self):
+            if known_device is device:
+                return position
+        raise ValueError(f"device [{device}] is not registered")
+
+    def _add_to_index(self, device):
+        if isinstance(device, dict) and 'id' in device:
+            # the first device wins, same as a linear scan would find it
+            self._index.setdefault(normalize_device_id(device['id']), device)
+
+    def _remove_from_index(self, device):
+        if isinstance(device, dict) and 'id' in device:
+            device_id = normalize_device_id(device['id'])
+            if self._index.get(device_id) is device:
+                del self._index[device_id]
+                for known_device in self:
+                    if isinstance(known_device, dict) and normalize_device_id(known_device.get('id')) == device_id:
+                        self._index[device_id] = known_device
+                        break
+
+
 SERVICES = {
     "reboot": {"name": "Reboot System", "action": system_reboot},
     "reset": {"name": "Reset Devices", "action": system_reset, "modes": [CUBIE_ENOCEAN, CUBIE_RELAY]}
@@ -36,7 +150,7 @@ class BaseSystem(abc.ABC):
     ip_address = None
     string_ip = 'unset'
     last_update = 0
-    config: [] = []
+    config: DeviceRegistry = DeviceRegistry()
     mqtt_config: {} = {}
     system_config: [] = []
     execution_mode = EXECUTION_MODE_BASE
@@ -46,6 +160,11 @@ class BaseSystem(abc.ABC):
         self.string_ip = self.ip_address.replace(".", "_")
         self.client_id = f"{self.ip_address}-{self.execution_mode}-client"
         self.mqtt_client = CubieMediaMQTTClient(self.client_id)
+        self.config = DeviceRegistry()
+        self.scheduler = UpdateScheduler()
+        self.config_writer = ConfigurationWriter()
+        self.discovery = DiscoveryPayloadBuilder()
+        self.published_discovery = {}
 
     def init(self):
         logging.info(f"... init base system [{self.client_id}]")
@@ -57,6 +176,7 @@ class BaseSystem(abc.ABC):
             f"... disconnect mqtt client [{self.client_id}] from [{self.get_mqtt_server()}]")
         if self.mqtt_client:
             self.mqtt_client.disconnect()
+        self.config_writer.flush()
 
     def action(self, device: {}) -> bool:
         raise NotImplementedError
@@ -68,6 +188,24 @@ class BaseSystem(abc.ABC):
 
         return data
 
+    def next_update(self) -> float:
+        # latest point in time the main loop has to call update again
+        return time.time() + TIMEOUT_UPDATE_IDLE
+
+    def get_update_file_descriptors(self) -> list:
+        # file descriptors which wake up the main loop as soon as they are readable
+        return []
+
+    def notify_update(self):
+        self.scheduler.notify()
+
+    def get_statistics(self) -> {}:
+        # system specific values for the metrics, e.g. the depth of a receive queue
+        return {}
+
+    def wait_for_update(self) -> list:
+        return self.scheduler.wait(self.next_update(), self.get_update_file_descriptors())
+
     def send(self, data: {}) -> bool:
         if all(attribute in data for attribute in ['id', 'state']):
             data_id = data["id"]
@@ -90,20 +228,40 @@ class BaseSystem(abc.ABC):
                 unique_id = f"{self.string_ip}-base-{service}"
                 availability_topic = f"{MQTT_CUBIEMEDIA}/base/{self.string_ip}/online"
 
-                payload = PAYLOAD_BUTTON
-                payload[MQTT_NAME] = attributes['name']
-                payload[MQTT_COMMAND_TOPIC] = state_topic + "/command"
-                payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-                payload[MQTT_UNIQUE_ID] = unique_id
-                payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = self.string_ip
-                payload[MQTT_DEVICE][MQTT_NAME] = f"MQTT - Gateway ({self.ip_address})"
-                payload[MQTT_DEVICE][MQTT_DEVICE_DESCRIPTION] = f"Gateway ({self.ip_address})"
+                payload = self.discovery.render(PAYLOAD_BUTTON, {
+                    MQTT_NAME: attributes['name'],
+                    MQTT_COMMAND_TOPIC: state_topic + "/command",
+                    MQTT_AVAILABILITY_TOPIC: availability_topic,
+                    MQTT_UNIQUE_ID: unique_id
+                }, {
+                    MQTT_DEVICE_IDS: self.string_ip,
+                    MQTT_NAME: f"MQTT - Gateway ({self.ip_address})",
+                    MQTT_DEVICE_DESCRIPTION: f"Gateway ({self.ip_address})"
+                })
 
-                self.mqtt_client.publish(config_topic, json.dumps(payload), retain=True)
+                self.publish_discovery(config_topic, payload)
 
                 service_specific_command_topic = f"{MQTT_CUBIEMEDIA}/base/{self.string_ip}/{service}/command"
                 logging.info(f"... ... subscribe to channel [{service_specific_command_topic}]")
-                self.mqtt_client.subscribe(service_specific_command_topic, QOS)
+                self.mqtt_client.subscribe(service_specific_command_topic, QOS, self.on_command)
+
+    def on_command(self, path: tuple, payload: bytes):
+        # cubiemedia/<mode>/<ip>/<id>/command
+        if len(path) > 3:
+            self.send({'ip': path[2].replace("_", "."), 'id': path[3], 'state': decode_payload(payload)})
+
+    def publish_discovery(self, config_topic: str, payload: bytes) -> bool:
+        # retained configs are only published again if they changed since the last announce
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        if self.published_discovery.get(config_topic) == digest:
+            return False
+        self.mqtt_client.publish(config_topic, payload, retain=True)
+        self.published_discovery[config_topic] = digest
+        return True
+
+    def reset_discovery(self):
+        logging.debug("... ... all discovery configs will be published with the next announce")
+        self.published_discovery = {}
 
     def set_availability(self, state: bool):
         self.mqtt_client.publish(
@@ -112,40 +270,37 @@ class BaseSystem(abc.ABC):
 
     def load(self):
         logging.info("... loading config")
+        # the stored configuration is newer, e.g. it was changed by the webtool before the reload
+        self.config_writer.discard()
 
         self.mqtt_config = get_mqtt_configuration()
         self.system_config = get_system_configuration()
+        self.config_writer.delay = self.system_config.get(SAVE_DELAY, TIMEOUT_SAVE_CONFIGURATION)
+        self.mqtt_client.offline_queue.spill_file = get_spill_file(self.system_config.get(OFFLINE_SPILL_FILE),
+                                                                   self.execution_mode)
+        self.mqtt_client.publish_cache.refresh_interval = self.system_config.get(PUBLISH_REFRESH,
+                                                                                 TIMEOUT_PUBLISH_REFRESH)
         if self.execution_mode != "base":
-            self.config = get_configuration(self.execution_mode)
+            self.config = DeviceRegistry(get_configuration(self.execution_mode))
 
     def save(self, device=None):
         if device and 'client_id' not in device:
             device['client_id'] = self.client_id
         if device and 'id' in device:
-            self.config = [device if device['id'] == temp_device['id'] else temp_device for
-                           temp_device in self.config]
-            if device not in self.config:
-                self.config.append(device)
+            self.config.put(device)
         if self.execution_mode != EXECUTION_MODE_BASE:
-            set_configuration(self.execution_mode, self.config)
+            self.config_writer.schedule(self.execution_mode, self.config)
 
     def delete(self, device):
-        deleted = False
-        for known_device in self.config:
-            if str(device['id']).upper() == str(known_device['id']).upper():
-                self.config.remove(known_device)
-                self.save()
-                deleted = True
-                break
-
-        if deleted:
+        if self.config.remove_device(device['id']) is not None:
+            self.save()
             logging.info(f"... deleted device [{device}]")
         else:
             logging.warning(f"... could not find device [{device}] to delete")
 
     def reset(self):
         logging.info("... resetting device list")
-        self.config = []
+        self.config = DeviceRegistry()
         self.save()
 
     def get_mqtt_server(self):
@@ -5,92 +5,122 @@ import json
 import logging
 import platform
 import queue
+import threading
 import time
-from threading import Timer
+from datetime import datetime
 
 from enocean.communicators.serialcommunicator import SerialCommunicator
-from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.constants import PACKET
 from serial import SerialException
 
 import common
 from common import MQTT_HOMEASSISTANT_PREFIX, MQTT_CUBIEMEDIA, CUBIE_SERIAL, CUBIE_DEVICE, \
-    CUBIE_TYPE, ENOCEAN_PORT, DEVICES_CAN_BE_ADDED
+    CUBIE_TYPE, ENOCEAN_PORT, DEVICES_CAN_BE_ADDED, ENOCEAN_RECEIVE_BATCH, ENOCEAN_LONG_PUSH, \
+    ENOCEAN_SHORT_PUSH_RELEASE, ENOCEAN_DIMMER_STEP, ENOCEAN_TOPIC_ARBITRATION, ARBITRATION_INTERVAL, QOS
+from common.arbitration import GatewayArbiter
+from common.enocean_eep import DECODERS, DEFAULT_DECODERS, DEVICE_TYPES, get_decoder, get_teach_in, \
+    format_profile
 from common.homeassistant import MQTT_BINARY_SENSOR, PAYLOAD_SENSOR, MQTT_NAME, MQTT_STATE_TOPIC, \
-    MQTT_AVAILABILITY_TOPIC, MQTT_UNIQUE_ID, MQTT_DEVICE, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION
+    MQTT_AVAILABILITY_TOPIC, MQTT_UNIQUE_ID, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION, PAYLOAD_SPECIAL_SENSOR, \
+    MQTT_CONFIG_TOPIC, MQTT_UNIT, MQTT_UNIT_OF_MEASUREMENT, MQTT_STATE_CLASS, MQTT_DEVICE_CLASS, MQTT_SENSOR
+from common.metrics import REGISTRY
 from common.python import get_configuration
-from system.base_system import BaseSystem
+from common.scheduler import NotifyingQueue
+from common.timers import TimerScheduler, ScheduledTimer
+from system.base_system import BaseSystem, normalize_device_id
+
+RECEIVE_LATENCY = REGISTRY.histogram(f"{MQTT_CUBIEMEDIA}_enocean_receive_latency_seconds",
+                                     "Time from receiving a telegram until it is handed to action")
 
 
 class EnoceanSystem(BaseSystem):
     serial_port = None
     communicator = None
     update_timeout = 30
-    timers = {}
+    receive_batch = ENOCEAN_RECEIVE_BATCH
+    receive_latency_max = 0.0
 
     def __init__(self):
         self.execution_mode = common.CUBIE_ENOCEAN
         super().__init__()
+        # channel topic -> pending long push detection or True while the button is held
+        self.timers = {}
+        # the timer thread marks a held button, the main thread removes it on release
+        self._timers_lock = threading.Lock()
+        self.timer_scheduler = TimerScheduler("enocean-timers")
+        self.arbiter = GatewayArbiter(self.client_id)
+        self.last_arbitration = 0
+        # (device id, rorg) -> decoder of the learned or stored profile, None if it is not supported
+        self.decoders = {}
 
     def action(self, device):
         if device and {'id', 'state', 'dbm'}.issubset(device.keys()):
             should_save = False
 
-            for known_device in self.config:
-                if str(device['id']).upper() == str(known_device['id']).upper():
-                    if known_device['client_id'] != self.client_id:
-                        if device['dbm'] > known_device['dbm']:
-                            device['client_id'] = self.client_id
-                            logging.info(
-                                "... ... device with better connection, announce [%s]" % device)
-                            self.mqtt_client.publish(common.DEFAULT_TOPIC_ANNOUNCE,
-                                                     json.dumps(device))
-                            return False
-                        logging.debug("... ... device is not managed by this gateway [%s]" % device)
-                        return True
-                    if str(device[common.CUBIE_TYPE]).upper() == "RPS":
-                        for topic in device['state']:
-                            if 'state' not in known_device or len(known_device['state']) == 0 or \
-                                    (topic in known_device['state'] and device['state'][topic] !=
-                                     known_device['state'][topic]):
-                                channel_topic = f"{common.MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(device['id']).lower()}/{topic}"
-                                value = device['state'][topic]
-                                if value == 1:
-                                    self._create_timer_for(channel_topic)
-                                else:
-                                    logging.info("... ... action for [%s]" % channel_topic)
-                                    if channel_topic in self.timers and isinstance(
-                                            self.timers[channel_topic], Timer):
-                                        self.mqtt_client.publish(channel_topic, 1)
-                                        timer = self.timers[channel_topic]
-                                        timer.cancel()
-                                        del self.timers[channel_topic]
-                                        short_push_timer = Timer(0.5, self.mqtt_client.publish,
-                                                                 [channel_topic, 0, True])
-                                        short_push_timer.start()
-                                    else:
-                                        if channel_topic in self.timers:
-                                            del self.timers[channel_topic]
-                                        self.mqtt_client.publish(channel_topic + "/longpush", 0,
-                                                                 True)
-                                should_save = True
-                        known_device['state'] = device['state']
-                        if device['dbm'] > known_device['dbm']:
-                            known_device['dbm'] = device['dbm']
-                        if should_save:
-                            self.save()
-                    else:
-                        logging.debug("... ... send message for [%s]" % device['id'])
-                        self.mqtt_client.publish(
-                            f"{common.MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(device['id']).lower()}",
-                            json.dumps(device['state']), True)
+            known_device = self.config.get(device['id'])
+            if known_device is not None:
+                device_id = normalize_device_id(device['id'])
+                if device_id not in self.arbiter.owners:
+                    self.arbiter.set_owner(device_id, known_device['client_id'])
+                owner = self.arbiter.observe(device_id, device['dbm'])
+                if owner is not None and owner != known_device['client_id']:
+                    self._change_owner(known_device, owner)
+                    if owner == self.client_id:
+                        return False
+                if known_device['client_id'] != self.client_id:
+                    logging.debug("... ... device is not managed by this gateway [%s]" % device)
                     return True
+                if str(device[common.CUBIE_TYPE]).upper() == "RPS":
+                    for topic in device['state']:
+                        if 'state' not in known_device or len(known_device['state']) == 0 or \
+                                (topic in known_device['state'] and device['state'][topic] !=
+                                 known_device['state'][topic]):
+                            channel_topic = f"{common.MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(device['id']).lower()}/{topic}"
+                            value = device['state'][topic]
+                            if value == 1:
+                                self._create_timer_for(channel_topic)
+                            else:
+                                logging.info("... ... action for [%s]" % channel_topic)
+                                with self._timers_lock:
+                                    timer = self.timers.pop(channel_topic, None)
+                                if isinstance(timer, ScheduledTimer):
+                                    self.mqtt_client.publish(channel_topic, 1)
+                                    timer.cancel()
+                                    self.timer_scheduler.schedule(ENOCEAN_SHORT_PUSH_RELEASE,
+                                                                  self.mqtt_client.publish, channel_topic, 0,
+                                                                  True)
+                                else:
+                                    self.mqtt_client.publish(channel_topic + "/longpush", 0,
+                                                             True)
+                            should_save = True
+                    known_device['state'] = device['state']
+                    if device['dbm'] > known_device['dbm']:
+                        known_device['dbm'] = device['dbm']
+                    if should_save:
+                        self.save()
+                else:
+                    logging.debug("... ... send message for [%s]" % device['id'])
+                    device_topic = f"{common.MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(device['id']).lower()}"
+                    self.mqtt_client.publish(device_topic, json.dumps(device['state']), True)
+                    for key, value in device['state'].items():
+                        self.mqtt_client.publish(f"{device_topic}/{key}", value, True)
+                    # e.g. a meter sends the current power and the energy in separate telegrams
+                    if not set(device['state']).issubset(known_device.get('state', {})):
+                        known_device['state'] = {**known_device.get('state', {}), **device['state']}
+                        self.save()
+                        self.announce_device(known_device)
+                return True
 
             device['client_id'] = self.client_id
             if self.system_config[DEVICES_CAN_BE_ADDED]:
                 logging.info("... ... unknown device, announce [%s]" % device)
                 self.save(device)
-                self.announce()
-                self.last_update = - 1
+                known_device = self.config.get(device['id'])
+                if known_device is not None:
+                    self.announce_device(known_device)
+                    self.mqtt_client.publish(
+                        f"{common.MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(device['id']).lower()}/online",
+                        "true")
             else:
                 logging.warning(f"unknown device[{device}], will not be added - system locked")
         else:
@@ -98,34 +128,146 @@ class EnoceanSystem(BaseSystem):
         return False
 
     def update(self) -> {}:
-        try:
-            if self.communicator:
-                data = {}
-                packet = self.communicator.receive.get(block=False, timeout=1)
-                if packet.packet_type == PACKET.RADIO_ERP1:
-                    sensor = {'id': packet.sender_hex.replace(':', '').lower(), 'dbm': packet.dBm}
-                    if packet.rorg == RORG.RPS:
-                        sensor[common.CUBIE_TYPE] = 'RPS'
-                        sensor['state'] = self._get_rps_state_from2(packet)
-                        data['devices'] = [sensor]
-                    elif packet.rorg == RORG.BS4:
-                        sensor[common.CUBIE_TYPE] = 'TEMP'
-                        sensor['state'] = self._get_temp_state_from(packet)
-                        data['devices'] = [sensor]
-                    else:
-                        logging.error(f"device type (RORG: {packet.rorg}) not supported")
-                else:
-                    logging.error(f"packet type ({packet.packet_type}) not supported")
+        # all packets received since the last wakeup are parsed in one batch, capped so a flooding
+        # serial line can not starve the main loop
+        if not self.communicator:
+            return {}
+
+        devices = []
+        received = []
+        for _ in range(self.receive_batch):
+            try:
+                packet = self.communicator.receive.get(block=False)
+            except queue.Empty:
+                break
+            except Exception as e:
+                logging.error(f"ERROR on update: {e}")
+                break
+
+            received.append(packet.received)
+            try:
+                sensor = self._get_sensor_from(packet)
+                if sensor:
+                    devices.append(sensor)
+            except Exception as e:
+                logging.error(f"ERROR on update: {e}")
+
+        # the deadline of next_update moves on, even if nothing was received
+        if time.monotonic() >= self.last_arbitration + ARBITRATION_INTERVAL:
+            self._publish_arbitration()
+        if self.last_update < time.time() - common.TIMEOUT_UPDATE_AVAILABILITY:
+            self.set_availability(True)
+            self.last_update = time.time()
+
+        if not received:
+            return {}
+        self._observe_receive_latency(received)
+        return {'devices': devices} if devices else {}
 
-                if self.last_update < time.time() - common.TIMEOUT_UPDATE_AVAILABILITY:
-                    self.set_availability(True)
-                    self.last_update = time.time()
-                return data
-        except queue.Empty:
+    def on_arbitration(self, path: tuple, payload: bytes):
+        try:
+            changed = self.arbiter.apply_delta(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"... could not apply arbitration [{payload}]: {e}")
+            return
+
+        for device_id, owner in changed.items():
+            known_device = self.config.get(device_id)
+            if known_device is not None and known_device['client_id'] != owner:
+                self._change_owner(known_device, owner)
+
+    def _change_owner(self, device, owner):
+        logging.info(f"... ... device [{device['id']}] is managed by [{owner}] now")
+        device['client_id'] = owner
+        self.save()
+        if owner == self.client_id:
+            self.announce_device(device)
+            # the claim has to reach the other gateways before they publish for the device again
+            self._publish_arbitration()
+
+    def _publish_arbitration(self):
+        self.last_arbitration = time.monotonic()
+        delta = self.arbiter.create_delta()
+        if delta is not None:
+            self.mqtt_client.publish(ENOCEAN_TOPIC_ARBITRATION, delta)
+
+    def _get_sensor_from(self, packet) -> {}:
+        if packet.packet_type != PACKET.RADIO_ERP1:
+            logging.error(f"packet type ({packet.packet_type}) not supported")
+            return None
+
+        device_id = packet.sender_hex.replace(':', '').lower()
+        profile = get_teach_in(packet.data)
+        if profile is not None:
+            self._learn_profile(device_id, profile)
+            return None
+
+        decoder = self._get_decoder(device_id, packet.rorg)
+        if decoder is None:
+            logging.debug(f"device type (RORG: {packet.rorg}) of [{device_id}] not supported")
+            return None
+        state = decoder.decode(packet.data)
+        if not state:
+            return None
+        return {'id': device_id, 'dbm': packet.dBm, common.CUBIE_TYPE: decoder.device_type, 'eep': decoder.name,
+                'state': state}
+
+    def _get_decoder(self, device_id: str, rorg: int):
+        try:
+            return self.decoders[(device_id, rorg)]
+        except KeyError:
             pass
-        except Exception as e:
-            logging.error(f"ERROR on update: {e}")
-        return {}
+
+        decoder = DEFAULT_DECODERS.get(rorg)
+        known_device = self.config.get(device_id)
+        if known_device is not None and 'eep' in known_device:
+            stored_decoder = get_decoder(known_device['eep'])
+            if stored_decoder is not None and stored_decoder.rorg == rorg:
+                decoder = stored_decoder
+        self.decoders[(device_id, rorg)] = decoder
+        return decoder
+
+    def _learn_profile(self, device_id: str, profile: tuple):
+        if not profile:
+            logging.debug(f"... ... teach-in without profile from [{device_id}]")
+            return
+        decoder = DECODERS.get(profile)
+        self.decoders[(device_id, profile[0])] = decoder
+        if decoder is None:
+            logging.warning(f"... ... profile [{format_profile(profile)}] of [{device_id}] is not supported")
+            return
+
+        logging.info(f"... ... learned profile [{decoder.name}] of [{device_id}]")
+        known_device = self.config.get(device_id)
+        if known_device is not None and known_device.get('eep') != decoder.name:
+            known_device['eep'] = decoder.name
+            known_device[common.CUBIE_TYPE] = decoder.device_type
+            self.save()
+
+    def _observe_receive_latency(self, received: list):
+        # time from parsing the telegram on the serial thread until it is handed to action
+        now = datetime.now()
+        for timestamp in received:
+            if isinstance(timestamp, datetime):
+                latency = (now - timestamp).total_seconds()
+                RECEIVE_LATENCY.observe(latency)
+                if latency > self.receive_latency_max:
+                    self.receive_latency_max = latency
+
+    def next_update(self) -> float:
+        if self.communicator:
+            if not self.communicator.receive.empty():
+                return time.time()
+            return min(self.last_update + common.TIMEOUT_UPDATE_AVAILABILITY, super().next_update())
+        return super().next_update()
+
+    def get_statistics(self) -> {}:
+        if not self.communicator:
+            return {'receive_queue_depth': 0, 'receive_queue_max_depth': 0,
+                    'receive_latency_max_seconds': self.receive_latency_max}
+        return {'receive_queue_depth': self.communicator.receive.qsize(),
+                'receive_queue_max_depth': getattr(self.communicator.receive, 'max_depth', 0),
+                'receive_latency_max_seconds': self.receive_latency_max}
 
     def set_availability(self, state: bool):
         super().set_availability(state)
@@ -146,6 +288,8 @@ class EnoceanSystem(BaseSystem):
                 self.communicator.start()
                 time.sleep(0.100)
                 self.set_availability(True)
+                # next_update waits until the availability has to be refreshed
+                self.last_update = time.time()
             except RuntimeError as exception:
                 logging.error(f"could not run serial communicator: {exception}")
                 self.communicator = None
@@ -157,6 +301,7 @@ class EnoceanSystem(BaseSystem):
         self.set_availability(False)
 
         super().shutdown()
+        self.timer_scheduler.shutdown()
 
         if self.communicator:
             logging.info('... stopping Enocean Communicator...')
@@ -165,74 +310,111 @@ class EnoceanSystem(BaseSystem):
 
     def announce(self):
         super().announce()
+        self.mqtt_client.subscribe(ENOCEAN_TOPIC_ARBITRATION, QOS, self.on_arbitration)
         for device in self.config:
-            # {"client_id": "10.10.20.31-enocean-client", "dbm": -51, "id": "fefc1be1",
-            # "state": {"a1": 0, "a2": 0, "b1": 0, "b2": 0}, "type": "RPS"}
-
-            if {'id', 'state', 'client_id'}.issubset(device.keys()) and device[
-                'client_id'] == self.client_id:
-                device_id = device['id']
-                logging.info("... ... announce device [%s]" % device_id)
-                temp_device = device.copy()
-                del temp_device['state']
-                self.mqtt_client.publish(common.DEFAULT_TOPIC_ANNOUNCE, json.dumps(temp_device))
-
-                for sensor, value in device['state'].items():
-                    device_name = f"EnOcean Switch {device_id}"
-                    sensor_name = f"Sensor {sensor.title()}"
-                    unique_id = f"enocean-{device_id}-{sensor}-input"
-                    config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_BINARY_SENSOR}/{device_id}-{sensor}/config"
-                    state_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device_id}/{sensor}"
-                    availability_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device_id}/online"
-
-                    payload = PAYLOAD_SENSOR
-                    payload[MQTT_NAME] = sensor_name
-                    payload[MQTT_STATE_TOPIC] = state_topic
-                    payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-                    payload[MQTT_UNIQUE_ID] = unique_id
-                    payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = device_id
-                    payload[MQTT_DEVICE][MQTT_NAME] = device_name
-                    payload[MQTT_DEVICE][
-                        MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
-
-                    self.mqtt_client.publish(config_topic, json.dumps(payload), retain=True)
-
-                    # also create long push sensor for all normal sensors
-                    config_topic_long_push = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_BINARY_SENSOR}/{device_id}-{sensor}-longpush/config"
-                    payload = PAYLOAD_SENSOR
-                    payload[MQTT_NAME] = sensor_name + "-longpush"
-                    payload[MQTT_STATE_TOPIC] = state_topic + "/longpush"
-                    payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-                    payload[MQTT_UNIQUE_ID] = unique_id + "_longpush"
-                    payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = device_id
-                    payload[MQTT_DEVICE][MQTT_NAME] = device_name
-                    payload[MQTT_DEVICE][
-                        MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
-
-                    self.mqtt_client.publish(config_topic_long_push, json.dumps(payload),
-                                             retain=True)
-                    if value == 1:
-                        channel_topic = f"{common.MQTT_CUBIEMEDIA}/{self.execution_mode}/{device_id}/{sensor}"
-                        self._create_timer_for(channel_topic, True)
-            else:
-                logging.debug(f"wrong data or device not managed by this gateway [{device}]")
+            self.announce_device(device)
         self.set_availability(True)
 
+    def announce_device(self, device):
+        # {"client_id": "10.10.20.31-enocean-client", "dbm": -51, "id": "fefc1be1",
+        # "state": {"a1": 0, "a2": 0, "b1": 0, "b2": 0}, "type": "RPS"}
+
+        if {'id', 'state', 'client_id'}.issubset(device.keys()) and device[
+            'client_id'] == self.client_id:
+            device_id = device['id']
+            logging.info("... ... announce device [%s]" % device_id)
+            temp_device = device.copy()
+            del temp_device['state']
+            self.mqtt_client.publish(common.DEFAULT_TOPIC_ANNOUNCE, json.dumps(temp_device))
+
+            if str(device.get(common.CUBIE_TYPE)).upper() != "RPS":
+                self._announce_sensor(device)
+                return
+
+            for sensor, value in device['state'].items():
+                device_name = f"EnOcean Switch {device_id}"
+                sensor_name = f"Sensor {sensor.title()}"
+                unique_id = f"enocean-{device_id}-{sensor}-input"
+                config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_BINARY_SENSOR}/{device_id}-{sensor}/config"
+                state_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device_id}/{sensor}"
+                availability_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device_id}/online"
+
+                device_attributes = {
+                    MQTT_DEVICE_IDS: device_id,
+                    MQTT_NAME: device_name,
+                    MQTT_DEVICE_DESCRIPTION: f"via Gateway ({self.ip_address})"
+                }
+                payload = self.discovery.render(PAYLOAD_SENSOR, {
+                    MQTT_NAME: sensor_name,
+                    MQTT_STATE_TOPIC: state_topic,
+                    MQTT_AVAILABILITY_TOPIC: availability_topic,
+                    MQTT_UNIQUE_ID: unique_id
+                }, device_attributes)
+
+                self.publish_discovery(config_topic, payload)
+
+                # also create long push sensor for all normal sensors
+                config_topic_long_push = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_BINARY_SENSOR}/{device_id}-{sensor}-longpush/config"
+                payload = self.discovery.render(PAYLOAD_SENSOR, {
+                    MQTT_NAME: sensor_name + "-longpush",
+                    MQTT_STATE_TOPIC: state_topic + "/longpush",
+                    MQTT_AVAILABILITY_TOPIC: availability_topic,
+                    MQTT_UNIQUE_ID: unique_id + "_longpush"
+                }, device_attributes)
+
+                self.publish_discovery(config_topic_long_push, payload)
+                if value == 1:
+                    channel_topic = f"{common.MQTT_CUBIEMEDIA}/{self.execution_mode}/{device_id}/{sensor}"
+                    self._create_timer_for(channel_topic, True)
+        else:
+            logging.debug(f"wrong data or device not managed by this gateway [{device}]")
+
+    def _announce_sensor(self, device):
+        # one entity per value of the state, described by the services of the profile
+        device_id = device['id']
+        decoder = get_decoder(device.get('eep'))
+        if decoder is None:
+            decoder = next((decoder for decoder in DEFAULT_DECODERS.values()
+                            if decoder.device_type == str(device.get(common.CUBIE_TYPE)).upper()), None)
+        services = decoder.services if decoder else {}
+        availability_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device_id}/online"
+        device_attributes = {
+            MQTT_DEVICE_IDS: device_id,
+            MQTT_NAME: f"EnOcean {str(device.get(common.CUBIE_TYPE)).title()} {device_id}",
+            MQTT_DEVICE_DESCRIPTION: f"via Gateway ({self.ip_address})"
+        }
+        for service in device['state']:
+            attributes = services.get(service, {MQTT_CONFIG_TOPIC: MQTT_SENSOR})
+            entity_attributes = {
+                MQTT_NAME: f"Sensor {service.title()}",
+                MQTT_STATE_TOPIC: f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device_id}/{service}",
+                MQTT_AVAILABILITY_TOPIC: availability_topic,
+                MQTT_UNIQUE_ID: f"enocean-{device_id}-{service}"
+            }
+            if attributes[MQTT_CONFIG_TOPIC] == MQTT_BINARY_SENSOR:
+                template = PAYLOAD_SENSOR
+                entity_attributes[MQTT_DEVICE_CLASS] = attributes.get(MQTT_DEVICE_CLASS)
+            else:
+                template = PAYLOAD_SPECIAL_SENSOR
+                entity_attributes[MQTT_UNIT_OF_MEASUREMENT] = attributes.get(MQTT_UNIT)
+                entity_attributes[MQTT_STATE_CLASS] = attributes.get(MQTT_STATE_CLASS)
+                entity_attributes[MQTT_DEVICE_CLASS] = attributes.get(MQTT_DEVICE_CLASS)
+            config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{attributes[MQTT_CONFIG_TOPIC]}/{device_id}-{service}/config"
+            self.publish_discovery(config_topic, self.discovery.render(template, entity_attributes, device_attributes))
+
     def save(self, device=None):
         if device and {'id', 'dbm', 'type'}.issubset(device.keys()):
-            if (str(device[common.CUBIE_TYPE]).upper() == "RPS" or str(
-                    device[common.CUBIE_TYPE]).upper() == "TEMP") and (
+            if str(device[common.CUBIE_TYPE]).upper() in DEVICE_TYPES and (
                     DEVICES_CAN_BE_ADDED in self.system_config and self.system_config[
                 'devices_can_be_added']):
                 add = True
-                for known_device in self.config:
-                    if str(device['id']).upper() == str(known_device['id']).upper():
-                        add = False
-                        if device['dbm'] > known_device['dbm']:
-                            logging.info("... ... replace device[%s]" % device)
-                            self.config[self.config.index(known_device)] = device
-                            add = True
-                        break
+                known_device = self.config.get(device['id'])
+                if known_device is not None:
+                    add = False
+                    if device['dbm'] > known_device['dbm']:
+                        logging.info("... ... replace device[%s]" % device)
+                        self.config.put(device)
+                        add = True
 
                 if add:
                     logging.info(f"... ... adding new/changed device[{device['id']}]")
@@ -245,124 +427,35 @@ class EnoceanSystem(BaseSystem):
         if device and 'state' in device:
             self.action(device)
 
-    @staticmethod
-    def _get_temp_state_from(packet):
-        packet.parse_eep(0x02, 0x05)
-        temperature = round(packet.parsed['TMP']['value'], 1)
-        return {"value": temperature}
-
-    @staticmethod
-    def _get_rps_state_from2(packet):
-        is_door_window_contact = False
-        state = {}
-        try:
-            attribute_list = packet.parse_eep(0x02, 0x01)
-        except TypeError:
-            attribute_list = packet.parse_eep(0x01, 0x01)
-            is_door_window_contact = True
-
-        button_action = 1
-        has_second_action = False
-        button_action_2 = 0
-        energy_bow_active = False
-
-        for k in attribute_list:
-            if k == 'R1':
-                button_action = int(packet.parsed[k]['raw_value'])
-            if k == 'R2':
-                button_action_2 = int(packet.parsed[k]['raw_value'])
-            if k == 'EB':
-                energy_bow_active = int(packet.parsed[k]['raw_value']) == 1
-            if k == 'SA':
-                has_second_action = int(packet.parsed[k]['raw_value']) == 1
-            if k == 'PB':
-                button_action = int(packet.parsed[k]['raw_value'])
-                energy_bow_active = int(packet.parsed[k]['raw_value']) == 1
-
-        if energy_bow_active:
-            if button_action == 0:
-                state['a2'] = 1
-            elif button_action == 1:
-                state['a1'] = 1
-            elif button_action == 2:
-                state['b2'] = 1
-            elif button_action == 3:
-                state['b1'] = 1
-
-            if has_second_action:
-                if button_action_2 == 2:
-                    state['b2'] = 1
-                elif button_action_2 == 3:
-                    state['b1'] = 1
-        else:
-            state['a1'] = 0
-            if not is_door_window_contact:
-                state['a2'] = 0
-                state['b1'] = 0
-                state['b2'] = 0
-
-        logging.debug(state)
-
-        return state
-
-    @staticmethod
-    def _get_rps_state_from(packet):
-        state = {}
-        data = packet.data[1]
-        sa = data & 0x40 >> 6
-        button_action = data & 0xE0
-        energy_bow = (data & 0x10) >> 4
-
-        logging.debug("SA: %s, Action: %02X, EB: %s" % (sa, button_action, energy_bow))
-        if button_action == 0xE0:
-            state['a1'] = energy_bow
-        elif energy_bow == 1:
-            if button_action == 0x00:
-                state['a2'] = 1
-            elif button_action == 0x20:
-                state['a1'] = 1
-
-            if sa == 0:
-                if button_action == 0x40:
-                    state['b2'] = 1
-                elif button_action == 0x60:
-                    state['b1'] = 1
-            else:
-                button_action_channel_2 = data & 0x03
-                if button_action_channel_2 == 0x01:
-                    state['b2'] = 1
-                elif button_action_channel_2 == 0x03:
-                    state['b1'] = 1
-        else:
-            state['a1'] = 0
-            state['a2'] = 0
-            state['b1'] = 0
-            state['b2'] = 0
-
-        return state
+    def delete(self, device):
+        self.arbiter.remove(normalize_device_id(device['id']))
+        self.decoders = {key: decoder for key, decoder in self.decoders.items()
+                         if normalize_device_id(key[0]) != normalize_device_id(device['id'])}
+        super().delete(device)
 
     def _create_timer_for(self, channel_topic, force=False):
-        if channel_topic not in self.timers:
-            timer = Timer(0.8, self._long_push_timer, [channel_topic])
-            self.timers[channel_topic] = timer
-            timer.start()
-        elif force:
+        with self._timers_lock:
+            created = channel_topic not in self.timers
+            if created:
+                self.timers[channel_topic] = self.timer_scheduler.schedule(
+                    ENOCEAN_LONG_PUSH, self._long_push_timer, channel_topic)
+        if not created and force:
             logging.info("... ... sending longpush [%s]" % channel_topic)
             self.mqtt_client.publish(channel_topic + "/longpush", 1, True)
 
     def _long_push_timer(self, channel_topic):
-        self.timers[channel_topic] = True
+        with self._timers_lock:
+            if channel_topic not in self.timers:
+                # released while the timer was due
+                return
+            self.timers[channel_topic] = True
         logging.info("... ... sending longpush [%s]" % channel_topic)
         self.mqtt_client.publish(channel_topic + "/longpush", 1, True)
 
         topic_array = channel_topic.split('/')
-        device_id = topic_array[1]
-        button = topic_array[2]
-        device = None
-        for known_device in self.config:
-            if device_id == known_device['id']:
-                device = known_device
-                break
+        device_id = topic_array[2]
+        button = topic_array[3]
+        device = self.config.get(device_id)
 
         if device is not None and 'channel_config' in device:
             channel_config = device['channel_config']
@@ -371,15 +464,22 @@ class EnoceanSystem(BaseSystem):
             if button[0] in channel_config:
                 device_topic = channel_config[button[0]]
                 if 'dimmer' in device_topic:
-                    value = 5 if button[1] == '1' else 95
-                    while channel_topic in self.timers:
-                        self.mqtt_client.publish(device_topic,
-                                                 '{"turn": "on","brightness": ' + str(value), True)
-                        value += 10 if button[1] == '1' else -10
-                        time.sleep(0.5)
+                    if button[1] == '1':
+                        self._ramp_dimmer(channel_topic, device_topic, 5, 10)
+                    else:
+                        self._ramp_dimmer(channel_topic, device_topic, 95, -10)
                 else:
                     logging.warning("WARN: unknown device[%s]" % device_topic)
 
+    def _ramp_dimmer(self, channel_topic, device_topic, value, step):
+        # runs on the timer thread and reschedules itself while the button is held
+        if self.timers.get(channel_topic) is not True:
+            return
+        self.mqtt_client.publish(device_topic, json.dumps({"turn": "on", "brightness": value}), True)
+        if 0 < value + step < 100:
+            self.timer_scheduler.schedule(ENOCEAN_DIMMER_STEP, self._ramp_dimmer, channel_topic, device_topic,
+                                          value + step, step)
+
     def _open_communicator(self):
         try:
             serial_json = get_configuration(CUBIE_SERIAL)[0]
@@ -388,6 +488,7 @@ class EnoceanSystem(BaseSystem):
                 self.communicator = SerialCommunicator(serial_json[CUBIE_DEVICE])
             else:
                 self.communicator = SerialCommunicator(ENOCEAN_PORT)
+            self.communicator.receive = NotifyingQueue(self.notify_update)
         except SerialException:
             if "arm" in platform.machine():
                 logging.warning(
@@ -5,13 +5,18 @@ import json
 import logging
 import os
 import time
+from collections import deque
 
 from common import COLOR_YELLOW, COLOR_DEFAULT, CUBIE_GPIO, GPIO_PIN_TYPE_IN, GPIO_PIN_TYPE_OUT, \
-    CUBIE_TYPE, MQTT_HOMEASSISTANT_PREFIX
-from common import MQTT_CUBIEMEDIA, TIMEOUT_UPDATE_AVAILABILITY
+    CUBIE_TYPE, MQTT_HOMEASSISTANT_PREFIX, GPIO_BOUNCETIME, GPIO_BOUNCETIME_KEY, GPIO_PIN_TYPE_COUNTER, \
+    GPIO_IMPULSES, GPIO_IMPULSES_KEY, GPIO_COUNTER_INTERVAL, GPIO_COUNTER_INTERVAL_KEY, GPIO_PULSES_KEY, \
+    GPIO_COUNTER_SAVE_INTERVAL
+from common import MQTT_CUBIEMEDIA, TIMEOUT_UPDATE_AVAILABILITY, GPIO_POLL_INTERVAL
 from common.homeassistant import PAYLOAD_SWITCH_ACTOR, MQTT_NAME, MQTT_COMMAND_TOPIC, \
-    MQTT_STATE_TOPIC, MQTT_AVAILABILITY_TOPIC, MQTT_UNIQUE_ID, MQTT_DEVICE, MQTT_DEVICE_DESCRIPTION, \
-    MQTT_DEVICE_IDS, PAYLOAD_SENSOR, MQTT_BINARY_SENSOR, MQTT_LIGHT
+    MQTT_STATE_TOPIC, MQTT_AVAILABILITY_TOPIC, MQTT_UNIQUE_ID, MQTT_DEVICE_DESCRIPTION, \
+    MQTT_DEVICE_IDS, PAYLOAD_SENSOR, MQTT_BINARY_SENSOR, MQTT_LIGHT, PAYLOAD_SPECIAL_SENSOR, MQTT_SENSOR, \
+    MQTT_UNIT, MQTT_UNIT_OF_MEASUREMENT, MQTT_STATE_CLASS, MQTT_DEVICE_CLASS, MQTT_POWER, MQTT_ENERGY, \
+    MQTT_MEASUREMENT, MQTT_TOTAL_INCREASING
 from system.base_system import BaseSystem
 
 try:
@@ -26,6 +31,41 @@ except ImportError as error:
             f"{COLOR_YELLOW} ... could not initialise GPIO, package rpi-gpio-emu is missing{COLOR_DEFAULT}")
     raise error
 
+COUNTER_SERVICES = {
+    MQTT_POWER: {
+        MQTT_UNIT: "W",
+        MQTT_STATE_CLASS: MQTT_MEASUREMENT,
+        MQTT_DEVICE_CLASS: MQTT_POWER
+    },
+    MQTT_ENERGY: {
+        MQTT_UNIT: "kWh",
+        MQTT_STATE_CLASS: MQTT_TOTAL_INCREASING,
+        MQTT_DEVICE_CLASS: MQTT_ENERGY
+    }
+}
+
+
+class PulseCounter:
+    """Pulses of an S0 output, counted on the GPIO thread and aggregated by update."""
+
+    def __init__(self, pulses: int = 0, polled: bool = False):
+        self.pulses = pulses
+        self.polled = polled
+        self.level = 0
+        self.published_pulses = pulses
+        self.published_at = time.monotonic()
+        self.saved_pulses = pulses
+        self.saved_at = self.published_at
+
+    def __call__(self, channel=None):
+        # only called by the one GPIO thread
+        self.pulses += 1
+
+    def poll(self, level: int):
+        if level and not self.level:
+            self.pulses += 1
+        self.level = level
+
 
 class GPIOSystem(BaseSystem):
     gpio_control = GPIO
@@ -33,12 +73,22 @@ class GPIOSystem(BaseSystem):
     def __init__(self):
         self.execution_mode = CUBIE_GPIO
         super().__init__()
+        # (pin, value) of detected edges, appended by the GPIO thread and drained by update
+        self.events = deque()
+        # inputs without edge detection
+        self.polled_pins = []
+        # pin -> PulseCounter of the counter inputs
+        self.counters = {}
 
     def action(self, device: {}) -> bool:
         if device and {'id', 'value'}.issubset(device.keys()):
             logging.info("... ... action for [%s]" % device)
             topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{self.ip_address.replace('.', '_')}/{device['id']}"
-            self.mqtt_client.publish(topic, json.dumps(device['value']))
+            if str(device.get(CUBIE_TYPE)).lower() == GPIO_PIN_TYPE_COUNTER:
+                for service, value in device['value'].items():
+                    self.mqtt_client.publish(f"{topic}/{service}", json.dumps(value))
+            else:
+                self.mqtt_client.publish(topic, json.dumps(device['value']))
             return True
         return False
 
@@ -48,6 +98,9 @@ class GPIOSystem(BaseSystem):
                 logging.info("... ... send data[%s] from HA" % data)
                 self.gpio_control.output(int(data['id']),
                                          GPIO.LOW if int(data['state']) == 1 else GPIO.HIGH)
+                # outputs are not polled, the new state is published with the next update
+                self.events.append((int(data['id']), int(data['state'])))
+                self.notify_update()
                 return True
             except RuntimeError as e:
                 logging.warning(e)
@@ -57,7 +110,7 @@ class GPIOSystem(BaseSystem):
     def save(self, device=None):
         if not device:
             super().save()
-        elif device[CUBIE_TYPE] == GPIO_PIN_TYPE_IN or device[CUBIE_TYPE] == GPIO_PIN_TYPE_OUT:
+        elif device[CUBIE_TYPE] in [GPIO_PIN_TYPE_IN, GPIO_PIN_TYPE_OUT, GPIO_PIN_TYPE_COUNTER]:
             super().save(device)
         elif 'state' in device:
             for state in device['state']:
@@ -69,12 +122,30 @@ class GPIOSystem(BaseSystem):
         data = {}
 
         device_list = []
-        for device in self.config:
+        if force:
+            devices = self.config
+        else:
+            devices = [self.config.get(pin) for pin in self.polled_pins]
+            # every edge is published, also a short pulse which is over before the main loop wakes up
+            while self.events:
+                pin, value = self.events.popleft()
+                device = self.config.get(pin)
+                if device is not None and value != device['value']:
+                    self._set_value(device, value)
+                    device_list.append(device.copy())
+
+        for device in devices:
+            if device is None:
+                continue
             device_type = str(device[CUBIE_TYPE]).lower()
             if device_type == GPIO_PIN_TYPE_IN:
                 value = self.gpio_control.input(device['id'])
             elif device_type == GPIO_PIN_TYPE_OUT:
                 value = 1 if self.gpio_control.input(device['id']) == 0 else 0
+            elif device_type == GPIO_PIN_TYPE_COUNTER:
+                if device['id'] in self.counters and self.counters[device['id']].polled:
+                    self.counters[device['id']].poll(self.gpio_control.input(device['id']))
+                continue
             else:
                 logging.warning(
                     "WARN: could not find valid function for device[%s] on update" % device)
@@ -82,11 +153,10 @@ class GPIOSystem(BaseSystem):
 
             # pylint: disable=used-before-assignment
             if value != device['value'] or force:
-                logging.debug(f"... ... update GPIO [{device['id']}] with value [{value}]")
-                device['value'] = value
-                device['client_id'] = self.client_id
+                self._set_value(device, value)
                 device_list.append(device)
 
+        device_list.extend(self._update_counters(force))
         data['devices'] = device_list
 
         if self.last_update < time.time() - TIMEOUT_UPDATE_AVAILABILITY:
@@ -94,6 +164,61 @@ class GPIOSystem(BaseSystem):
             self.last_update = time.time()
         return data
 
+    def _set_value(self, device: {}, value: int):
+        logging.debug(f"... ... update GPIO [{device['id']}] with value [{value}]")
+        device['value'] = value
+        device['client_id'] = self.client_id
+
+    def _update_counters(self, force=False) -> list:
+        # power and energy of every counter once per interval, the pulses are saved less often
+        device_list = []
+        now = time.monotonic()
+        for pin, counter in self.counters.items():
+            device = self.config.get(pin)
+            if device is None:
+                continue
+            elapsed = now - counter.published_at
+            if force or elapsed >= device.get(GPIO_COUNTER_INTERVAL_KEY, GPIO_COUNTER_INTERVAL):
+                pulses = counter.pulses
+                impulses = device.get(GPIO_IMPULSES_KEY, GPIO_IMPULSES)
+                value = {MQTT_ENERGY: round(pulses / impulses, 3)}
+                if elapsed > 0 and not force:
+                    value[MQTT_POWER] = round((pulses - counter.published_pulses) / impulses * 3600000 / elapsed, 1)
+                counter.published_pulses = pulses
+                counter.published_at = now
+                device_list.append({'id': pin, CUBIE_TYPE: GPIO_PIN_TYPE_COUNTER, 'value': value,
+                                    'client_id': self.client_id})
+            if counter.pulses != counter.saved_pulses and now >= counter.saved_at + GPIO_COUNTER_SAVE_INTERVAL:
+                self._save_counter(device, counter, now)
+        return device_list
+
+    def _save_counter(self, device: {}, counter: PulseCounter, now: float):
+        counter.saved_pulses = counter.pulses
+        counter.saved_at = now
+        device[GPIO_PULSES_KEY] = counter.saved_pulses
+        self.save()
+
+    def _next_counter_update(self) -> float:
+        next_update = float('inf')
+        for pin, counter in self.counters.items():
+            device = self.config.get(pin)
+            if device is not None:
+                next_update = min(next_update, counter.published_at + device.get(GPIO_COUNTER_INTERVAL_KEY,
+                                                                                   GPIO_COUNTER_INTERVAL))
+        return time.time() + max(0.0, next_update - time.monotonic())
+
+    def _on_edge(self, channel: int):
+        # runs on the GPIO thread, the level is read right away so a short pulse is not lost
+        self.events.append((channel, self.gpio_control.input(channel)))
+        self.notify_update()
+
+    def next_update(self) -> float:
+        if self.polled_pins:
+            return time.time() + GPIO_POLL_INTERVAL
+        # edges wake up the main loop, counters are aggregated on their interval
+        return min(self.last_update + TIMEOUT_UPDATE_AVAILABILITY, super().next_update(),
+                   self._next_counter_update())
+
     def set_availability(self, state: bool):
         super().set_availability(state)
         logging.debug("... ... set availability [%s]", state)
@@ -104,11 +229,17 @@ class GPIOSystem(BaseSystem):
         super().init()
 
         self.gpio_control.setmode(GPIO.BCM)
+        self.polled_pins = []
         for device in self.config:
             device_type = str(device[CUBIE_TYPE]).lower()
             if device_type == GPIO_PIN_TYPE_IN:
                 logging.info("... set Pin %d as INPUT" % device['id'])
                 self.gpio_control.setup(device['id'], GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+                self._add_event_detect(device)
+            elif device_type == GPIO_PIN_TYPE_COUNTER:
+                logging.info("... set Pin %d as COUNTER" % device['id'])
+                self.gpio_control.setup(device['id'], GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+                self._add_counter(device)
             elif device_type == GPIO_PIN_TYPE_OUT:
                 logging.info("... set Pin %d as OUTPUT" % device['id'])
                 self.gpio_control.setup(device['id'], GPIO.OUT)
@@ -117,9 +248,33 @@ class GPIOSystem(BaseSystem):
                 logging.warning(
                     "WARN: could not find valid function for device[%s] on init" % device)
 
+    def _add_event_detect(self, device: {}):
+        try:
+            self.gpio_control.add_event_detect(device['id'], GPIO.BOTH, callback=self._on_edge,
+                                               bouncetime=int(device.get(GPIO_BOUNCETIME_KEY, GPIO_BOUNCETIME)))
+        except (RuntimeError, ValueError) as e:
+            logging.warning(f"... could not add edge detection for Pin {device['id']}, polling instead: {e}")
+            self.polled_pins.append(device['id'])
+
+    def _add_counter(self, device: {}):
+        counter = self.counters.get(device['id'])
+        if counter is None:
+            counter = self.counters[device['id']] = PulseCounter(int(device.get(GPIO_PULSES_KEY, 0)))
+        try:
+            self.gpio_control.add_event_detect(device['id'], GPIO.RISING, callback=counter,
+                                               bouncetime=int(device.get(GPIO_BOUNCETIME_KEY, GPIO_BOUNCETIME)))
+        except (RuntimeError, ValueError) as e:
+            logging.warning(f"... could not add edge detection for counter Pin {device['id']}, polling instead: {e}")
+            counter.polled = True
+            self.polled_pins.append(device['id'])
+
     def shutdown(self):
         logging.info('... set devices unavailable...')
         self.set_availability(False)
+        for pin, counter in self.counters.items():
+            device = self.config.get(pin)
+            if device is not None and counter.pulses != counter.saved_pulses:
+                self._save_counter(device, counter, time.monotonic())
 
         super().shutdown()
 
@@ -136,39 +291,41 @@ class GPIOSystem(BaseSystem):
             device_name = f"GPIO Device ({self.ip_address})"
             state_topic = f"{MQTT_CUBIEMEDIA}/gpio/{self.string_ip}/{gpio_id}"
             availability_topic = f"{MQTT_CUBIEMEDIA}/gpio/{self.string_ip}/online"
+            device_attributes = {
+                MQTT_DEVICE_IDS: f"{self.execution_mode}-{self.string_ip}",
+                MQTT_NAME: device_name,
+                MQTT_DEVICE_DESCRIPTION: f"via Gateway ({self.ip_address})"
+            }
             if gpio_type == GPIO_PIN_TYPE_OUT:
                 gpio_name = f"Output {gpio_id}"
                 unique_id = f"{self.string_ip}-out-{gpio_id}"
                 config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_LIGHT}/{self.string_ip}-{gpio_id}/config"
 
-                payload = PAYLOAD_SWITCH_ACTOR
-                payload[MQTT_NAME] = gpio_name
-                payload[MQTT_COMMAND_TOPIC] = state_topic + "/command"
-                payload[MQTT_STATE_TOPIC] = state_topic
-                payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-                payload[MQTT_UNIQUE_ID] = unique_id
-                payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = f"{self.execution_mode}-{self.string_ip}"
-                payload[MQTT_DEVICE][MQTT_NAME] = device_name
-                payload[MQTT_DEVICE][
-                    MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
+                payload = self.discovery.render(PAYLOAD_SWITCH_ACTOR, {
+                    MQTT_NAME: gpio_name,
+                    MQTT_COMMAND_TOPIC: state_topic + "/command",
+                    MQTT_STATE_TOPIC: state_topic,
+                    MQTT_AVAILABILITY_TOPIC: availability_topic,
+                    MQTT_UNIQUE_ID: unique_id
+                }, device_attributes)
+            elif gpio_type == GPIO_PIN_TYPE_COUNTER:
+                self._announce_counter(gpio, state_topic, availability_topic, device_attributes)
+                continue
             elif gpio_type == GPIO_PIN_TYPE_IN:
                 gpio_name = f"Input {gpio_id}"
                 unique_id = f"{self.string_ip}-in-{gpio_id}"
                 config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_BINARY_SENSOR}/{self.string_ip}-{gpio_id}/config"
 
-                payload = PAYLOAD_SENSOR
-                payload[MQTT_NAME] = gpio_name
-                payload[MQTT_STATE_TOPIC] = state_topic
-                payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-                payload[MQTT_UNIQUE_ID] = unique_id
-                payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = f"{self.execution_mode}-{self.string_ip}"
-                payload[MQTT_DEVICE][MQTT_NAME] = device_name
-                payload[MQTT_DEVICE][
-                    MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
+                payload = self.discovery.render(PAYLOAD_SENSOR, {
+                    MQTT_NAME: gpio_name,
+                    MQTT_STATE_TOPIC: state_topic,
+                    MQTT_AVAILABILITY_TOPIC: availability_topic,
+                    MQTT_UNIQUE_ID: unique_id
+                }, device_attributes)
             else:
                 logging.warning(f"unknown gpio type for [{gpio}]")
                 continue
-            self.mqtt_client.publish(config_topic, json.dumps(payload), retain=True)
+            self.publish_discovery(config_topic, payload)
 
         data = self.update(True)
         for device in data['devices']:
@@ -176,4 +333,18 @@ class GPIOSystem(BaseSystem):
 
         topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{self.string_ip}/+/command"
         logging.info("... ... subscribe to [%s] for gpio output commands" % topic)
-        self.mqtt_client.subscribe(topic, 2)
+        self.mqtt_client.subscribe(topic, 2, self.on_command)
+
+    def _announce_counter(self, gpio: {}, state_topic: str, availability_topic: str, device_attributes: {}):
+        for service, attributes in COUNTER_SERVICES.items():
+            config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_SENSOR}/{self.string_ip}-{gpio['id']}-{service}/config"
+            payload = self.discovery.render(PAYLOAD_SPECIAL_SENSOR, {
+                MQTT_UNIT_OF_MEASUREMENT: attributes[MQTT_UNIT],
+                MQTT_STATE_CLASS: attributes[MQTT_STATE_CLASS],
+                MQTT_DEVICE_CLASS: attributes[MQTT_DEVICE_CLASS],
+                MQTT_NAME: f"Counter {gpio['id']} {service.title()}",
+                MQTT_STATE_TOPIC: f"{state_topic}/{service}",
+                MQTT_AVAILABILITY_TOPIC: availability_topic,
+                MQTT_UNIQUE_ID: f"{self.string_ip}-counter-{gpio['id']}-{service}"
+            }, device_attributes)
+            self.publish_discovery(config_topic, payload)
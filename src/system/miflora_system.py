@@ -1,5 +1,4 @@
 import asyncio
-import json
 import logging
 import threading
 import time
@@ -13,7 +12,7 @@ from common import MQTT_CUBIEMEDIA, CUBIE_MIFLORA, MQTT_HOMEASSISTANT_PREFIX, TI
 from common.homeassistant import MQTT_BATTERY, MQTT_TEMPERATURE, MQTT_BRIGHTNESS, MQTT_MOISTURE, \
     MQTT_CONDUCTIVITY, MQTT_UNIT, MQTT_STATE_CLASS, MQTT_DEVICE_CLASS, \
     MQTT_MEASUREMENT, MQTT_SENSOR, PAYLOAD_SPECIAL_SENSOR, MQTT_UNIT_OF_MEASUREMENT, MQTT_NAME, \
-    MQTT_STATE_TOPIC, MQTT_AVAILABILITY_TOPIC, MQTT_UNIQUE_ID, MQTT_DEVICE, MQTT_DEVICE_IDS, \
+    MQTT_STATE_TOPIC, MQTT_AVAILABILITY_TOPIC, MQTT_UNIQUE_ID, MQTT_DEVICE_IDS, \
     MQTT_DEVICE_DESCRIPTION
 from common.miflora import XIAOMI_FLOWER_CARE_DISCOVERY, XIAOMI_DEVICE_MODE_CHANGE, \
     XIAOMI_REAL_TIME_DATA_UUID, XIAOMI_FLOWER_CARE_BATTERY_LEVEL
@@ -105,14 +104,13 @@ class MiFloraSystem(BaseSystem):
             device_found = False
             device_list = []
             for device_mac in devices.keys():
-                for device in self.config:
-                    mac_address = device['id']
-                    if device_mac == mac_address:
-                        self._read(mac_address)
-                        if 'state' in devices[mac_address]:
-                            device['state'] = devices[mac_address]['state']
-                            device_list.append(device)
-                        device_found = True
+                device = self.config.get(device_mac)
+                if device is not None:
+                    self._read(device_mac)
+                    if 'state' in devices[device_mac]:
+                        device['state'] = devices[device_mac]['state']
+                        device_list.append(device)
+                    device_found = True
 
                 if not device_found:
                     self._read(device_mac)
@@ -128,6 +126,11 @@ class MiFloraSystem(BaseSystem):
 
         return data
 
+    def next_update(self) -> float:
+        if self.last_update is not None:
+            return min(self.last_update + TIMEOUT_UPDATE_MIFLORA, super().next_update())
+        return super().next_update()
+
     def announce(self):
         super().announce()
 
@@ -150,21 +153,21 @@ class MiFloraSystem(BaseSystem):
                 unique_id = f"{string_id}-{self.execution_mode}-{service}"
                 config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_SENSOR}/{string_id}-{service}/config"
 
-                payload = PAYLOAD_SPECIAL_SENSOR
-                payload[MQTT_UNIT_OF_MEASUREMENT] = attributes[MQTT_UNIT]
-                payload[MQTT_STATE_CLASS] = attributes[MQTT_STATE_CLASS]
-                payload[MQTT_DEVICE_CLASS] = attributes[MQTT_DEVICE_CLASS]
-                payload[MQTT_NAME] = service_name
-                payload[MQTT_STATE_TOPIC] = state_topic
-                payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-                payload[MQTT_UNIQUE_ID] = unique_id
-                payload[MQTT_DEVICE][
-                    MQTT_DEVICE_IDS] = f"{self.execution_mode}-{mac.replace(':', '')}"
-                payload[MQTT_DEVICE][MQTT_NAME] = plant_name
-                payload[MQTT_DEVICE][
-                    MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
-
-                self.mqtt_client.publish(config_topic, json.dumps(payload), retain=True)
+                payload = self.discovery.render(PAYLOAD_SPECIAL_SENSOR, {
+                    MQTT_UNIT_OF_MEASUREMENT: attributes[MQTT_UNIT],
+                    MQTT_STATE_CLASS: attributes[MQTT_STATE_CLASS],
+                    MQTT_DEVICE_CLASS: attributes[MQTT_DEVICE_CLASS],
+                    MQTT_NAME: service_name,
+                    MQTT_STATE_TOPIC: state_topic,
+                    MQTT_AVAILABILITY_TOPIC: availability_topic,
+                    MQTT_UNIQUE_ID: unique_id
+                }, {
+                    MQTT_DEVICE_IDS: f"{self.execution_mode}-{mac.replace(':', '')}",
+                    MQTT_NAME: plant_name,
+                    MQTT_DEVICE_DESCRIPTION: f"via Gateway ({self.ip_address})"
+                })
+
+                self.publish_discovery(config_topic, payload)
 
     def set_availability(self, state: bool):
         super().set_availability(state)
@@ -191,6 +194,7 @@ class MiFloraSystem(BaseSystem):
                     logging.info("... ... found new device: %s, %s", device.name, device.address)
                     devices[device.address] = {}
                     self.last_update = 0
+                    self.notify_update()
                 return
             else:
                 logging.warning("Recieved Data from %s: %s", device.address, advertisement_data)
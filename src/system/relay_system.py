@@ -1,22 +1,21 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
-import json
 import logging
 import socket
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
-import requests
-from requests import ConnectionError, ReadTimeout
+from requests import RequestException
 
-from common import MQTT_CUBIEMEDIA, RELAY_USERNAME, RELAY_PASSWORD, \
-    STATE_UNKNOWN, \
-    TIMEOUT_UPDATE_AVAILABILITY, TIMEOUT_UPDATE_RELAY, CUBIE_RELAY, CUBIE_TYPE, QOS, \
-    MQTT_HOMEASSISTANT_PREFIX
+from common import MQTT_CUBIEMEDIA, TIMEOUT_UPDATE_AVAILABILITY, TIMEOUT_UPDATE_RELAY, CUBIE_RELAY, CUBIE_TYPE, \
+    QOS, MQTT_HOMEASSISTANT_PREFIX, RELAY_POOL_SIZE, RELAY_SWEEP_DEADLINE, RELAY_COMBINE_COMMANDS
 from common.homeassistant import MQTT_LIGHT, PAYLOAD_SWITCH_ACTOR, \
     MQTT_NAME, MQTT_COMMAND_TOPIC, MQTT_STATE_TOPIC, MQTT_AVAILABILITY_TOPIC, MQTT_UNIQUE_ID, \
-    MQTT_DEVICE, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION
+    MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION
+from common.relay_board import RelayBoard, StatusError, CommandCoalescer
+from common.timers import TimerScheduler
 from system.base_system import BaseSystem
 
 DISCOVERY_MESSAGE = "DISCOVER_RELAIS_MODULE".encode()
@@ -25,93 +24,178 @@ DESTINATION_ADDRESS = ('<broadcast>', 30303)
 
 class RelaySystem(BaseSystem):
     relay_board_list = []
-    all_relay_boards_scanned = False
-    index_of_current_relay_board = 0
     scan_thread = threading.Thread()
     scan_thread_event = threading.Event()
     discovery_socket = None
+    sweep_deadline = RELAY_SWEEP_DEADLINE
 
     def __init__(self):
         self.execution_mode = CUBIE_RELAY
+        # ip -> RelayBoard, all boards are polled at the same time by the executor
+        self.relay_boards = {}
+        self.executor = None
+        # ip -> future of a poll which was not done within the deadline of its sweep, update runs on the
+        # main loop and on the mqtt thread with load, reentrant for a shutdown from the signal handler
+        self.pending_polls = {}
+        self._poll_lock = threading.RLock()
+        # boards which got commands and are polled with the next update, added by the executor
+        self.refresh_boards = set()
+        self._refresh_lock = threading.Lock()
+        # a sweep is done when its last poll was collected
+        self.sweeping = False
+        self.command_scheduler = TimerScheduler("relay-commands")
+        self.commands = CommandCoalescer(self._send_commands, self.command_scheduler)
         super().__init__()
 
     def action(self, device: {}) -> bool:
         if all(attribute in device for attribute in ['id', 'state']):
-            for known_device in self.config:
-                if device['id'] == known_device['id']:
-                    for index, state in device['state'].items():
-                        relay_id = int(index) + 1
-                        logging.info("... ... action for [%s] Relay [%s] -> [%s]" % (
-                            device['id'], relay_id, state))
-                        self.mqtt_client.publish(
-                            f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device['id'].replace('.', '_')}/{relay_id}",
-                            state, True)
-                        known_device['state'][index] = state
-                    return True
+            known_device = self.config.get(device['id'])
+            if known_device is not None:
+                for index, state in device['state'].items():
+                    relay_id = int(index) + 1
+                    logging.info("... ... action for [%s] Relay [%s] -> [%s]" % (
+                        device['id'], relay_id, state))
+                    self.mqtt_client.publish(
+                        f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{device['id'].replace('.', '_')}/{relay_id}",
+                        state, True)
+                    known_device['state'][index] = state
+                return True
         else:
             logging.warning(f"... received action with wrong data [{device}]")
         return False
 
     def send(self, data) -> bool:
         toggle = False
-        for known_device in self.config:
-            if data['ip'] == known_device['id']:
-                self.index_of_current_relay_board = self.config.index(known_device)
-                if 'toggle' in known_device and int(data['id']) in known_device['toggle']:
-                    toggle = True
-                logging.info("... ... send data[%s] from HA with toggle[%s]" % (data, toggle))
-                self._set_status(data['ip'], data['id'], data['state'], toggle)
-                self.last_update = -1
-                self.all_relay_boards_scanned = False
-                self.index_of_current_relay_board = 0
-                return True
+        known_device = self.config.get(data['ip'])
+        if known_device is not None:
+            if 'toggle' in known_device and int(data['id']) in known_device['toggle']:
+                toggle = True
+            logging.info("... ... send data[%s] from HA with toggle[%s]" % (data, toggle))
+            self.commands.add(data['ip'], data['id'], data['state'], toggle)
+            return True
 
         return super().send(data)
 
     def update(self):
+        with self._poll_lock:
+            return self._update()
+
+    def _update(self) -> {}:
         data = {}
-        if self.last_update < time.time() - TIMEOUT_UPDATE_RELAY and len(self.relay_board_list) > 0:
-            relay_board = self.relay_board_list[self.index_of_current_relay_board]
-            logging.info(f"... ... updating relay board [{relay_board}]")
-            known_device = None
-            for temp_device in self.config:
-                if relay_board == temp_device['id']:
-                    known_device = temp_device
-
-            relay_board_json = {'id': str(relay_board), CUBIE_TYPE: CUBIE_RELAY,
-                                'client_id': self.client_id}
-            status_dict = self._read_status(relay_board)
-            if known_device:
-                logging.debug("... ... ... scanning for changes on known device")
-                relay_state_changed_list = {}
-                send_data = False
-                for index, status in status_dict.items():
-                    if status != known_device['state'][index]:
-                        relay_state_changed_list[index] = status
-                        send_data = True
-
-                if send_data:
-                    logging.debug("... ... ... found changes, sending action data")
-                    relay_board_json['state'] = relay_state_changed_list
-                    data['devices'] = [relay_board_json]
+        sweep = self.last_update < time.time() - TIMEOUT_UPDATE_RELAY and len(self.relay_board_list) > 0
+        if sweep:
+            # every board is polled once per sweep, a slow board is collected by later updates
+            # without polling the others again
+            if self.last_update < 0:
+                self.last_update = time.time() - int(TIMEOUT_UPDATE_RELAY * 0.3)
             else:
-                logging.debug("... ... ... saving new device with state")
-                relay_board_json['state'] = status_dict
-                self.save(relay_board_json)
-
-            self.index_of_current_relay_board += 1
-            if self.index_of_current_relay_board >= len(self.relay_board_list):
-                self.index_of_current_relay_board = 0
-                self.all_relay_boards_scanned = True
-
-            if self.all_relay_boards_scanned:
-                if self.last_update < 0:
-                    self.last_update = time.time() - int(TIMEOUT_UPDATE_RELAY * 0.3)
-                else:
-                    self.last_update = time.time()
-                self.set_availability(True)
+                self.last_update = time.time()
+            self.sweeping = True
+        with self._refresh_lock:
+            refresh_boards, self.refresh_boards = self.refresh_boards, set()
+        if self.pending_polls or sweep or refresh_boards:
+            devices = []
+            relay_boards = list(self.relay_board_list) if sweep else list(refresh_boards)
+            for relay_board, status_dict in self._poll_relay_boards(relay_boards).items():
+                device = self._update_relay_board(relay_board, status_dict)
+                if device:
+                    devices.append(device)
+            if devices:
+                data['devices'] = devices
+
+        if self.sweeping and not self.pending_polls:
+            self.sweeping = False
+            self.set_availability(True)
         return data
 
+    def _poll_relay_boards(self, relay_boards: list) -> dict:
+        # polls the available boards at once, boards which are not done within the deadline are
+        # collected by a later update
+        now = time.monotonic()
+        submitted = []
+        for relay_board in relay_boards:
+            board = self._get_relay_board(relay_board)
+            if relay_board not in self.pending_polls and board.is_available(now):
+                logging.info(f"... ... updating relay board [{relay_board}]")
+                future = self._get_executor().submit(self._read_status, relay_board)
+                future.add_done_callback(lambda _: self.notify_update())
+                self.pending_polls[relay_board] = future
+                submitted.append(future)
+
+        # only new polls are waited for, polls of earlier updates are collected when they are done
+        wait(submitted, timeout=self.sweep_deadline)
+        results = {}
+        for relay_board, future in list(self.pending_polls.items()):
+            if future.done():
+                del self.pending_polls[relay_board]
+                results[relay_board] = future.result()
+        return results
+
+    def _update_relay_board(self, relay_board, status_dict) -> {}:
+        online_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(relay_board).replace('.', '_')}/online"
+        if status_dict is None:
+            # the next sweep comes earlier, without polling the other boards again right away
+            self.last_update = min(self.last_update, time.time() - int(TIMEOUT_UPDATE_RELAY * 0.3))
+            self.mqtt_client.publish(online_topic, 'false')
+            return None
+        self.mqtt_client.publish(online_topic, 'true')
+
+        known_device = self.config.get(relay_board)
+        relay_board_json = {'id': str(relay_board), CUBIE_TYPE: CUBIE_RELAY,
+                            'client_id': self.client_id}
+        if known_device:
+            logging.debug("... ... ... scanning for changes on known device")
+            relay_state_changed_list = {}
+            for index, status in status_dict.items():
+                if status != known_device['state'][index]:
+                    relay_state_changed_list[index] = status
+
+            if relay_state_changed_list:
+                logging.debug("... ... ... found changes, sending action data")
+                relay_board_json['state'] = relay_state_changed_list
+                return relay_board_json
+        else:
+            logging.debug("... ... ... saving new device with state")
+            relay_board_json['state'] = status_dict
+            self.save(relay_board_json)
+        return None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=RELAY_POOL_SIZE, thread_name_prefix="relay-poll")
+        return self.executor
+
+    def _send_commands(self, ip, commands: list):
+        # called by the coalescer, the requests run on the executor
+        self._get_executor().submit(self._execute_commands, ip, commands)
+
+    def _execute_commands(self, ip, commands: list):
+        if len(commands) == 1:
+            self._set_status(ip, *commands[0])
+        else:
+            known_device = self.config.get(ip)
+            combine = bool(known_device and known_device.get(RELAY_COMBINE_COMMANDS))
+            logging.info(f"... ... send [{len(commands)}] commands to relay board [{ip}] combined [{combine}]")
+            try:
+                self._get_relay_board(ip).set_statuses(commands, combine)
+            except RequestException:
+                self._set_status_failed(ip)
+        with self._refresh_lock:
+            self.refresh_boards.add(ip)
+        self.notify_update()
+
+    def _get_relay_board(self, ip) -> RelayBoard:
+        board = self.relay_boards.get(ip)
+        if board is None:
+            board = self.relay_boards[ip] = RelayBoard(ip)
+        return board
+
+    def next_update(self) -> float:
+        # polls which were not done within the deadline wake up the main loop when they are done
+        if len(self.relay_board_list) > 0:
+            return min(self.last_update + TIMEOUT_UPDATE_RELAY, super().next_update())
+        return super().next_update()
+
     def set_availability(self, state: bool):
         super().set_availability(state)
         for device in self.config:
@@ -140,6 +224,16 @@ class RelaySystem(BaseSystem):
             self.scan_thread_event.set()
             self.scan_thread.join()
 
+        self.command_scheduler.shutdown()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        with self._poll_lock:
+            self.pending_polls = {}
+        for board in self.relay_boards.values():
+            board.close()
+        self.relay_boards = {}
+
         super().shutdown()
 
     def announce(self):
@@ -151,15 +245,10 @@ class RelaySystem(BaseSystem):
         should_save = False
         if device is not None:
             if device[CUBIE_TYPE] == CUBIE_RELAY and self.system_config['devices_can_be_added']:
-                add = True
-                for known_device in self.config:
-                    if device['id'] == known_device['id']:
-                        add = False
-                        break
-                if add:
+                if self.config.get(device['id']) is None:
                     self.config.append(device)
                     should_save = True
-                    self.announce()
+                    self.announce_device(device)
         else:
             should_save = True
 
@@ -190,6 +279,7 @@ class RelaySystem(BaseSystem):
                         logging.info(f"... ... found new module[{address[0]}]")
                         self.relay_board_list.append(address[0])
                         self.last_update = -1
+                        self.notify_update()
                         continue
                 else:
                     logging.debug(f"ignore unknown device [{buf}] with [{address}]")
@@ -202,60 +292,32 @@ class RelaySystem(BaseSystem):
         return True
 
     def _read_status(self, ip) -> dict:
-        status_dict = {}
-        auth = (RELAY_USERNAME, RELAY_PASSWORD)
-
-        url = "http://" + str(ip) + "/status.xml"
+        # runs on the executor, None if the board did not answer
         try:
-            r = requests.get(url, auth=auth, timeout=3)
-
-            content = r.text
-            logging.debug(f"... ... content:\n{content}")
-            self.mqtt_client.publish(
-                f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(ip).replace('.', '_')}/online",
-                'true')
-            for line in content.splitlines():
-                if "relay" in line:
-                    index = line[line.index("<relay") + 6:line.index(">")]
-                    status = line[line.index(">") + 1:line.index("</")]
-                    if status == "1" or status == "0":
-                        status_dict[index] = status
-                    else:
-                        status_dict[index] = STATE_UNKNOWN
-                        logging.warning("... ... WARN: state [%s] unknown" % status)
-
-        except ConnectionError:
-            logging.error(f"could not read status from relay board [{ip}]")
-            self.last_update = -1
-            self.mqtt_client.publish(
-                f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(ip).replace('.', '_')}/online",
-                'false')
-        finally:
-            return status_dict
+            return self._get_relay_board(ip).read_status()
+        except (RequestException, StatusError) as e:
+            logging.error(f"could not read status from relay board [{ip}]: {e}")
+            return None
 
     def _set_status(self, ip, relay_id, state, toggle: bool = False):
-        auth = (RELAY_USERNAME, RELAY_PASSWORD)
-
-        url = "http://" + str(ip) + "/io.cgi?"
-        url += "DOA" if state == b'1' or str(state) == "1" else "DOI"
-        url += relay_id
-        if toggle:
-            url += '=30'  # + str(int(toggle) * 10)
         try:
-            requests.get(url, auth=auth, timeout=3)
-        except (ConnectionError, ReadTimeout):
-            logging.error(f"could not set value on relay board [{ip}]")
-            self.last_update = -1
-            self.mqtt_client.publish(
-                f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(ip).replace('.', '_')}/online",
-                'false')
+            self._get_relay_board(ip).set_status(relay_id, state, toggle)
+        except RequestException:
+            self._set_status_failed(ip)
+
+    def _set_status_failed(self, ip):
+        logging.error(f"could not set value on relay board [{ip}]")
+        self.last_update = -1
+        self.mqtt_client.publish(
+            f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{str(ip).replace('.', '_')}/online",
+            'false')
 
     def announce_device(self, device):
         string_id = device['id'].replace('.', '_')
         device_name = f"Relay Board ({device['id']})"
         service_specific_command_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{string_id}/+/command"
         logging.info(f"... ... subscribe to channel [{service_specific_command_topic}]")
-        self.mqtt_client.subscribe(service_specific_command_topic, QOS)
+        self.mqtt_client.subscribe(service_specific_command_topic, QOS, self.on_command)
 
         logging.info("... ... announce relay board with all actors and sensors [%s]",
                      device['state'])
@@ -268,15 +330,16 @@ class RelaySystem(BaseSystem):
             unique_id = f"{string_id}-light-{relay_id}"
             config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{MQTT_LIGHT}/{string_id}-{relay_id}/config"
 
-            payload = PAYLOAD_SWITCH_ACTOR
-            payload[MQTT_NAME] = relay_name
-            payload[MQTT_COMMAND_TOPIC] = state_topic + "/command"
-            payload[MQTT_STATE_TOPIC] = state_topic
-            payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-            payload[MQTT_UNIQUE_ID] = unique_id
-            payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = device[
-                'id']  # f"{self.execution_mode}-{string_id}"
-            payload[MQTT_DEVICE][MQTT_NAME] = device_name
-            payload[MQTT_DEVICE][MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
-
-            self.mqtt_client.publish(config_topic, json.dumps(payload), retain=True)
+            payload = self.discovery.render(PAYLOAD_SWITCH_ACTOR, {
+                MQTT_NAME: relay_name,
+                MQTT_COMMAND_TOPIC: state_topic + "/command",
+                MQTT_STATE_TOPIC: state_topic,
+                MQTT_AVAILABILITY_TOPIC: availability_topic,
+                MQTT_UNIQUE_ID: unique_id
+            }, {
+                MQTT_DEVICE_IDS: device['id'],  # f"{self.execution_mode}-{string_id}"
+                MQTT_NAME: device_name,
+                MQTT_DEVICE_DESCRIPTION: f"via Gateway ({self.ip_address})"
+            })
+
+            self.publish_discovery(config_topic, payload)
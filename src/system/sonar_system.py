@@ -13,7 +13,7 @@ from common import COLOR_YELLOW, COLOR_DEFAULT, CUBIE_SONAR, SONAR_PORT, CUBIE_D
 from common import MQTT_CUBIEMEDIA
 from common.homeassistant import MQTT_NAME, MQTT_STATE_TOPIC, MQTT_AVAILABILITY_TOPIC, \
     MQTT_UNIT_OF_MEASUREMENT, \
-    MQTT_STATE_CLASS, MQTT_UNIQUE_ID, MQTT_DEVICE, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION, \
+    MQTT_STATE_CLASS, MQTT_UNIQUE_ID, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION, \
     MQTT_MEASUREMENT, MQTT_SENSOR, MQTT_UNIT, MQTT_CONFIG_TOPIC, PAYLOAD_SENSOR
 from common.python import get_configuration
 from system.base_system import BaseSystem
@@ -138,17 +138,18 @@ class SonarSystem(BaseSystem):
         data['devices'] = device_list
         return data
 
+    def next_update(self) -> float:
+        if self.update_interval:
+            return min(self.last_update + self.update_interval, super().next_update())
+        return super().next_update()
+
     def announce(self):
         super().announce()
         for device in self.config:
             if 'id' not in device:
-                already_exists = False
-                for temp_device in self.config:
-                    if 'id' in temp_device and temp_device['id'] == self.ip_address:
-                        already_exists = True
-                        break
-                if not already_exists:
+                if self.config.get(self.ip_address) is None:
                     device['id'] = self.ip_address
+                    self.config.reindex()
                 else:
                     logging.warning(
                         f'{COLOR_YELLOW}something ist wrong with your config (id matching){COLOR_DEFAULT}')
@@ -167,18 +168,20 @@ class SonarSystem(BaseSystem):
                 unique_id = f"{string_id}-{self.execution_mode}-{service}"
                 config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{attributes[MQTT_CONFIG_TOPIC]}/{string_id}-{service}/config"
 
-                payload = PAYLOAD_SENSOR
-                payload[MQTT_NAME] = service_name
-                payload[MQTT_STATE_TOPIC] = state_topic
-                payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-                payload[MQTT_STATE_CLASS] = attributes[MQTT_STATE_CLASS]
-                payload[MQTT_UNIT_OF_MEASUREMENT] = attributes[MQTT_UNIT]
-                payload[MQTT_UNIQUE_ID] = unique_id
-                payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = f"{self.execution_mode}-{self.string_ip}"
-                payload[MQTT_DEVICE][MQTT_NAME] = device_name
-                payload[MQTT_DEVICE][MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
-
-                self.mqtt_client.publish(config_topic, json.dumps(payload), retain=True)
+                payload = self.discovery.render(PAYLOAD_SENSOR, {
+                    MQTT_NAME: service_name,
+                    MQTT_STATE_TOPIC: state_topic,
+                    MQTT_AVAILABILITY_TOPIC: availability_topic,
+                    MQTT_STATE_CLASS: attributes[MQTT_STATE_CLASS],
+                    MQTT_UNIT_OF_MEASUREMENT: attributes[MQTT_UNIT],
+                    MQTT_UNIQUE_ID: unique_id
+                }, {
+                    MQTT_DEVICE_IDS: f"{self.execution_mode}-{self.string_ip}",
+                    MQTT_NAME: device_name,
+                    MQTT_DEVICE_DESCRIPTION: f"via Gateway ({self.ip_address})"
+                })
+
+                self.publish_discovery(config_topic, payload)
 
     def set_availability(self, state: bool):
         super().set_availability(state)
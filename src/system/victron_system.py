@@ -13,7 +13,7 @@ from common import MQTT_CUBIEMEDIA, CUBIE_VICTRON, QOS, EXPORT_CORRECTION_FACTOR
     IMPORT_CORRECTION_FACTOR, COLOR_YELLOW, COLOR_DEFAULT, MQTT_HOMEASSISTANT_PREFIX
 from common.homeassistant import MQTT_NAME, MQTT_COMMAND_TOPIC, \
     MQTT_STATE_TOPIC, MQTT_AVAILABILITY_TOPIC, MQTT_UNIT_OF_MEASUREMENT, MQTT_STATE_CLASS, \
-    MQTT_DEVICE_CLASS, MQTT_UNIQUE_ID, MQTT_DEVICE, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION, \
+    MQTT_DEVICE_CLASS, MQTT_UNIQUE_ID, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION, \
     MQTT_BINARY_SENSOR, PAYLOAD_SWITCH_ACTOR, MQTT_BATTERY, MQTT_POWER, \
     MQTT_MEASUREMENT, MQTT_ENERGY, MQTT_SENSOR, MQTT_SWITCH, \
     PAYLOAD_SPECIAL_SENSOR, MQTT_UNIT, MQTT_CONFIG_TOPIC, VICTRON_MQTT_TOPIC, MQTT_TOTAL_INCREASING
@@ -163,6 +163,11 @@ class VictronSystem(BaseSystem):
         self._updated_data = {"devices": []}
         return data
 
+    def next_update(self) -> float:
+        if len(self._updated_data["devices"]) > 0:
+            return time.time()
+        return super().next_update()
+
     def init(self):
         super().init()
 
@@ -205,7 +210,7 @@ class VictronSystem(BaseSystem):
         device_name = f"Victron System ({self.victron_system['id']})"
         service_specific_command_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{string_id}/+/command"
         logging.info(f"... ... subscribe to channel [{service_specific_command_topic}]")
-        self.mqtt_client.subscribe(service_specific_command_topic, QOS)
+        self.mqtt_client.subscribe(service_specific_command_topic, QOS, self.on_command)
 
         logging.info("... ... announce victron_system with all actors and sensors [%s]", self.victron_system)
         availability_topic = f"{MQTT_CUBIEMEDIA}/{self.execution_mode}/{string_id}/online"
@@ -216,24 +221,28 @@ class VictronSystem(BaseSystem):
             unique_id = f"{string_id}-{self.execution_mode}-{service}"
             config_topic = f"{MQTT_HOMEASSISTANT_PREFIX}/{attributes[MQTT_CONFIG_TOPIC]}/{string_id}-{service}/config"
 
+            entity = {
+                MQTT_NAME: service_name,
+                MQTT_STATE_TOPIC: state_topic,
+                MQTT_AVAILABILITY_TOPIC: availability_topic,
+                MQTT_UNIQUE_ID: unique_id
+            }
             if attributes[MQTT_CONFIG_TOPIC] == MQTT_SENSOR:
-                payload = PAYLOAD_SPECIAL_SENSOR
-                payload[MQTT_UNIT_OF_MEASUREMENT] = attributes[MQTT_UNIT]
-                payload[MQTT_STATE_CLASS] = attributes[MQTT_STATE_CLASS]
-                payload[MQTT_DEVICE_CLASS] = attributes[MQTT_DEVICE_CLASS]
+                template = PAYLOAD_SPECIAL_SENSOR
+                entity[MQTT_UNIT_OF_MEASUREMENT] = attributes[MQTT_UNIT]
+                entity[MQTT_STATE_CLASS] = attributes[MQTT_STATE_CLASS]
+                entity[MQTT_DEVICE_CLASS] = attributes[MQTT_DEVICE_CLASS]
             else:
-                payload = PAYLOAD_SWITCH_ACTOR
-                payload[MQTT_COMMAND_TOPIC] = state_topic + "/command"
-
-            payload[MQTT_NAME] = service_name
-            payload[MQTT_STATE_TOPIC] = state_topic
-            payload[MQTT_AVAILABILITY_TOPIC] = availability_topic
-            payload[MQTT_UNIQUE_ID] = unique_id
-            payload[MQTT_DEVICE][MQTT_DEVICE_IDS] = f"{self.execution_mode}-{self.string_ip}"
-            payload[MQTT_DEVICE][MQTT_NAME] = device_name
-            payload[MQTT_DEVICE][MQTT_DEVICE_DESCRIPTION] = f"via Gateway ({self.ip_address})"
-
-            self.mqtt_client.publish(config_topic, json.dumps(payload), retain=True)
+                template = PAYLOAD_SWITCH_ACTOR
+                entity[MQTT_COMMAND_TOPIC] = state_topic + "/command"
+
+            payload = self.discovery.render(template, entity, {
+                MQTT_DEVICE_IDS: f"{self.execution_mode}-{self.string_ip}",
+                MQTT_NAME: device_name,
+                MQTT_DEVICE_DESCRIPTION: f"via Gateway ({self.ip_address})"
+            })
+
+            self.publish_discovery(config_topic, payload)
         self.set_availability(True)
 
     def load(self):
@@ -281,6 +290,7 @@ class VictronSystem(BaseSystem):
                     service = service_from_topic(topic)
                     value = json.loads(message_payload)['value']
                     self._updated_data["devices"].append({service: value})
+                    self.notify_update()
                 except JSONDecodeError:
                     logging.warning(
                         f"message on topic [{topic}] with value [{msg.payload}] seems not to be json format")
@@ -5,18 +5,23 @@ import threading
 import time
 
 import paho.mqtt.client as mqtt
-from flask import Flask, url_for, render_template, request, send_from_directory
+from flask import Flask, url_for, render_template, request, send_from_directory, Response
 from werkzeug.utils import redirect
 
 from common import CUBIE_GPIO, CUBIE_ENOCEAN, CUBIE_RELAY, CUBIE_VICTRON, CUBIE_SONAR, CUBIE_BALBOA, \
-    CUBIE_MIFLORA, DEVICES_CAN_BE_ADDED, CUBIE_SYSTEM, MQTT_CUBIEMEDIA, CUBIE_GIT_UPDATER
+    CUBIE_MIFLORA, DEVICES_CAN_BE_ADDED, CUBIE_SYSTEM, MQTT_CUBIEMEDIA, CUBIE_GIT_UPDATER, \
+    WEBTOOL_CONFIGURATION_MAX_AGE
+from common.metrics import read_metrics_files
 from common.network import get_ip_address
 from common.python import get_configuration, execute_command, get_variable_type_from_string, \
-    get_mqtt_configuration, get_system_configuration, set_default_configuration, set_configuration
+    get_mqtt_configuration, get_system_configuration, set_default_configuration, set_configuration, \
+    set_configuration_cache_max_age
 from mqtt_client import configure_logger
 
 app = Flask(__name__)
 configure_logger(False)
+# the mqtt clients change the configuration in their own processes, do not show outdated devices for long
+set_configuration_cache_max_age(WEBTOOL_CONFIGURATION_MAX_AGE)
 service_list = [
     {"id": CUBIE_ENOCEAN, "name": "Cubie-EnOcean", "icon": "enocean.png",
      "description": "With an EnOcean Hat on your Raspberry you can communicate with EnOcean Devices"},
@@ -214,6 +219,11 @@ def system_reboot():
     return redirect(url_for('system_wait'))
 
 
+@app.route('/metrics')
+def metrics():
+    return Response(read_metrics_files(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'), 'favicon.png',
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Simulation of N EnOcean gateways which hear the same devices with noisy signal strength.
+
+Compares the single reading rule (a gateway takes over as soon as one reading is better than the
+stored dbm of the device) with the GatewayArbiter. Halfway through some devices are moved, the
+simulation measures handovers, messages, config writes and the time until the best gateway owns
+a moved device for good.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_arbitration.py [gateways] [devices]
+"""
+import random
+import statistics
+import sys
+
+from common import ARBITRATION_INTERVAL, ARBITRATION_HYSTERESIS
+from common.arbitration import GatewayArbiter
+
+DURATION = 3600
+MOVE_AT = 1800
+TELEGRAM_INTERVAL = 10
+NOISE = 4
+SPIKE_PROBABILITY = 0.02
+SPIKE = 15
+RECEIVE_PROBABILITY = 0.9
+# a new owner announces the discovery configs of the device, four channels with long push
+ANNOUNCE_MESSAGES = 9
+ANNOUNCE_BYTES = 9 * 400
+
+
+class World:
+    def __init__(self, gateways: int, devices: int, seed: int = 42):
+        self.random = random.Random(seed)
+        self.gateways = [f"10.0.0.{index}-enocean-client" for index in range(gateways)]
+        self.devices = [f"{index:08x}" for index in range(devices)]
+        self.rssi = {device: self._place() for device in self.devices}
+        self.moved = set(self.random.sample(self.devices, max(1, devices // 5)))
+        self.best_before_move = {}
+        # devices have been learned by any gateway before
+        self.initial_owner = {device: self.random.choice(self.gateways) for device in self.devices}
+
+    def _place(self) -> {}:
+        return {gateway: self.random.uniform(-90, -50) for gateway in self.gateways}
+
+    def move(self):
+        for device in sorted(self.moved):
+            self.best_before_move[device] = self.best(device)
+            self.rssi[device] = self._place()
+
+    def best(self, device: str) -> str:
+        # None if the best gateway is not clearly better, then every owner is fine
+        ranked = sorted(self.rssi[device].items(), key=lambda item: item[1], reverse=True)
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < ARBITRATION_HYSTERESIS * 1.5:
+            return None
+        return ranked[0][0]
+
+    def telegrams(self):
+        # (time, device, gateway, dbm) in time order
+        events = []
+        for device in self.devices:
+            now = self.random.uniform(0, TELEGRAM_INTERVAL)
+            while now < DURATION:
+                events.append((now, device))
+                now += self.random.expovariate(1 / TELEGRAM_INTERVAL)
+        events.sort()
+
+        moved = False
+        for now, device in events:
+            if not moved and now >= MOVE_AT:
+                self.move()
+                moved = True
+            for gateway in self.gateways:
+                if self.random.random() > RECEIVE_PROBABILITY:
+                    continue
+                dbm = self.rssi[device][gateway] + self.random.gauss(0, NOISE)
+                if self.random.random() < SPIKE_PROBABILITY:
+                    dbm += SPIKE
+                yield now, device, gateway, round(dbm)
+
+
+class Result:
+    def __init__(self, world: World):
+        self.world = world
+        self.handovers = 0
+        self.messages = 0
+        self.bytes = 0
+        self.config_writes = 0
+        self.owner_since = {}
+
+    def owned(self, device: str, owner: str, now: float):
+        self.owner_since[device] = (owner, now)
+
+    def summary(self) -> {}:
+        convergence = []
+        correct = 0
+        relevant = 0
+        for device in self.world.devices:
+            best = self.world.best(device)
+            if best is None:
+                continue
+            relevant += 1
+            owner, since = self.owner_since.get(device, (None, 0))
+            if owner == best:
+                correct += 1
+                if device in self.world.moved and self.world.best_before_move.get(device) != best:
+                    convergence.append(max(0.0, since - MOVE_AT))
+        return {
+            'handovers': self.handovers,
+            'messages': self.messages,
+            'kbytes': self.bytes / 1024,
+            'config_writes': self.config_writes,
+            'correct': correct / relevant * 100 if relevant else 100,
+            'convergence_s': statistics.median(convergence) if convergence else float('nan'),
+        }
+
+
+def single_reading(world: World) -> {}:
+    result = Result(world)
+    owner = dict(world.initial_owner)
+    stored_dbm = {device: -100 for device in world.devices}
+    for device, gateway in owner.items():
+        result.owned(device, gateway, 0)
+    for now, device, gateway, dbm in world.telegrams():
+        if owner[device] == gateway:
+            stored_dbm[device] = max(stored_dbm[device], dbm)
+        elif dbm > stored_dbm[device]:
+            # announce with the device and every gateway rewrites its config
+            owner[device], stored_dbm[device] = gateway, dbm
+            result.owned(device, gateway, now)
+            result.handovers += 1
+            result.messages += ANNOUNCE_MESSAGES
+            result.bytes += ANNOUNCE_BYTES
+            result.config_writes += len(world.gateways)
+    return result.summary()
+
+
+def arbiter(world: World) -> {}:
+    result = Result(world)
+    arbiters = {gateway: GatewayArbiter(gateway) for gateway in world.gateways}
+    for device, gateway in world.initial_owner.items():
+        result.owned(device, gateway, 0)
+        for receiver in arbiters.values():
+            receiver.set_owner(device, gateway)
+    next_report = {gateway: ARBITRATION_INTERVAL for gateway in world.gateways}
+
+    def publish(sender: str, now: float):
+        delta = arbiters[sender].create_delta(now)
+        if delta is None:
+            return
+        result.messages += 1
+        result.bytes += len(delta)
+        for gateway, receiver in arbiters.items():
+            if gateway != sender:
+                for device in receiver.apply_delta(delta, now):
+                    result.config_writes += 1
+
+    for now, device, gateway, dbm in world.telegrams():
+        for sender in world.gateways:
+            if now >= next_report[sender]:
+                publish(sender, now)
+                next_report[sender] = now + ARBITRATION_INTERVAL
+
+        previous = arbiters[gateway].owners.get(device)
+        owner = arbiters[gateway].observe(device, dbm, now)
+        if owner != previous and owner == gateway:
+            result.handovers += 1
+            result.messages += ANNOUNCE_MESSAGES
+            result.bytes += ANNOUNCE_BYTES
+            result.config_writes += 1
+            result.owned(device, owner, now)
+            publish(gateway, now)
+    return result.summary()
+
+
+def main(gateways: int = 4, devices: int = 100):
+    results = {
+        'single reading': single_reading(World(gateways, devices)),
+        'arbiter': arbiter(World(gateways, devices)),
+    }
+    print(f"{gateways} gateways, {devices} devices, {DURATION} s, {len(World(gateways, devices).moved)} moved")
+    print(f"{'rule':<16}{'handovers':>10}{'messages':>10}{'kB':>8}{'config writes':>15}{'correct %':>11}"
+          f"{'converge s':>12}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['handovers']:>10}{result['messages']:>10}{result['kbytes']:>8.1f}"
+              f"{result['config_writes']:>15}{result['correct']:>11.1f}{result['convergence_s']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main(*[int(argument) for argument in sys.argv[1:3]])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Commands encoded per second: the crc8 hasher imported and created per call, like BalboaSystem.send did
+before, against the CRC table of common.balboa. The frame reader checks the checksum of every received
+frame, so the checksum of a status frame is measured too.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_balboa_commands.py [commands]
+"""
+import sys
+import time
+
+from common.balboa import LIGHT_1, STATUS_UPDATE, compute_checksum, encode_toggle, encode_temperature, encode_frame
+
+STATUS_PAYLOAD = bytes(24)
+
+
+def legacy_checksum(len_bytes, data):
+    import crc8
+    hash_value = crc8.crc8()
+    hash_value._sum = 0x02
+    hash_value.update(len_bytes)
+    hash_value.update(data)
+    checksum = hash_value.digest()[0]
+    checksum = checksum ^ 0x02
+    return checksum
+
+
+def legacy_send(msg_type: bytes, payload: bytes) -> bytes:
+    # the message building of BalboaSystem.send before the encoders
+    length = 5 + len(payload)
+    checksum = legacy_checksum(bytes([length]), msg_type + payload)
+    prefix = b'\x7e'
+    return prefix + bytes([length]) + msg_type + payload + bytes([checksum]) + prefix
+
+
+def measure(function, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return count / (time.perf_counter() - start)
+
+
+def main(count: int = 100000):
+    toggle = (b'\x0a\xbf\x11', bytes([LIGHT_1, 0x00]))
+    temperature = (b'\x0a\xbf\x20', bytes([77]))
+    assert legacy_send(*toggle) == encode_toggle(LIGHT_1) and legacy_send(*temperature) == encode_temperature(38.5)
+    frame = encode_frame(STATUS_UPDATE, STATUS_PAYLOAD)
+    rows = [("toggle light", lambda: legacy_send(*toggle), lambda: encode_toggle(LIGHT_1)),
+            ("set temperature", lambda: legacy_send(*temperature), lambda: encode_temperature(38.5)),
+            ("status frame checksum", lambda: legacy_checksum(frame[1:2], frame[2:-2]),
+             lambda: compute_checksum(frame[1:-2]))]
+    print(f"{'operation':<24}{'crc8 hasher/s':>15}{'CRC table/s':>13}")
+    for name, legacy, table in rows:
+        print(f"{name:<24}{measure(legacy, count):>15,.0f}{measure(table, count):>13,.0f}")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Status updates decoded per second: the per service loop of get_state_from before the StatusDecoder, with
+only the 8 services it knew, against one struct unpack with lookup tables for all documented fields.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_balboa_status.py [frames]
+"""
+import logging
+import os
+import sys
+import time
+
+from common.balboa import FrameReader, STATUS_UPDATE
+from system.balboa_system import SERVICES, BALBOA_READ_BYTE, BALBOA_READ_FORMULA, STATUS_DECODER, get_state_from
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "test_common", "fixtures")
+LEGACY_SERVICES = ["light", "jets", "blower", "circulation_pump", "heating", "temperature_control",
+                   "current_temperature", "target_temperature"]
+
+
+def legacy(response, known_device):
+    # the decoding of get_state_from before the StatusDecoder
+    service_json = {}
+    for service in LEGACY_SERVICES:
+        attributes = SERVICES[service]
+        formula = attributes[BALBOA_READ_FORMULA]
+        data_byte = response[attributes[BALBOA_READ_BYTE]]
+        value = formula(data_byte)
+        if value is None:
+            value = known_device['state'][service]
+        if (service not in known_device['state'] or value != known_device['state'][service]
+                or service == 'temperature_control'):
+            service_json[service] = value
+            known_device['state'][service] = value
+    return service_json
+
+
+def read_payloads() -> list:
+    reader = FrameReader()
+    payloads = []
+    with open(os.path.join(FIXTURES, "balboa_status.hex")) as fixture:
+        for line in fixture:
+            if line.strip() and not line.startswith("#"):
+                payloads += [frame.payload for frame in reader.feed(bytes.fromhex(line))
+                             if frame.message_type == STATUS_UPDATE and frame.payload[2] != 0xff]
+    return payloads
+
+
+def measure(function, payloads: list, count: int) -> float:
+    known_device = {'state': {}}
+    start = time.perf_counter()
+    for index in range(count):
+        function(payloads[index % len(payloads)], known_device)
+    return count / (time.perf_counter() - start)
+
+
+def main(count: int = 200000):
+    logging.disable(logging.WARNING)
+    payloads = read_payloads()
+    print(f"{'decoder':<24}{'fields':>7}{'frames/s':>12}")
+    print(f"{'per service loop':<24}{len(LEGACY_SERVICES):>7}{measure(legacy, payloads, count):>12,.0f}")
+    print(f"{'StatusDecoder.decode':<24}{len(STATUS_DECODER.fields):>7}"
+          f"{measure(lambda payload, _: STATUS_DECODER.decode(payload), payloads, count):>12,.0f}")
+    print(f"{'get_state_from':<24}{len(SERVICES):>7}{measure(get_state_from, payloads, count):>12,.0f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
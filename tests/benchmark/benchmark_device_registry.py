@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Device lookup and save on large EnOcean installations: linear scan against the device registry.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_device_registry.py
+"""
+import random
+import timeit
+
+from system.base_system import DeviceRegistry
+
+SIZES = (1_000, 2_000, 5_000, 10_000)
+LOOKUPS = 1_000
+
+
+def create_devices(count: int) -> list:
+    return [{'id': f"{0xFEF00000 + index:08X}", 'type': "RPS", 'dbm': -70, 'client_id': "benchmark",
+             'state': {'a1': 0, 'a2': 0}} for index in range(count)]
+
+
+def scan_lookup(devices: list, device_id: str):
+    for known_device in devices:
+        if str(device_id).upper() == str(known_device['id']).upper():
+            return known_device
+    return None
+
+
+def scan_save(devices: list, device: {}) -> list:
+    devices = [device if device['id'] == temp_device['id'] else temp_device for temp_device in devices]
+    if device not in devices:
+        devices.append(device)
+    return devices
+
+
+def measure(statement, repeat: int = 3) -> float:
+    return min(timeit.repeat(statement, number=1, repeat=repeat)) / LOOKUPS * 1_000_000
+
+
+def main():
+    random.seed(42)
+    print(f"{'devices':>8}{'scan get us':>14}{'registry get us':>18}{'scan save us':>15}{'registry save us':>19}")
+    for size in SIZES:
+        devices = create_devices(size)
+        registry = DeviceRegistry(devices)
+        ids = [device['id'].lower() for device in random.choices(devices, k=LOOKUPS)]
+        updates = [dict(device, dbm=-60) for device in random.choices(devices, k=LOOKUPS)]
+
+        def scan_gets():
+            for device_id in ids:
+                scan_lookup(devices, device_id)
+
+        def registry_gets():
+            for device_id in ids:
+                registry.get(device_id)
+
+        def scan_saves():
+            current = devices
+            for device in updates:
+                current = scan_save(current, device)
+
+        def registry_saves():
+            for device in updates:
+                registry.put(device)
+
+        print(f"{size:>8}{measure(scan_gets):>14.2f}{measure(registry_gets):>18.3f}"
+              f"{measure(scan_saves, 1):>15.2f}{measure(registry_saves):>19.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Discovery payloads for an announce: json.dumps of the mutated templates against the payload builder.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_discovery.py [entities]
+"""
+import json
+import sys
+import timeit
+
+from common.homeassistant import DiscoveryPayloadBuilder, PAYLOAD_SENSOR, MQTT_NAME, MQTT_STATE_TOPIC, \
+    MQTT_AVAILABILITY_TOPIC, MQTT_UNIQUE_ID, MQTT_DEVICE, MQTT_DEVICE_IDS, MQTT_DEVICE_DESCRIPTION
+
+
+def create_entities(count: int) -> list:
+    entities = []
+    for index in range(count):
+        device_id = f"{0xFEF00000 + index // 4:08x}"
+        sensor = ("a1", "a2", "b1", "b2")[index % 4]
+        entities.append(({
+            MQTT_NAME: f"Sensor {sensor.title()}",
+            MQTT_STATE_TOPIC: f"cubiemedia/enocean/{device_id}/{sensor}",
+            MQTT_AVAILABILITY_TOPIC: f"cubiemedia/enocean/{device_id}/online",
+            MQTT_UNIQUE_ID: f"enocean-{device_id}-{sensor}-input"
+        }, {
+            MQTT_DEVICE_IDS: device_id,
+            MQTT_NAME: f"EnOcean Switch {device_id}",
+            MQTT_DEVICE_DESCRIPTION: "via Gateway (10.10.20.31)"
+        }))
+    return entities
+
+
+def legacy_announce(entities: list):
+    for entity, device in entities:
+        payload = PAYLOAD_SENSOR
+        for key, value in entity.items():
+            payload[key] = value
+        for key, value in device.items():
+            payload[MQTT_DEVICE][key] = value
+        json.dumps(payload)
+
+
+def builder_announce(builder: DiscoveryPayloadBuilder, entities: list):
+    for entity, device in entities:
+        builder.render(PAYLOAD_SENSOR, entity, device)
+
+
+def main(count: int = 1000):
+    entities = create_entities(count)
+    builder = DiscoveryPayloadBuilder()
+
+    legacy = min(timeit.repeat(lambda: legacy_announce(entities), number=1, repeat=5))
+    first = timeit.timeit(lambda: builder_announce(builder, entities), number=1)
+    again = min(timeit.repeat(lambda: builder_announce(builder, entities), number=1, repeat=5))
+
+    print(f"{'announce of':<24}{count:>8} entities")
+    print(f"{'mutate + json.dumps':<24}{legacy * 1000:>8.2f} ms")
+    print(f"{'builder, first':<24}{first * 1000:>8.2f} ms")
+    print(f"{'builder, re-announce':<24}{again * 1000:>8.2f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
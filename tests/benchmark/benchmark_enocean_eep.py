@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Telegrams decoded per second: parse_eep of the enocean library against the decoder tables, directly
+and dispatched through the decoder registry as EnoceanSystem does.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_enocean_eep.py [telegrams]
+"""
+import random
+import sys
+import time
+import warnings
+
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.packet import RadioPacket
+
+from common.enocean_eep import decode_rps, decode_temperature, DEFAULT_DECODERS
+
+SENDER = [0xFE, 0xFC, 0x1B, 0xE1]
+OPTIONAL = [0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00]
+
+
+def legacy_rps(packet) -> {}:
+    # the decoding of EnoceanSystem before the decoder tables
+    is_door_window_contact = False
+    state = {}
+    try:
+        attribute_list = packet.parse_eep(0x02, 0x01)
+    except TypeError:
+        attribute_list = packet.parse_eep(0x01, 0x01)
+        is_door_window_contact = True
+
+    button_action = 1
+    has_second_action = False
+    button_action_2 = 0
+    energy_bow_active = False
+    for k in attribute_list:
+        if k == 'R1':
+            button_action = int(packet.parsed[k]['raw_value'])
+        if k == 'R2':
+            button_action_2 = int(packet.parsed[k]['raw_value'])
+        if k == 'EB':
+            energy_bow_active = int(packet.parsed[k]['raw_value']) == 1
+        if k == 'SA':
+            has_second_action = int(packet.parsed[k]['raw_value']) == 1
+        if k == 'PB':
+            button_action = int(packet.parsed[k]['raw_value'])
+            energy_bow_active = int(packet.parsed[k]['raw_value']) == 1
+
+    if energy_bow_active:
+        state[['a2', 'a1', 'b2', 'b1'][button_action]] = 1
+        if has_second_action and button_action_2 in [2, 3]:
+            state['b2' if button_action_2 == 2 else 'b1'] = 1
+    else:
+        state['a1'] = 0
+        if not is_door_window_contact:
+            state['a2'] = 0
+            state['b1'] = 0
+            state['b2'] = 0
+    return state
+
+
+def legacy_temperature(packet) -> {}:
+    packet.parse_eep(0x02, 0x05)
+    return {"value": round(packet.parsed['TMP']['value'], 1)}
+
+
+def create_telegrams(count: int) -> list:
+    random.seed(42)
+    telegrams = []
+    for _ in range(count):
+        if random.random() < 0.8:
+            data = [RORG.RPS, random.choice([0x00, 0x10, 0x30, 0x50, 0x70, 0x15, 0xE0, 0xF0])]
+        else:
+            data = [RORG.BS4, 0x00, 0x00, random.randint(0, 255), 0x08]
+        telegrams.append(RadioPacket(PACKET.RADIO_ERP1, data=data + SENDER + [0x30], optional=OPTIONAL))
+    return telegrams
+
+
+def measure(telegrams: list, rps, temperature) -> float:
+    start = time.perf_counter()
+    for packet in telegrams:
+        if packet.rorg == RORG.RPS:
+            rps(packet)
+        else:
+            temperature(packet)
+    return len(telegrams) / (time.perf_counter() - start)
+
+
+def measure_registry(telegrams: list) -> float:
+    # decoder cached per (sender, rorg) like EnoceanSystem._get_decoder
+    decoders = {}
+    start = time.perf_counter()
+    for packet in telegrams:
+        key = (packet.sender_hex, packet.rorg)
+        try:
+            decoder = decoders[key]
+        except KeyError:
+            decoder = decoders[key] = DEFAULT_DECODERS.get(packet.rorg)
+        decoder.decode(packet.data)
+    return len(telegrams) / (time.perf_counter() - start)
+
+
+def main(count: int = 2000):
+    warnings.simplefilter("ignore")
+    telegrams = create_telegrams(count)
+    legacy = measure(telegrams, legacy_rps, legacy_temperature)
+    tables = measure(telegrams * 100, lambda packet: decode_rps(packet.data),
+                     lambda packet: decode_temperature(packet.data))
+    registry = measure_registry(telegrams * 100)
+    print(f"{'decoder':<12}{'telegrams/s':>14}")
+    print(f"{'parse_eep':<12}{legacy:>14,.0f}")
+    print(f"{'tables':<12}{tables:>14,.0f}")
+    print(f"{'registry':<12}{registry:>14,.0f}")
+    print(f"speedup: {tables / legacy:.0f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Latency from a received telegram to action for bursts of telegrams: one packet per wakeup
+against draining all pending packets per wakeup.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_enocean_receive.py [bursts] [burst size]
+"""
+import logging
+import statistics
+import sys
+import threading
+import time
+import warnings
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from enocean.protocol.constants import RORG
+from enocean.protocol.packet import Packet
+
+from common.scheduler import NotifyingQueue
+from system.enocean_system import EnoceanSystem
+
+
+def create_system(receive_batch: int) -> EnoceanSystem:
+    system = EnoceanSystem()
+    system.receive_batch = receive_batch
+    system.set_availability = MagicMock()
+    system.communicator = MagicMock()
+    system.communicator.receive = NotifyingQueue(system.notify_update)
+    system.latencies = []
+    system.wakeups = 0
+    system.action = lambda device: system.latencies.append(
+        (datetime.now() - device['received']).total_seconds())
+    get_sensor_from = system._get_sensor_from
+
+    def _get_sensor_from(packet):
+        sensor = get_sensor_from(packet)
+        sensor['received'] = packet.received
+        return sensor
+
+    system._get_sensor_from = _get_sensor_from
+    return system
+
+
+def main_loop(system: EnoceanSystem):
+    while system.RUN:
+        system.wakeups += 1
+        data = system.update()
+        for device in data.get('devices', []):
+            system.action(device)
+        system.wait_for_update()
+
+
+def run(receive_batch: int, bursts: int, burst_size: int) -> dict:
+    system = create_system(receive_batch)
+    system.RUN = True
+    thread = threading.Thread(target=main_loop, args=[system], daemon=True)
+    thread.start()
+
+    packet_data = [Packet.create(0x01, RORG.RPS, 0x02, 0x01, sender=[0xFF, 0x00, 0x00, index])
+                   for index in range(burst_size)]
+    for _ in range(bursts):
+        for packet in packet_data:
+            packet.received = datetime.now()
+            system.communicator.receive.put(packet)
+        time.sleep(0.05)
+    while len(system.latencies) < bursts * burst_size:
+        time.sleep(0.01)
+
+    system.RUN = False
+    system.notify_update()
+    thread.join()
+    system.scheduler.close()
+
+    latencies = sorted(system.latencies)
+    return {
+        'packets': len(latencies),
+        'median_ms': statistics.median(latencies) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'wakeups': system.wakeups,
+        'max_depth': system.communicator.receive.max_depth,
+    }
+
+
+def main(bursts: int = 50, burst_size: int = 20):
+    warnings.simplefilter("ignore")
+    logging.getLogger('enocean').setLevel(logging.ERROR)
+    results = {
+        'one per wakeup': run(1, bursts, burst_size),
+        'batch': run(EnoceanSystem.receive_batch, bursts, burst_size),
+    }
+    print(f"{'receive':<16}{'packets':>8}{'median ms':>12}{'max ms':>12}{'wakeups':>10}{'max depth':>11}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['packets']:>8}{result['median_ms']:>12.3f}{result['max_ms']:>12.3f}"
+              f"{result['wakeups']:>10}{result['max_depth']:>11}")
+
+
+if __name__ == '__main__':
+    main(*[int(argument) for argument in sys.argv[1:3]])
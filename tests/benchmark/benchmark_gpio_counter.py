@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""One hour of an S0 meter: every edge published as 0/1 input against the aggregating pulse counter.
+
+The hour is simulated, the counter is aggregated with the default interval like GPIOSystem.update.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_gpio_counter.py [pulses per hour]
+"""
+import json
+import sys
+import time
+
+from common import GPIO_COUNTER_INTERVAL, GPIO_IMPULSES
+from system.gpio_system import PulseCounter
+
+HOUR = 3600
+
+
+def edge_inputs(pulses: int) -> (int, int):
+    # rising and falling edge of every pulse is an action with its own json encoded publish
+    publishes = 0
+    payload_bytes = 0
+    for _ in range(pulses):
+        for value in (1, 0):
+            publishes += 1
+            payload_bytes += len(json.dumps(value))
+    return publishes, payload_bytes
+
+
+def pulse_counter(pulses: int) -> (int, int, float):
+    counter = PulseCounter()
+    publishes = 0
+    payload_bytes = 0
+    interval = HOUR / pulses
+    published_at = 0.0
+    published_pulses = 0
+    start = time.perf_counter()
+    for index in range(pulses):
+        counter(5)
+        now = index * interval
+        if now - published_at >= GPIO_COUNTER_INTERVAL:
+            value = {'energy': round(counter.pulses / GPIO_IMPULSES, 3),
+                     'power': round((counter.pulses - published_pulses) / GPIO_IMPULSES * 3600000 /
+                                    (now - published_at), 1)}
+            published_at, published_pulses = now, counter.pulses
+            for service_value in value.values():
+                publishes += 1
+                payload_bytes += len(json.dumps(service_value))
+    elapsed = time.perf_counter() - start
+    return publishes, payload_bytes, elapsed / pulses * 1e9
+
+
+def main(pulses: int = 10000):
+    publishes, payload_bytes = edge_inputs(pulses)
+    counter_publishes, counter_bytes, pulse_ns = pulse_counter(pulses)
+    print(f"{pulses} pulses in one hour, interval {GPIO_COUNTER_INTERVAL} s")
+    print(f"{'input':<14}{'publishes':>11}{'bytes':>9}")
+    print(f"{'edge input':<14}{publishes:>11}{payload_bytes:>9}")
+    print(f"{'pulse counter':<14}{counter_publishes:>11}{counter_bytes:>9}")
+    print(f"counting and aggregating: {pulse_ns:.0f} ns per pulse")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Latency from event to publish: fixed 200 ms poll loop against the event driven scheduler.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_main_loop.py [events]
+"""
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+
+from common.scheduler import UpdateScheduler, NotifyingQueue
+
+
+class EventSystem:
+    RUN = True
+
+    def __init__(self, scheduler: UpdateScheduler = None):
+        self.scheduler = scheduler
+        self.events = NotifyingQueue(self.notify_update) if scheduler else queue.Queue()
+        self.latencies = []
+        self.wakeups = 0
+
+    def update(self) -> {}:
+        self.wakeups += 1
+        try:
+            return {'devices': [self.events.get(block=False)]}
+        except queue.Empty:
+            return {}
+
+    def action(self, device):
+        # publishing is the end of the measured path
+        self.latencies.append(time.perf_counter() - device['created'])
+
+    def notify_update(self):
+        self.scheduler.notify()
+
+    def next_update(self) -> float:
+        if not self.events.empty():
+            return time.time()
+        return time.time() + 30
+
+
+def poll_loop(system: EventSystem):
+    while system.RUN:
+        data = system.update()
+        for device in data.get('devices', []):
+            system.action(device)
+        time.sleep(.2)
+
+
+def scheduler_loop(system: EventSystem):
+    while system.RUN:
+        data = system.update()
+        for device in data.get('devices', []):
+            system.action(device)
+        system.scheduler.wait(system.next_update())
+
+
+def run(loop, system: EventSystem, events: int) -> dict:
+    thread = threading.Thread(target=loop, args=[system], daemon=True)
+    thread.start()
+
+    random.seed(42)
+    start = time.perf_counter()
+    for _ in range(events):
+        time.sleep(random.uniform(0.05, 0.4))
+        system.events.put({'created': time.perf_counter()})
+    while len(system.latencies) < events and time.perf_counter() - start < events:
+        time.sleep(0.1)
+    duration = time.perf_counter() - start
+
+    system.RUN = False
+    if system.scheduler:
+        system.scheduler.notify()
+    thread.join()
+
+    latencies = sorted(system.latencies)
+    return {
+        'events': len(latencies),
+        'median_ms': statistics.median(latencies) * 1000,
+        'p99_ms': statistics.quantiles(latencies, n=100)[98] * 1000,
+        'wakeups_per_second': system.wakeups / duration,
+    }
+
+
+def main(events: int = 100):
+    results = {
+        'poll (200 ms)': run(poll_loop, EventSystem(), events),
+        'scheduler': run(scheduler_loop, EventSystem(UpdateScheduler()), events),
+    }
+    print(f"{'loop':<16}{'events':>8}{'median ms':>12}{'p99 ms':>12}{'wakeups/s':>12}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['events']:>8}{result['median_ms']:>12.3f}{result['p99_ms']:>12.3f}"
+              f"{result['wakeups_per_second']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Overhead of the metrics instrumentation on the hot path (update, action, publish).
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_metrics.py [calls]
+"""
+import sys
+import time
+
+from common.metrics import MetricsRegistry, instrument
+
+
+class Stats:
+    depth = 0
+    dropped = 0
+    hits = 0
+    misses = 0
+
+
+class Client:
+    offline_queue = Stats()
+    publish_cache = Stats()
+
+    def publish(self, topic, payload, retain=False):
+        return True
+
+
+class System:
+    execution_mode = "benchmark"
+
+    def __init__(self):
+        self.config = []
+        self.mqtt_client = Client()
+        self.mqtt_client.offline_queue.depth = lambda: 0
+
+    def update(self) -> {}:
+        return {}
+
+    def action(self, device: {}) -> bool:
+        return self.mqtt_client.publish("cubiemedia/benchmark/1", device['state'])
+
+    def send(self, data: {}) -> bool:
+        return True
+
+    def announce(self):
+        pass
+
+    def get_statistics(self) -> {}:
+        return {}
+
+
+def measure(system: System, calls: int) -> float:
+    device = {'id': '1', 'state': '1'}
+    start = time.perf_counter()
+    for _ in range(calls):
+        system.update()
+        system.action(device)
+    return (time.perf_counter() - start) / calls
+
+
+def main(calls: int = 200000):
+    plain = measure(System(), calls)
+    instrumented_system = System()
+    registry = MetricsRegistry()
+    instrument(instrumented_system, registry)
+    instrumented = measure(instrumented_system, calls)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        registry.render()
+    render = (time.perf_counter() - start) / 100
+
+    print(f"{'loop':<16}{'µs/iteration':>14}")
+    print(f"{'plain':<16}{plain * 1e6:>14.3f}")
+    print(f"{'instrumented':<16}{instrumented * 1e6:>14.3f}")
+    print(f"overhead per instrumented call: {(instrumented - plain) / 3 * 1e6:.3f} µs, "
+          f"render: {render * 1e3:.3f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""A scene switches all relays of one board among N fake ETH008 boards: one io.cgi request and a full
+rescan per command, like RelaySystem.send did before, against the coalesced commands which are sent
+over one kept alive connection (or combined in one request) followed by one refresh of the board.
+
+run with: PYTHONPATH=src:tests python tests/benchmark/benchmark_relay_commands.py [boards]
+"""
+import sys
+import time
+
+import requests
+
+from common import RELAY_USERNAME, RELAY_PASSWORD
+from common.relay_board import RelayBoard
+from test_common import FakeRelayBoard
+
+RELAYS = 8
+
+
+def per_command(fake_boards: list) -> float:
+    start = time.perf_counter()
+    target = fake_boards[0]
+    for relay_id in range(1, RELAYS + 1):
+        requests.get(f"http://{target.ip}/io.cgi?DOA{relay_id}", auth=(RELAY_USERNAME, RELAY_PASSWORD), timeout=3)
+        for fake_board in fake_boards:
+            requests.get(f"http://{fake_board.ip}/status.xml", auth=(RELAY_USERNAME, RELAY_PASSWORD), timeout=3)
+    return time.perf_counter() - start
+
+
+def coalesced(fake_boards: list, combine: bool) -> float:
+    board = RelayBoard(fake_boards[0].ip)
+    start = time.perf_counter()
+    board.set_statuses([(relay_id, "0", False) for relay_id in range(1, RELAYS + 1)], combine)
+    board.read_status()
+    elapsed = time.perf_counter() - start
+    board.close()
+    return elapsed
+
+
+def main(boards: int = 10):
+    fake_boards = [FakeRelayBoard(relays=RELAYS) for _ in range(boards)]
+    try:
+        results = []
+        for name, function in [("per command", per_command),
+                               ("coalesced", lambda fakes: coalesced(fakes, False)),
+                               ("combined", lambda fakes: coalesced(fakes, True))]:
+            for fake_board in fake_boards:
+                fake_board.requests.clear()
+            elapsed = function(fake_boards)
+            results.append((name, sum(len(fake_board.requests) for fake_board in fake_boards), elapsed))
+    finally:
+        for fake_board in fake_boards:
+            fake_board.close()
+
+    print(f"scene of {RELAYS} relays, {boards} boards")
+    print(f"{'commands':<14}{'requests':>10}{'ms':>8}")
+    for name, request_count, elapsed in results:
+        print(f"{name:<14}{request_count:>10}{elapsed * 1000:>8.0f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Sweep time over N fake ETH008 boards on local ports: one requests.get after the other, like
+RelaySystem did before, against pooled RelayBoard sessions polled by the executor.
+
+Every board answers after DELAY, the last run adds a stalled board which never answers.
+
+run with: PYTHONPATH=src:tests python tests/benchmark/benchmark_relay_polling.py [sweeps]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+from common import RELAY_USERNAME, RELAY_PASSWORD, RELAY_POOL_SIZE, RELAY_SWEEP_DEADLINE
+from common.relay_board import RelayBoard
+from test_common import FakeRelayBoard
+
+DELAY = 0.02
+BOARD_COUNTS = [1, 5, 10, 20]
+
+
+def sequential(ips: list) -> float:
+    start = time.perf_counter()
+    for ip in ips:
+        try:
+            requests.get(f"http://{ip}/status.xml", auth=(RELAY_USERNAME, RELAY_PASSWORD), timeout=3)
+        except requests.RequestException:
+            pass
+    return time.perf_counter() - start
+
+
+def parallel(executor: ThreadPoolExecutor, boards: list) -> float:
+    start = time.perf_counter()
+    futures = [executor.submit(board.read_status) for board in boards if board.is_available()]
+    wait(futures, timeout=RELAY_SWEEP_DEADLINE)
+    return time.perf_counter() - start
+
+
+def measure(count: int, sweeps: int, stalled: bool = False) -> (float, float):
+    fake_boards = [FakeRelayBoard(delay=DELAY) for _ in range(count)]
+    if stalled:
+        fake_boards.append(FakeRelayBoard(stalled=True))
+    ips = [fake_board.ip for fake_board in fake_boards]
+    boards = [RelayBoard(ip) for ip in ips]
+    executor = ThreadPoolExecutor(max_workers=RELAY_POOL_SIZE)
+    try:
+        sequential_time = min(sequential(ips) for _ in range(sweeps))
+        parallel_time = min(parallel(executor, boards) for _ in range(sweeps))
+    finally:
+        for fake_board in fake_boards:
+            fake_board.close()
+        executor.shutdown(wait=False, cancel_futures=True)
+    return sequential_time, parallel_time
+
+
+def main(sweeps: int = 3):
+    print(f"{'boards':<18}{'sequential ms':>15}{'parallel ms':>13}")
+    for count in BOARD_COUNTS:
+        sequential_time, parallel_time = measure(count, sweeps)
+        print(f"{count:<18}{sequential_time * 1000:>15.0f}{parallel_time * 1000:>13.0f}")
+    sequential_time, parallel_time = measure(BOARD_COUNTS[-1], 1, stalled=True)
+    print(f"{f'{BOARD_COUNTS[-1]} + 1 stalled':<18}{sequential_time * 1000:>15.0f}{parallel_time * 1000:>13.0f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""status.xml responses parsed per second: the line splitting of RelaySystem before the StatusParser,
+the StatusParser on the whole body and fed in chunks as the response arrives.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_relay_status.py [responses]
+"""
+import logging
+import os
+import sys
+import time
+
+from common import STATE_UNKNOWN
+from common.relay_board import StatusParser, STATUS_CHUNK_SIZE
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "test_common", "fixtures")
+
+
+def legacy(content: bytes) -> dict:
+    # the decoding of RelaySystem._read_status before the StatusParser, only relays
+    status_dict = {}
+    text = content.decode()
+    logging.debug(f"... ... content:\n{text}")
+    for line in text.splitlines():
+        if "relay" in line:
+            index = line[line.index("<relay") + 6:line.index(">")]
+            status = line[line.index(">") + 1:line.index("</")]
+            status_dict[index] = status if status == "1" or status == "0" else STATE_UNKNOWN
+    return status_dict
+
+
+def streaming(content: bytes, chunk_size: int) -> dict:
+    parser = StatusParser()
+    for index in range(0, len(content), chunk_size):
+        parser.feed(content[index:index + chunk_size])
+    return parser.close().relays
+
+
+def measure(function, content: bytes, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        function(content)
+    return count / (time.perf_counter() - start)
+
+
+def main(count: int = 20000):
+    print(f"{'fixture':<20}{'parser':<18}{'responses/s':>12}")
+    for name in ["eth008_status.xml", "eth484_status.xml"]:
+        with open(os.path.join(FIXTURES, name), "rb") as fixture:
+            content = fixture.read()
+        assert legacy(content) == streaming(content, len(content))
+        for parser, function in [("line split", legacy),
+                                 ("stream, one feed", lambda data: streaming(data, len(data))),
+                                 (f"stream, {64} B", lambda data: streaming(data, 64)),
+                                 (f"stream, {STATUS_CHUNK_SIZE} B", lambda data: streaming(data, STATUS_CHUNK_SIZE))]:
+            print(f"{name:<20}{parser:<18}{measure(function, content, count):>12,.0f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
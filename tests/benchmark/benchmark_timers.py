@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Many buttons pressed at once: one threading.Timer per press against the shared TimerScheduler.
+
+Every press starts a long push timer and a release timer, like EnoceanSystem does for a short push.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_timers.py [presses]
+"""
+import statistics
+import sys
+import threading
+import time
+
+from common.timers import TimerScheduler
+
+DELAY = 0.2
+
+
+class Press:
+    def __init__(self, presses: int):
+        self.lateness = []
+        self.lock = threading.Lock()
+        self.remaining = presses * 2
+        self.done = threading.Event()
+        self.peak_threads = threading.active_count()
+
+    def fired(self, deadline: float):
+        lateness = time.monotonic() - deadline
+        with self.lock:
+            self.lateness.append(lateness)
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+
+def thread_per_press(press: Press, presses: int) -> float:
+    start = time.perf_counter()
+    for _ in range(presses):
+        for delay in (DELAY, DELAY * 1.5):
+            timer = threading.Timer(delay, press.fired, [time.monotonic() + delay])
+            timer.start()
+    return time.perf_counter() - start
+
+
+def shared_scheduler(press: Press, presses: int) -> float:
+    scheduler = TimerScheduler()
+    start = time.perf_counter()
+    for _ in range(presses):
+        for delay in (DELAY, DELAY * 1.5):
+            scheduler.schedule(delay, press.fired, time.monotonic() + delay)
+    duration = time.perf_counter() - start
+    press.done.wait()
+    scheduler.shutdown()
+    return duration
+
+
+def run(function, presses: int) -> dict:
+    press = Press(presses)
+    schedule_duration = function(press, presses)
+    press.done.wait()
+    lateness = sorted(press.lateness)
+    return {
+        'schedule_us': schedule_duration / presses / 2 * 1e6,
+        'median_ms': statistics.median(lateness) * 1000,
+        'max_ms': lateness[-1] * 1000,
+        'threads': press.peak_threads,
+    }
+
+
+def main(presses: int = 200):
+    results = {
+        'thread per press': run(thread_per_press, presses),
+        'shared scheduler': run(shared_scheduler, presses),
+    }
+    print(f"{'timers':<18}{'schedule µs':>12}{'late median ms':>16}{'late max ms':>13}{'peak threads':>14}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['schedule_us']:>12.1f}{result['median_ms']:>16.3f}{result['max_ms']:>13.3f}"
+              f"{result['threads']:>14}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
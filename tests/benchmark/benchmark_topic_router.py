@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""Dispatch cost per mqtt message: legacy if/elif chain in on_message against the topic router.
+
+A producer thread stands in for the broker and hands messages to the consumer at a fixed rate,
+the consumer calls on_message like the paho network loop does.
+
+run with: PYTHONPATH=src python tests/benchmark/benchmark_topic_router.py
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+from paho.mqtt.client import MQTTMessage
+
+from common import CUBIE_ANNOUNCE, CUBIE_RESET, CUBIE_RELOAD, DEFAULT_TOPIC_COMMAND
+from common.mqtt_client_wrapper import CubieMediaMQTTClient
+from system.base_system import BaseSystem
+
+RATES = (1_000, 10_000, 100_000)
+DURATION = 1.0
+BOARDS = 100
+
+
+class CountingSystem:
+    execution_mode = "relay"
+    string_ip = "10_10_23_1"
+    on_command = BaseSystem.on_command
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, data):
+        self.sent += 1
+
+    def save(self, device):
+        pass
+
+    def delete(self, device):
+        pass
+
+    def announce(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def load(self):
+        pass
+
+    def notify_update(self):
+        pass
+
+
+def legacy_on_message(system, msg):
+    # copy of CubieMediaMQTTClient.on_message before the topic router
+    msg_payload = str(msg.payload.decode()).replace("False", "false").replace("True", "true").strip()
+    logging.debug(f"... ... mqtt message [{msg_payload}] on topic [{msg.topic}]")
+    if msg_payload == CUBIE_ANNOUNCE:
+        system.announce()
+    elif msg_payload == CUBIE_RESET:
+        system.reset()
+    elif msg_payload == CUBIE_RELOAD:
+        system.load()
+    else:
+        try:
+            if msg.topic == DEFAULT_TOPIC_COMMAND:
+                message_data = json.loads(msg_payload)
+                if "type" in message_data and message_data["type"] == system.execution_mode:
+                    if "mode" in message_data:
+                        message_mode = message_data["mode"]
+                        if message_mode == "update":
+                            if "device" in message_data:
+                                system.save(message_data["device"])
+                        elif message_mode == "delete":
+                            if "device" in message_data:
+                                system.delete(message_data["device"])
+                        elif message_mode == 'values':
+                            system.send(message_data)
+            else:
+                if msg.topic.endswith("/command"):
+                    topic_array = msg.topic.split("/")
+                    if len(topic_array) > 3:
+                        message_data = {'ip': topic_array[2].replace("_", "."),
+                                        'id': topic_array[3],
+                                        'state': msg_payload}
+                        system.send(message_data)
+                else:
+                    logging.warning(f"... ... unknown topic [{msg.topic}]")
+        except json.JSONDecodeError as json_error:
+            logging.warning(f"... could not decode message[{msg_payload}] with [{json_error}]")
+    system.notify_update()
+
+
+def create_messages(count: int) -> list:
+    messages = []
+    for index in range(count):
+        if index % 10 == 0:
+            message = MQTTMessage(topic=DEFAULT_TOPIC_COMMAND.encode())
+            message.payload = json.dumps({'type': "relay", 'mode': "values", 'ip': "10.10.23.20", 'id': 1,
+                                          'state': 1}).encode()
+        else:
+            message = MQTTMessage(topic=f"cubiemedia/relay/10_10_23_{index % BOARDS}/{index % 8}/command".encode())
+            message.payload = b"1" if index % 2 else b"0"
+        messages.append(message)
+    return messages
+
+
+def run(on_message, rate: int) -> dict:
+    messages = create_messages(int(rate * DURATION))
+    inbox = queue.SimpleQueue()
+
+    def produce():
+        # messages arrive in bursts every millisecond, like from a busy network socket
+        burst = max(1, rate // 1000)
+        start = time.perf_counter()
+        for index in range(0, len(messages), burst):
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            for message in messages[index:index + burst]:
+                inbox.put(message)
+        inbox.put(None)
+
+    producer = threading.Thread(target=produce)
+    dispatch_time = 0.0
+    handled = 0
+    start = time.perf_counter()
+    producer.start()
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        before = time.perf_counter()
+        on_message(None, None, message)
+        dispatch_time += time.perf_counter() - before
+        handled += 1
+    duration = time.perf_counter() - start
+    producer.join()
+    return {'messages': handled, 'us_per_message': dispatch_time / handled * 1_000_000,
+            'achieved_rate': handled / duration}
+
+
+def main():
+    logging.disable(logging.WARNING)
+
+    legacy_system = CountingSystem()
+
+    router_system = CountingSystem()
+    client = CubieMediaMQTTClient("benchmark")
+    client.system = router_system
+    client.router.add(DEFAULT_TOPIC_COMMAND, client.on_default_command)
+    for board in range(BOARDS):
+        client.router.add(f"cubiemedia/relay/10_10_23_{board}/+/command", router_system.on_command)
+
+    dispatchers = (('legacy', lambda c, u, m: legacy_on_message(legacy_system, m)), ('router', client.on_message))
+
+    messages = create_messages(100_000)
+    print(f"{'dispatch':>10}{'us/msg without broker':>24}")
+    for name, on_message in dispatchers:
+        start = time.perf_counter()
+        for message in messages:
+            on_message(None, None, message)
+        print(f"{name:>10}{(time.perf_counter() - start) / len(messages) * 1_000_000:>24.2f}")
+    assert legacy_system.sent == router_system.sent
+
+    print(f"\n{'rate/s':>8}{'dispatch':>10}{'us/msg':>10}{'achieved/s':>13}")
+    for rate in RATES:
+        for name, on_message in dispatchers:
+            result = run(on_message, rate)
+            print(f"{rate:>8}{name:>10}{result['us_per_message']:>10.2f}{result['achieved_rate']:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import logging
+import socket
 import subprocess
+import threading
 import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from unittest.mock import MagicMock
 
 import psutil
@@ -22,3 +25,180 @@ def check_mqtt_server():
         except FileNotFoundError:
             logging.error("could not start mosquitto [sudo apt install mosquitto]")
     return None
+
+
+class GPIOEmulator:
+    """Wraps the GPIO emulator, inputs keep their level and edges are fired like by RPi.GPIO.
+
+    Edges within the bouncetime of the previous edge of the pin are dropped, callbacks run on a
+    separate thread.
+    """
+
+    def __init__(self, gpio, fail_pins=()):
+        self.gpio = gpio
+        self.fail_pins = fail_pins
+        self.levels = {}
+        self.callbacks = {}
+        self.edges = {}
+        self.bouncetimes = {}
+        self.last_edge = {}
+
+    def __getattr__(self, name):
+        return getattr(self.gpio, name)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=0):
+        if channel in self.fail_pins:
+            raise RuntimeError("Failed to add edge detection")
+        self.callbacks[channel] = callback
+        self.edges[channel] = edge
+        self.bouncetimes[channel] = bouncetime
+
+    def input(self, channel):
+        return self.levels.get(channel, self.gpio.LOW)
+
+    def fire(self, channel, level, now=None) -> bool:
+        now = time.monotonic() if now is None else now
+        if self.levels.get(channel, self.gpio.LOW) == level:
+            return False
+        self.levels[channel] = level
+        if now - self.last_edge.get(channel, float('-inf')) < self.bouncetimes.get(channel, 0) / 1000:
+            return False
+        self.last_edge[channel] = now
+        edge = self.edges.get(channel, self.gpio.BOTH)
+        if edge != self.gpio.BOTH and edge != (self.gpio.RISING if level else self.gpio.FALLING):
+            return True
+        thread = threading.Thread(target=self.callbacks[channel], args=(channel,))
+        thread.start()
+        thread.join()
+        return True
+
+
+class FakeRelayBoard:
+    """ETH008 relay board on a local port which answers status.xml and io.cgi like the firmware.
+
+    delay holds every answer back, a stalled board accepts connections but never answers. Any other
+    status_code than 200 is answered without a body.
+    """
+
+    def __init__(self, relays: int = 8, delay: float = 0.0, stalled: bool = False):
+        board = self
+        self.relays = ["0"] * relays
+        self.delay = delay
+        self.stalled = stalled
+        self.status_code = 200
+        self.requests = []
+        self.connections = set()
+        self.released = threading.Event()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, with nagle a kept alive connection waits for the delayed ack
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                board.requests.append(self.path)
+                board.connections.add(self.client_address)
+                if board.stalled:
+                    board.released.wait()
+                    return
+                time.sleep(board.delay)
+                if board.status_code != 200:
+                    self.send_response(board.status_code)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.path.startswith("/io.cgi?"):
+                    board.command(self.path[len("/io.cgi?"):])
+                body = board.status().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.ip = f"127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def status(self) -> str:
+        relays = "".join(f"<relay{index}>{state}</relay{index}>\r\n" for index, state in enumerate(self.relays))
+        return f"<response>\r\n{relays}</response>\r\n"
+
+    def command(self, query: str):
+        # DOA<n> switches relay n on, DOI<n> off, relays are counted from 1
+        for command in query.split("&"):
+            if command[:3] in ("DOA", "DOI"):
+                self.relays[int(command[3:].split("=")[0]) - 1] = "1" if command[:3] == "DOA" else "0"
+
+    def close(self):
+        self.released.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeSpa:
+    """Wifi module of a Balboa spa on a local port, sends the given bytes to every connected client.
+
+    Everything the clients send is collected in received. A spa which never sends just accepts connections.
+    """
+
+    def __init__(self, ip: str = "127.0.0.1", port: int = 0):
+        self.server = socket.create_server((ip, port))
+        self.ip = ip
+        self.port = self.server.getsockname()[1]
+        self.clients = []
+        self.connections = 0
+        self.received = bytearray()
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+
+    def send(self, data: bytes):
+        for client in list(self.clients):
+            client.sendall(data)
+
+    def wait_for_client(self, timeout: float = 3) -> bool:
+        deadline = time.monotonic() + timeout
+        while not self.clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return bool(self.clients)
+
+    def disconnect(self):
+        for client in self.clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+        self.clients = []
+
+    def close(self):
+        self.disconnect()
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            self.clients.append(client)
+            threading.Thread(target=self._receive, args=(client,), daemon=True).start()
+
+    def _receive(self, client):
+        while True:
+            try:
+                data = client.recv(1024)
+            except OSError:
+                data = None
+            if not data:
+                # closed by the client
+                if client in self.clients:
+                    self.clients.remove(client)
+                return
+            self.received += data
@@ -0,0 +1,104 @@
+import json
+from unittest import TestCase
+
+from common.arbitration import GatewayArbiter, SignalStatistic
+
+GATEWAY_A = "10.0.0.1-enocean-client"
+GATEWAY_B = "10.0.0.2-enocean-client"
+
+
+class TestSignalStatistic(TestCase):
+
+    def test_ewma_and_percentiles(self):
+        signal = SignalStatistic()
+        for dbm in [-60, -60, -60, -30, -60]:
+            signal.add(dbm, 0, alpha=0.5)
+
+        assert signal.count == 5
+        assert signal.ewma == -52.5
+        assert signal.median == -60
+        assert signal.percentile(100) == -30
+
+    def test_window(self):
+        signal = SignalStatistic()
+        for dbm in range(-100, -50):
+            signal.add(dbm, 0)
+
+        assert signal.percentile(0) == -58
+
+
+class TestGatewayArbiter(TestCase):
+    arbiter_a = None
+    arbiter_b = None
+
+    def test_first_owner(self):
+        assert self.arbiter_a.observe("dev", -70, 0) is None
+        assert self.arbiter_a.observe("dev", -70, 1) is None
+        assert self.arbiter_a.observe("dev", -70, 2) == GATEWAY_A
+
+        delta = json.loads(self.arbiter_a.create_delta(2))
+        assert delta == {'g': GATEWAY_A, 's': {'dev': [-70, -70]}, 'c': ['dev']}
+
+        assert self.arbiter_b.apply_delta(json.dumps(delta), 2) == {'dev': GATEWAY_A}
+        assert self.arbiter_b.owners['dev'] == GATEWAY_A
+
+    def test_hysteresis(self):
+        self._report(self.arbiter_a, -70, 0)
+        self._report(self.arbiter_b, -66, 0)
+
+        # better, but not by the hysteresis
+        for now in range(0, 100, 10):
+            assert self.arbiter_b.evaluate("dev", now) == GATEWAY_A
+
+    def test_hold_time(self):
+        self._report(self.arbiter_a, -80, 0)
+        self._report(self.arbiter_b, -60, 0)
+
+        assert self.arbiter_b.evaluate("dev", 10) == GATEWAY_A
+        assert self.arbiter_b.evaluate("dev", 20) == GATEWAY_A
+        assert self.arbiter_b.evaluate("dev", 40) == GATEWAY_B
+        assert json.loads(self.arbiter_b.create_delta(40))['c'] == ['dev']
+
+    def test_short_spike(self):
+        self._report(self.arbiter_a, -80, 0)
+        self._report(self.arbiter_b, -60, 0)
+        assert self.arbiter_b.evaluate("dev", 10) == GATEWAY_A
+
+        # candidate falls back within the hold time
+        for _ in range(10):
+            self.arbiter_b.observe("dev", -90, 20)
+        assert self.arbiter_b.evaluate("dev", 50) == GATEWAY_A
+
+    def test_stale_owner(self):
+        self._report(self.arbiter_a, -80, 0)
+        self._report(self.arbiter_b, -79, 0)
+
+        assert self.arbiter_b.evaluate("dev", 300) == GATEWAY_A
+        self.arbiter_b.observe("dev", -79, 700)
+        assert self.arbiter_b.evaluate("dev", 700) == GATEWAY_B
+
+    def test_compact_delta(self):
+        for now in range(3):
+            self.arbiter_a.observe("dev", -70, now)
+        assert self.arbiter_a.create_delta(3) is not None
+
+        # changes below one dB are not reported again
+        self.arbiter_a.observe("dev", -72, 4)
+        assert self.arbiter_a.create_delta(4) is None
+        self.arbiter_a.observe("dev", -90, 5)
+        assert json.loads(self.arbiter_a.create_delta(5))['s']['dev'] == [-74, -70]
+
+        # repeated before it gets stale on the other gateways
+        assert self.arbiter_a.create_delta(400) is not None
+
+    def _report(self, arbiter: GatewayArbiter, dbm: int, now: float):
+        self.arbiter_a.set_owner("dev", GATEWAY_A)
+        self.arbiter_b.set_owner("dev", GATEWAY_A)
+        for _ in range(3):
+            arbiter.observe("dev", dbm, now)
+        other = self.arbiter_b if arbiter is self.arbiter_a else self.arbiter_a
+        other.apply_delta(arbiter.create_delta(now), now)
+
+    def setUp(self):
+        self.arbiter_a = GatewayArbiter(GATEWAY_A)
+        self.arbiter_b = GatewayArbiter(GATEWAY_B)
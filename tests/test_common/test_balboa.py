@@ -0,0 +1,200 @@
+import os
+import random
+import time
+from unittest import TestCase
+
+import crc8
+
+from common.balboa import FrameReader, Frame, SpaConnection, StatusDecoder, STATUS_UPDATE, TOGGLE_ITEM, \
+    SET_TEMPERATURE, SET_TIME, SET_FILTER_CYCLES, SETTINGS_REQUEST, LIGHT_1, PUMP_1, BLOWER, TEMPERATURE_RANGE, \
+    HEATING_MODE, PANEL_CONFIGURATION, FILTER_CYCLES, SYSTEM_INFORMATION, FAULT_LOG, encode_frame, compute_checksum, \
+    encode_toggle, encode_temperature, encode_time, encode_filter_cycles, encode_request
+from test_common import FakeSpa
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# 38 °C, heating, jets and light on, target 38.5 °C
+STATUS_PAYLOAD = bytes([0x00, 0x00, 0x4c, 0x0c, 0x1e, 0x00, 0x00, 0x00, 0x00, 0x03, 0x34, 0x02, 0x00, 0x02, 0x03,
+                        0x00, 0x00, 0x00, 0x00, 0x00, 0x4d, 0x00, 0x00, 0x00])
+PANEL_REQUEST = b'\x0a\xbf\x22'
+
+
+def read_commands() -> dict:
+    with open(os.path.join(FIXTURES, "balboa_commands.hex")) as fixture:
+        return {line.split(maxsplit=1)[0]: bytes.fromhex(line.split(maxsplit=1)[1])
+                for line in fixture if line.strip() and not line.startswith("#")}
+
+
+class TestFrameReader(TestCase):
+
+    def test_encode_frame(self):
+        assert encode_frame(PANEL_REQUEST, b'\x00\x00\x01') == bytes.fromhex("7e 08 0a bf 22 00 00 01 58 7e")
+        assert compute_checksum(b'\x08' + PANEL_REQUEST + b'\x00\x00\x01') == 0x58
+
+    def test_feed(self):
+        reader = FrameReader()
+        frame = encode_frame(STATUS_UPDATE, STATUS_PAYLOAD)
+
+        assert reader.feed(frame + frame) == [Frame(STATUS_UPDATE, STATUS_PAYLOAD)] * 2
+        assert reader.buffer == bytearray()
+
+    def test_feed_chunked(self):
+        reader = FrameReader()
+        stream = encode_frame(STATUS_UPDATE, STATUS_PAYLOAD) + encode_frame(PANEL_REQUEST, b'\x00\x00\x01')
+
+        frames = []
+        for index in range(len(stream)):
+            frames += reader.feed(stream[index:index + 1])
+        assert frames == [Frame(STATUS_UPDATE, STATUS_PAYLOAD), Frame(PANEL_REQUEST, b'\x00\x00\x01')]
+
+    def test_resynchronize(self):
+        reader = FrameReader()
+        frame = encode_frame(STATUS_UPDATE, STATUS_PAYLOAD)
+        corrupted = bytearray(frame)
+        corrupted[10] ^= 0xff
+
+        # connected in the middle of a frame, garbage and a frame with a wrong checksum
+        frames = reader.feed(frame[12:] + b'\x01\x7e\x02' + bytes(corrupted) + frame)
+        assert frames == [Frame(STATUS_UPDATE, STATUS_PAYLOAD)]
+        assert reader.dropped == 1
+
+        # a truncated frame does not swallow the following one
+        frames = reader.feed(frame[:-6] + frame)
+        assert frames == [Frame(STATUS_UPDATE, STATUS_PAYLOAD)]
+
+
+class TestCommands(TestCase):
+
+    def test_checksum(self):
+        # same as the crc8 hasher which started with 0x02 and was xored with 0x02
+        random.seed(42)
+        for _ in range(1000):
+            data = bytes(random.randrange(256) for _ in range(random.randrange(1, 40)))
+            hash_value = crc8.crc8()
+            hash_value._sum = 0x02
+            hash_value.update(data)
+            assert compute_checksum(data) == hash_value.digest()[0] ^ 0x02
+
+    def test_encode(self):
+        commands = read_commands()
+        encoded = {
+            "toggle_light_1": encode_toggle(LIGHT_1),
+            "toggle_pump_1": encode_toggle(PUMP_1),
+            "toggle_blower": encode_toggle(BLOWER),
+            "toggle_temperature_range": encode_toggle(TEMPERATURE_RANGE),
+            "toggle_heating_mode": encode_toggle(HEATING_MODE),
+            "set_temperature_38_5": encode_temperature(38.5),
+            "set_time_21_45_24h": encode_time(21, 45),
+            "set_filter_cycles": encode_filter_cycles((8, 0, 2, 0), (20, 30, 1, 30)),
+            "request_panel_configuration": encode_request(PANEL_CONFIGURATION),
+            "request_filter_cycles": encode_request(FILTER_CYCLES),
+            "request_system_information": encode_request(SYSTEM_INFORMATION),
+            "request_fault_log": encode_request(FAULT_LOG),
+        }
+        assert encoded == commands
+
+    def test_round_trip(self):
+        commands = read_commands()
+        frames = FrameReader().feed(b"".join(commands.values()))
+
+        message_types = [TOGGLE_ITEM] * 5 + [SET_TEMPERATURE, SET_TIME, SET_FILTER_CYCLES] + [SETTINGS_REQUEST] * 4
+        assert [frame.message_type for frame in frames] == message_types
+        assert [encode_frame(frame.message_type, frame.payload) for frame in frames] == list(commands.values())
+        assert frames[6].payload == bytes([21 | 0x80, 45])
+        assert encode_time(9, 5, False) == encode_frame(SET_TIME, bytes([9, 5]))
+        assert encode_filter_cycles((8, 0, 2, 0)) == encode_frame(SET_FILTER_CYCLES, bytes([8, 0, 2, 0, 0, 0, 0, 0]))
+
+
+class TestStatusDecoder(TestCase):
+
+    def test_decode(self):
+        decoder = StatusDecoder({'temperature': (2, lambda value: value / 2), 'light': (14, lambda value: value & 0x03),
+                                 'flags': (9, int), 'celsius': (9, lambda value: value & 0x01 == 1)})
+
+        # one byte per offset, everything in between is skipped
+        assert decoder.struct.size == 15
+        assert decoder.decode(STATUS_PAYLOAD) == {'temperature': 38.0, 'light': 3, 'flags': 3, 'celsius': True}
+        with self.assertRaises(ValueError):
+            decoder.decode(STATUS_PAYLOAD[:14])
+
+
+class TestSpaConnection(TestCase):
+    fake_spa = None
+
+    def test_read(self):
+        connection = SpaConnection(self.fake_spa.ip, self.fake_spa.port)
+        frames = []
+        connection.on(STATUS_UPDATE, frames.append)
+
+        connection.connect()
+        assert self.fake_spa.wait_for_client()
+        frame = encode_frame(STATUS_UPDATE, STATUS_PAYLOAD)
+        self.fake_spa.send(frame + frame + encode_frame(PANEL_REQUEST) + frame[:10])
+        assert connection.read(STATUS_UPDATE, 1)
+        assert frames == [Frame(STATUS_UPDATE, STATUS_PAYLOAD)] * 2
+
+        self.fake_spa.send(frame[10:])
+        assert connection.read(STATUS_UPDATE, 1)
+        assert len(frames) == 3
+        # the connection is kept open between reads
+        assert self.fake_spa.connections == 1 and connection.connects == 1
+        connection.close()
+
+    def test_send_and_reconnect(self):
+        connection = SpaConnection(self.fake_spa.ip, self.fake_spa.port)
+        connection.send(encode_frame(PANEL_REQUEST, b'\x00\x00\x01'))
+        connection.send(encode_frame(b'\x0a\xbf\x11', b'\x04\x00'))
+        assert self.fake_spa.wait_for_client()
+
+        deadline = time.monotonic() + 1
+        while len(self.fake_spa.received) < 17 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert FrameReader().feed(bytes(self.fake_spa.received)) == [Frame(PANEL_REQUEST, b'\x00\x00\x01'),
+                                                                     Frame(b'\x0a\xbf\x11', b'\x04\x00')]
+
+        self.fake_spa.disconnect()
+        with self.assertRaises(ConnectionError):
+            connection.read(STATUS_UPDATE, 1)
+        assert not connection.is_connected()
+
+        # connected again, without a status update the read fails as well
+        assert not connection.read(STATUS_UPDATE, 0.2)
+        assert connection.connects == 2 and self.fake_spa.connections == 2
+        assert not connection.is_connected()
+        connection.close()
+
+    def test_send_without_connect(self):
+        connection = SpaConnection(self.fake_spa.ip, self.fake_spa.port)
+        with self.assertRaises(ConnectionError):
+            connection.send(encode_frame(PANEL_REQUEST, b'\x00\x00\x01'), connect=False)
+        assert connection.connects == 0 and self.fake_spa.connections == 0
+
+        connection.connect()
+        connection.send(encode_frame(PANEL_REQUEST, b'\x00\x00\x01'), connect=False)
+        assert connection.connects == 1
+        connection.close()
+
+    def test_backoff(self):
+        connection = SpaConnection(self.fake_spa.ip, self.fake_spa.port, backoff=10, max_backoff=30)
+        self.fake_spa.close()
+
+        for failures, backoff in [(1, 10), (2, 20), (3, 30), (4, 30)]:
+            with self.assertRaises(OSError):
+                connection.read(STATUS_UPDATE, 0.2)
+            assert connection.failures == failures
+            assert backoff - 1 < connection.retry_at - time.monotonic() <= backoff
+
+        self.fake_spa = FakeSpa()
+        connection.port = self.fake_spa.port
+        connection.connect()
+        assert self.fake_spa.wait_for_client()
+        self.fake_spa.send(encode_frame(STATUS_UPDATE, STATUS_PAYLOAD))
+        assert connection.read(STATUS_UPDATE, 1)
+        assert connection.failures == 0 and connection.retry_at == 0.0
+        connection.close()
+
+    def setUp(self) -> None:
+        self.fake_spa = FakeSpa()
+
+    def tearDown(self) -> None:
+        self.fake_spa.close()
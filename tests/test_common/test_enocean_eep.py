@@ -0,0 +1,125 @@
+from unittest import TestCase
+
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.packet import RadioPacket
+
+from common.enocean_eep import decode_rps, decode_temperature, decode_humidity, decode_occupancy, \
+    decode_contact, decode_meter, get_teach_in, get_decoder, format_profile, DEFAULT_DECODERS
+
+SENDER = [0xFE, 0xFC, 0x1B, 0xE1]
+OPTIONAL = [0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00]
+
+
+def create_packet(rorg: int, data: list, status: int = 0x30) -> RadioPacket:
+    return RadioPacket(PACKET.RADIO_ERP1, data=[rorg] + data + SENDER + [status], optional=OPTIONAL)
+
+
+def parse_rps(packet: RadioPacket) -> {}:
+    # reference: the profile parsing of the enocean library as used before the decoder tables
+    is_door_window_contact = False
+    try:
+        attribute_list = packet.parse_eep(0x02, 0x01)
+    except TypeError:
+        attribute_list = packet.parse_eep(0x01, 0x01)
+        is_door_window_contact = True
+
+    values = {key: int(packet.parsed[key]['raw_value']) for key in attribute_list}
+    button_action = values.get('R1', values.get('PB', 1))
+    energy_bow_active = values.get('EB', values.get('PB', 0)) == 1
+    state = {}
+    if energy_bow_active:
+        state[['a2', 'a1', 'b2', 'b1'][button_action]] = 1
+        if values.get('SA') == 1 and values.get('R2') in [2, 3]:
+            state['b2' if values['R2'] == 2 else 'b1'] = 1
+    else:
+        state['a1'] = 0
+        if not is_door_window_contact:
+            state.update({'a2': 0, 'b1': 0, 'b2': 0})
+    return state
+
+
+class TestEnoceanEEP(TestCase):
+
+    def test_rps_matches_profile(self):
+        for status in [0x20, 0x30]:
+            for data in range(256):
+                packet = create_packet(RORG.RPS, [data], status)
+                assert decode_rps(packet.data) == parse_rps(packet), f"data byte {data:02X}"
+
+    def test_rps_states(self):
+        assert decode_rps(create_packet(RORG.RPS, [0x30]).data) == {'a1': 1}
+        assert decode_rps(create_packet(RORG.RPS, [0x70]).data) == {'b1': 1}
+        assert decode_rps(create_packet(RORG.RPS, [0x15]).data) == {'a2': 1, 'b2': 1}
+        assert decode_rps(create_packet(RORG.RPS, [0x00]).data) == {'a1': 0, 'a2': 0, 'b1': 0, 'b2': 0}
+        # door and window contacts use F6-01-01
+        assert decode_rps(create_packet(RORG.RPS, [0xE0]).data) == {'a1': 0}
+
+    def test_copy(self):
+        state = decode_rps(create_packet(RORG.RPS, [0x30]).data)
+        state['a1'] = 0
+
+        assert decode_rps(create_packet(RORG.RPS, [0x30]).data) == {'a1': 1}
+
+    def test_temperature_matches_profile(self):
+        for raw_value in range(256):
+            packet = create_packet(RORG.BS4, [0x00, 0x00, raw_value, 0x08])
+            packet.parse_eep(0x02, 0x05)
+            expected = round(packet.parsed['TMP']['value'], 1)
+            assert decode_temperature(packet.data) == {"value": expected}, f"raw value {raw_value}"
+
+    def test_humidity_matches_profile(self):
+        for raw_value in range(256):
+            packet = create_packet(RORG.BS4, [0x00, raw_value, 255 - raw_value, 0x0A])
+            packet.parse_eep(0x04, 0x01)
+            expected = {'humidity': round(packet.parsed['HUM']['value'], 1),
+                        'temperature': round(packet.parsed['TMP']['value'], 1)}
+            assert decode_humidity(packet.data) == expected, f"raw value {raw_value}"
+
+        # temperature sensor not available
+        assert decode_humidity(create_packet(RORG.BS4, [0x00, 0x7D, 0x00, 0x08]).data) == {'humidity': 50.0}
+
+    def test_occupancy_matches_profile(self):
+        for raw_value in range(256):
+            packet = create_packet(RORG.BS4, [raw_value, 0x00, raw_value, 0x09])
+            packet.parse_eep(0x07, 0x01)
+            expected = {'occupancy': packet.parsed['PIR']['raw_value'],
+                        'voltage': round(packet.parsed['SVC']['value'], 2)}
+            assert decode_occupancy(packet.data) == expected, f"raw value {raw_value}"
+
+    def test_contact_matches_profile(self):
+        for data in [0x08, 0x09]:
+            packet = create_packet(RORG.BS1, [data])
+            packet.parse_eep(0x00, 0x01)
+            assert decode_contact(packet.data) == {'opening': 1 - packet.parsed['CO']['raw_value']}
+
+    def test_meter_matches_profile(self):
+        for status in range(0x08, 0x100, 0x11):
+            packet = create_packet(RORG.BS4, [0x01, 0xE2, 0x40, status | 0x08])
+            packet.parse_eep(0x12, 0x01)
+            value = packet.parsed['MR']['value'] / 10 ** packet.parsed['DIV']['raw_value']
+            key = 'power' if packet.parsed['DT']['raw_value'] else 'energy'
+            assert decode_meter(packet.data) == {key: value}, f"status {status:02X}"
+
+    def test_teach_in(self):
+        # data telegrams
+        assert get_teach_in(create_packet(RORG.RPS, [0x30]).data) is None
+        assert get_teach_in(create_packet(RORG.BS4, [0x00, 0x00, 0x80, 0x08]).data) is None
+        assert get_teach_in(create_packet(RORG.BS1, [0x09]).data) is None
+
+        # 4BS teach-in with A5-04-01 and without profile
+        assert get_teach_in(create_packet(RORG.BS4, [0x10, 0x08, 0x00, 0x80]).data) == (0xA5, 0x04, 0x01)
+        assert get_teach_in(create_packet(RORG.BS4, [0x00, 0x00, 0x00, 0x00]).data) == ()
+        assert get_teach_in(create_packet(RORG.BS1, [0x00]).data) == (0xD5, 0x00, 0x01)
+        # UTE teach-in of A5-12-01, request type 0 and deletion
+        assert get_teach_in(create_packet(RORG.UTE, [0x80, 0xFF, 0x00, 0x00, 0x01, 0x12, 0xA5]).data) == \
+               (0xA5, 0x12, 0x01)
+        assert get_teach_in(create_packet(RORG.UTE, [0x90, 0xFF, 0x00, 0x00, 0x01, 0x12, 0xA5]).data) == ()
+
+    def test_registry(self):
+        assert get_decoder("A5-02-05").decode is decode_temperature
+        assert get_decoder("a5-07-01").decode is decode_occupancy
+        assert get_decoder("A5-99-01") is None
+        assert get_decoder(None) is None
+        assert format_profile((0xD5, 0x00, 0x01)) == "D5-00-01"
+        assert DEFAULT_DECODERS[RORG.RPS].decode is decode_rps
+        assert get_decoder("A5-12-01").services['energy']['state_class'] == "total_increasing"
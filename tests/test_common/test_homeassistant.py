@@ -0,0 +1,54 @@
+import copy
+import json
+from unittest import TestCase
+
+from common.homeassistant import DiscoveryPayloadBuilder, PAYLOAD_SENSOR, PAYLOAD_SWITCH_ACTOR, MQTT_NAME, \
+    MQTT_STATE_TOPIC, MQTT_UNIQUE_ID, MQTT_DEVICE, MQTT_DEVICE_IDS, MQTT_COMMAND_TOPIC
+
+ENTITY_TEST = {MQTT_NAME: "Sensor A1", MQTT_STATE_TOPIC: "cubiemedia/enocean/test/a1", MQTT_UNIQUE_ID: "test-a1"}
+DEVICE_TEST = {MQTT_DEVICE_IDS: "test", MQTT_NAME: "EnOcean Switch test"}
+
+
+class TestDiscoveryPayloadBuilder(TestCase):
+    builder = None
+
+    def test_render(self):
+        payload = json.loads(self.builder.render(PAYLOAD_SENSOR, ENTITY_TEST, DEVICE_TEST))
+
+        assert payload[MQTT_NAME] == "Sensor A1"
+        assert payload[MQTT_STATE_TOPIC] == "cubiemedia/enocean/test/a1"
+        assert payload[MQTT_DEVICE][MQTT_DEVICE_IDS] == "test"
+        assert payload[MQTT_DEVICE][MQTT_NAME] == "EnOcean Switch test"
+        assert MQTT_COMMAND_TOPIC not in payload
+
+    def test_templates_unchanged(self):
+        sensor = copy.deepcopy(PAYLOAD_SENSOR)
+        switch = copy.deepcopy(PAYLOAD_SWITCH_ACTOR)
+
+        self.builder.render(PAYLOAD_SENSOR, ENTITY_TEST, DEVICE_TEST)
+        self.builder.render(PAYLOAD_SWITCH_ACTOR, {**ENTITY_TEST, MQTT_COMMAND_TOPIC: "command"}, DEVICE_TEST)
+        assert PAYLOAD_SENSOR == sensor
+        assert PAYLOAD_SWITCH_ACTOR == switch
+
+    def test_cache(self):
+        payload = self.builder.render(PAYLOAD_SENSOR, ENTITY_TEST, DEVICE_TEST)
+        assert self.builder.render(PAYLOAD_SENSOR, dict(ENTITY_TEST), dict(DEVICE_TEST)) is payload
+        assert len(self.builder) == 1
+
+        # different template, entity or device is a different entry
+        assert self.builder.render(PAYLOAD_SWITCH_ACTOR, ENTITY_TEST, DEVICE_TEST) != payload
+        assert self.builder.render(PAYLOAD_SENSOR, {**ENTITY_TEST, MQTT_NAME: "Sensor B1"}, DEVICE_TEST) != payload
+        assert self.builder.render(PAYLOAD_SENSOR, ENTITY_TEST, {**DEVICE_TEST, MQTT_NAME: "Renamed"}) != payload
+        assert len(self.builder) == 4
+
+    def test_max_size(self):
+        self.builder.max_size = 2
+        first = self.builder.render(PAYLOAD_SENSOR, ENTITY_TEST, DEVICE_TEST)
+        self.builder.render(PAYLOAD_SENSOR, {**ENTITY_TEST, MQTT_NAME: "Sensor B1"}, DEVICE_TEST)
+        self.builder.render(PAYLOAD_SENSOR, {**ENTITY_TEST, MQTT_NAME: "Sensor B2"}, DEVICE_TEST)
+
+        assert len(self.builder) == 2
+        assert self.builder.render(PAYLOAD_SENSOR, ENTITY_TEST, DEVICE_TEST) is not first
+
+    def setUp(self):
+        self.builder = DiscoveryPayloadBuilder()
@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from common.metrics import MetricsRegistry, Histogram, instrument, write_metrics_file, read_metrics_files, \
+    MetricsReporter, SUBPROCESS_SPAWNS
+from common.python import execute_command, exit_gracefully
+
+
+class TestMetricsRegistry(TestCase):
+    registry = None
+
+    def test_counter(self):
+        counter = self.registry.counter("cubiemedia_calls_total", "Calls", method="update")
+        counter.inc()
+        counter.inc(2)
+
+        assert self.registry.counter("cubiemedia_calls_total", "Calls", method="update") is counter
+        assert self.registry.render() == ('# HELP cubiemedia_calls_total Calls\n'
+                                          '# TYPE cubiemedia_calls_total counter\n'
+                                          'cubiemedia_calls_total{mode="test",method="update"} 3\n')
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        assert histogram.samples("duration", '{method="send"}') == [
+            'duration_bucket{method="send",le="0.1"} 1',
+            'duration_bucket{method="send",le="1"} 2',
+            'duration_bucket{method="send",le="+Inf"} 3',
+            'duration_sum{method="send"} 5.55',
+            'duration_count{method="send"} 3']
+        assert histogram.snapshot() == {'count': 3, 'avg_ms': 1850.0, 'max_ms': 5000.0}
+
+    def test_callback(self):
+        values = [1, 2]
+        self.registry.callback("cubiemedia_devices", "Devices", lambda: len(values))
+        assert 'cubiemedia_devices{mode="test"} 2\n' in self.registry.render()
+
+        values.append(3)
+        assert self.registry.snapshot() == {'devices': 3}
+
+    def test_instrument(self):
+        system = MagicMock()
+        system.execution_mode = "test"
+        system.config = [{'id': 'Test'}]
+        system.get_statistics.return_value = {'receive_queue_depth': 4}
+        system.mqtt_client.offline_queue.depth.return_value = 0
+        system.mqtt_client.publish_cache.hits = 5
+        system.action.side_effect = RuntimeError("failed")
+        update = system.update
+
+        instrument(system, self.registry)
+        system.update()
+        system.update()
+        system.mqtt_client.publish("topic", "payload")
+        with self.assertRaises(RuntimeError):
+            system.action({})
+
+        assert update.call_count == 2
+        snapshot = self.registry.snapshot()
+        assert snapshot['call_duration_seconds_update']['count'] == 2
+        assert snapshot['call_duration_seconds_publish']['count'] == 1
+        assert snapshot['call_duration_seconds_action']['count'] == 1
+        assert snapshot['call_errors_total_action'] == 1
+        assert snapshot['call_errors_total_update'] == 0
+        assert snapshot['devices'] == 1
+        assert snapshot['publish_cache_hits_total'] == 5
+        assert snapshot['system_receive_queue_depth'] == 4
+
+    def test_subprocess_spawns(self):
+        spawns = SUBPROCESS_SPAWNS.value
+        execute_command(["true"])
+        execute_command(["command-which-does-not-exist"])
+
+        assert SUBPROCESS_SPAWNS.value == spawns + 2
+
+    def test_merge_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.registry.counter("cubiemedia_calls_total", "Calls", method="update").inc()
+            write_metrics_file(os.path.join(directory, "cubiemedia-test.prom"), self.registry)
+            self.registry.constant_labels = {'mode': "other"}
+            write_metrics_file(os.path.join(directory, "cubiemedia-other.prom"), self.registry)
+
+            assert read_metrics_files(directory) == ('# HELP cubiemedia_calls_total Calls\n'
+                                                     '# TYPE cubiemedia_calls_total counter\n'
+                                                     'cubiemedia_calls_total{mode="other",method="update"} 1\n'
+                                                     'cubiemedia_calls_total{mode="test",method="update"} 1\n')
+            assert not [name for name in os.listdir(directory) if name.endswith(".tmp")]
+
+    def test_reporter(self):
+        system = MagicMock()
+        system.execution_mode = "test"
+        system.string_ip = "127_0_0_1"
+        self.registry.counter("cubiemedia_calls_total", "Calls", method="update").inc()
+
+        with tempfile.TemporaryDirectory() as directory:
+            reporter = MetricsReporter(system, registry=self.registry)
+            reporter.path = os.path.join(directory, "cubiemedia-test.prom")
+            reporter.report()
+
+            assert os.path.exists(reporter.path)
+        system.mqtt_client.publish.assert_called_once_with(
+            "cubiemedia/test/127_0_0_1/stats", json.dumps({'calls_total_update': 1}), True)
+
+    def test_stop_on_exit(self):
+        shutdown = MagicMock()
+        exit_gracefully(shutdown.system, 15, None, metrics_reporter=shutdown.reporter)
+
+        # the last stats are published before the system disconnects
+        calls = [name for name, _, _ in shutdown.mock_calls if name.endswith(("stop", "shutdown", "disconnect"))]
+        assert calls == ["reporter.stop", "system.shutdown", "system.mqtt_client.disconnect"]
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.constant_labels = {'mode': "test"}
@@ -1,13 +1,16 @@
 import logging
+import os
 import subprocess
+import tempfile
 import time
 from unittest import TestCase
 from unittest.mock import MagicMock, create_autospec
 
 import pytest
 
-from common import CUBIE_ANNOUNCE, CUBIE_RESET, CUBIE_RELOAD, CUBIE_SYSTEM
+from common import CUBIE_ANNOUNCE, CUBIE_RESET, CUBIE_RELOAD, CUBIE_SYSTEM, DEFAULT_TOPIC_COMMAND
 from common.python import get_default_configuration_for, set_default_configuration
+from common.mqtt_client_wrapper import OfflinePublishQueue, PublishCache
 from system.base_system import BaseSystem
 from test_common import check_mqtt_server, MQTT_HOST_MOCK
 
@@ -94,6 +97,36 @@ class TestCubieMediaMQTTClient(TestCase):
         self.system.reset.assert_called_once()
         self.system.load.assert_called_once()
 
+    def test_on_message_command(self):
+        self.system.send = MagicMock()
+        self.system.save = MagicMock()
+        mqtt_client = self.system.mqtt_client
+        mqtt_client.system = self.system
+        mqtt_client.mqtt_client.subscribe = MagicMock(return_value=(0, 1))
+        mqtt_client.subscribe("cubiemedia/base/10_10_23_20/+/command", 0, self.system.on_command)
+        mqtt_client.subscribe(DEFAULT_TOPIC_COMMAND, 0, mqtt_client.on_default_command)
+
+        msg = MagicMock()
+        msg.topic = "cubiemedia/base/10_10_23_20/reboot/command"
+        msg.payload = b"True"
+        mqtt_client.on_message(None, None, msg)
+        self.system.send.assert_called_once_with({'ip': "10.10.23.20", 'id': "reboot", 'state': "true"})
+
+        # not routed command topics still reach the system
+        msg.topic = "cubiemedia/gpio/10_10_23_20/7/command"
+        msg.payload = b"1"
+        mqtt_client.on_message(None, None, msg)
+        self.system.send.assert_called_with({'ip': "10.10.23.20", 'id': "7", 'state': "1"})
+
+        msg.topic = DEFAULT_TOPIC_COMMAND
+        msg.payload = b'{"type": "base", "mode": "update", "device": {"id": "Test"}}'
+        mqtt_client.on_message(None, None, msg)
+        self.system.save.assert_called_once_with({"id": "Test"})
+
+        msg.payload = b'no json'
+        mqtt_client.on_message(None, None, msg)
+        assert self.system.send.call_count == 2
+
     def test_on_connect(self):
         self.system.announce = MagicMock()
         self.system.mqtt_client.mqtt_client.subscribe = MagicMock()
@@ -104,6 +137,71 @@ class TestCubieMediaMQTTClient(TestCase):
         self.system.announce.assert_called_once()
         self.system.mqtt_client.mqtt_client.subscribe.assert_called()
 
+    def test_subscribe_once_per_session(self):
+        self.system.announce = MagicMock()
+        self.system.reset_discovery = MagicMock()
+        mqtt_client = self.system.mqtt_client
+        mqtt_client.system = self.system
+        mqtt_client.mqtt_client.subscribe = MagicMock(return_value=(0, 1))
+
+        mqtt_client.subscribe("Topic", 0)
+        mqtt_client.subscribe("Topic", 0)
+        mqtt_client.mqtt_client.subscribe.assert_called_once_with("Topic", 0)
+
+        # the broker kept the session, nothing has to be sent again
+        mqtt_client.on_connect(None, None, {'session present': 1}, 0)
+        self.system.reset_discovery.assert_not_called()
+        subscribed = mqtt_client.mqtt_client.subscribe.call_count
+        mqtt_client.on_connect(None, None, {'session present': 1}, 0)
+        assert mqtt_client.mqtt_client.subscribe.call_count == subscribed
+
+        mqtt_client.on_connect(None, None, {'session present': 0}, 0)
+        self.system.reset_discovery.assert_called_once()
+        assert mqtt_client.mqtt_client.subscribe.call_count == subscribed * 2 - 1
+        mqtt_client.subscribe("Topic", 0)
+        assert mqtt_client.mqtt_client.subscribe.call_count == subscribed * 2
+
+    def test_publish_offline(self):
+        mqtt_client = self.system.mqtt_client
+        mqtt_client.mqtt_client = MagicMock()
+        mqtt_client.mqtt_client.is_connected.return_value = False
+        mqtt_client.mqtt_client.publish.return_value.rc = 4  # MQTT_ERR_NO_CONN
+
+        mqtt_client.publish("state", "1", True)
+        mqtt_client.publish("state", "0", True)
+        mqtt_client.publish("event", "pressed")
+        assert mqtt_client.offline_queue.depth() == 2
+
+        # back online, queued messages go out before new ones
+        mqtt_client.mqtt_client.is_connected.return_value = True
+        mqtt_client.mqtt_client.publish.reset_mock()
+        mqtt_client.mqtt_client.publish.return_value.rc = 0
+        mqtt_client.publish("event", "released")
+        mqtt_client._drain_thread.join(1)
+
+        assert mqtt_client.offline_queue.depth() == 0
+        assert [publish_call.args for publish_call in mqtt_client.mqtt_client.publish.call_args_list] == [
+            ("event", "pressed", 0, False), ("event", "released", 0, False), ("state", "0", 0, True)]
+
+    def test_publish_unchanged(self):
+        mqtt_client = self.system.mqtt_client
+        mqtt_client.mqtt_client = MagicMock()
+        mqtt_client.mqtt_client.publish.return_value.rc = 0
+
+        for _ in range(5):
+            mqtt_client.publish("cubiemedia/relay/10_10_23_20/1", "1", True)
+            mqtt_client.publish("cubiemedia/relay/10_10_23_20/online", "true")
+            mqtt_client.publish("cubiemedia/enocean/fefc1be1/a1", 1)
+        assert mqtt_client.mqtt_client.publish.call_count == 7
+
+        # a new session starts with an empty cache
+        mqtt_client.system = self.system
+        self.system.announce = MagicMock()
+        mqtt_client.on_connect(None, None, {'session present': 0}, 0)
+        mqtt_client.mqtt_client.publish.reset_mock()
+        mqtt_client.publish("cubiemedia/relay/10_10_23_20/1", "1", True)
+        mqtt_client.mqtt_client.publish.assert_called_once()
+
     def test_on_disconnect(self):
         self.system.announce = MagicMock()
         self.system.init()
@@ -137,3 +235,118 @@ class TestCubieMediaMQTTClient(TestCase):
         if cls.mqtt_server_process:
             cls.mqtt_server_process.terminate()
             cls.mqtt_server_process.communicate()
+
+
+class TestPublishCache(TestCase):
+
+    def test_retained(self):
+        publish_cache = PublishCache()
+        assert publish_cache.should_publish("cubiemedia/sonar/10_10_23_20/percent", "80", True)
+        assert not publish_cache.should_publish("cubiemedia/sonar/10_10_23_20/percent", "80", True)
+        assert publish_cache.should_publish("cubiemedia/sonar/10_10_23_20/percent", "81", True)
+        assert publish_cache.should_publish("cubiemedia/sonar/10_10_23_20/percent", 81, True)
+        assert publish_cache.stats() == {'hits': 1, 'misses': 3, 'size': 1}
+
+    def test_events_and_availability(self):
+        publish_cache = PublishCache()
+        assert publish_cache.should_publish("cubiemedia/enocean/fefc1be1/a1", 1, False)
+        assert publish_cache.should_publish("cubiemedia/enocean/fefc1be1/a1", 1, False)
+
+        assert publish_cache.should_publish("cubiemedia/victron/10_10_23_20/online", "true", False)
+        assert not publish_cache.should_publish("cubiemedia/victron/10_10_23_20/online", "true", False)
+        assert publish_cache.should_publish("cubiemedia/victron/10_10_23_20/online", "false", False)
+
+    def test_short_push(self):
+        # pushed unretained, released retained, on every short push
+        publish_cache = PublishCache()
+        for _ in range(2):
+            assert publish_cache.should_publish("cubiemedia/enocean/fefc1be1/a1", 1, False)
+            assert publish_cache.should_publish("cubiemedia/enocean/fefc1be1/a1", 0, True)
+        assert publish_cache.stats()['hits'] == 0
+
+    def test_refresh_interval(self):
+        publish_cache = PublishCache(refresh_interval=0.1)
+        assert publish_cache.should_publish("topic", "1", True)
+        assert not publish_cache.should_publish("topic", "1", True)
+
+        time.sleep(0.15)
+        assert publish_cache.should_publish("topic", "1", True)
+
+    def test_max_size(self):
+        publish_cache = PublishCache(max_size=2)
+        for topic in ["one", "two", "three"]:
+            publish_cache.should_publish(topic, "1", True)
+
+        assert publish_cache.stats()['size'] == 2
+        assert publish_cache.should_publish("one", "1", True)
+        assert not publish_cache.should_publish("three", "1", True)
+
+
+class TestOfflinePublishQueue(TestCase):
+    published = None
+
+    def publish(self, topic, payload, retain):
+        self.published.append((topic, payload, retain))
+        return True
+
+    def test_latest_retained_value(self):
+        offline_queue = OfflinePublishQueue()
+        for value in range(10):
+            offline_queue.put("cubiemedia/relay/10_10_23_20/1", str(value), True)
+        assert offline_queue.depth() == 1
+
+        assert offline_queue.drain(self.publish) == 1
+        assert self.published == [("cubiemedia/relay/10_10_23_20/1", "9", True)]
+        assert offline_queue.depth() == 0
+
+    def test_events_in_order(self):
+        offline_queue = OfflinePublishQueue(max_events=3)
+        for value in range(5):
+            offline_queue.put("cubiemedia/enocean/fefc1be1/a1", value, False)
+        assert offline_queue.stats() == {'depth': 3, 'retained': 0, 'events': 3, 'spilled': 0, 'dropped': 2}
+
+        offline_queue.drain(self.publish)
+        assert [payload for _, payload, _ in self.published] == [2, 3, 4]
+
+    def test_max_retained(self):
+        offline_queue = OfflinePublishQueue(max_retained=2)
+        offline_queue.put("one", "1", True)
+        offline_queue.put("two", "2", True)
+        offline_queue.put("three", "3", True)
+        offline_queue.put("one", "4", True)
+        assert offline_queue.stats()['dropped'] == 1
+
+        offline_queue.drain(self.publish)
+        assert self.published == [("two", "2", True), ("one", "4", True)]
+
+    def test_drain_stops_on_failure(self):
+        offline_queue = OfflinePublishQueue()
+        offline_queue.put("event", "1", False)
+        offline_queue.put("event", "2", False)
+
+        assert offline_queue.drain(MagicMock(return_value=False)) == 0
+        assert offline_queue.drain(self.publish, 1) == 1
+        assert offline_queue.depth() == 1
+
+    def test_spill_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spill_file = os.path.join(directory, "offline.jsonl")
+            offline_queue = OfflinePublishQueue(max_events=2, spill_file=spill_file, max_spilled=2)
+            offline_queue.put("event", "text", False)
+            offline_queue.put("event", b"\x7e\x00", False)
+            for value in range(4):
+                offline_queue.put("event", value, False)
+            assert offline_queue.stats() == {'depth': 4, 'retained': 0, 'events': 2, 'spilled': 2, 'dropped': 2}
+
+            # spilled messages survive a restart
+            offline_queue = OfflinePublishQueue(max_events=2, spill_file=spill_file)
+            assert offline_queue.depth() == 2
+            offline_queue.put("event", 3, False)
+
+            assert offline_queue.drain(self.publish) == 3
+            assert self.published == [("event", "text", False), ("event", b"\x7e\x00", False), ("event", 3, False)]
+            assert not os.path.exists(spill_file)
+
+    def setUp(self):
+        self.published = []
+
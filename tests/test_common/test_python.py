@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import common.python
+from common import CUBIE_SYSTEM, CUBIE_ENOCEAN
+from common.python import get_configuration, set_configuration, invalidate_configuration, \
+    get_default_configuration_for, set_default_configuration, set_configuration_cache_max_age, \
+    ConfigurationWriter, find_config_file
+
+DEVICE_TEST = {"id": "Test", "type": "RPS", "dbm": 67}
+NO_SNAP = "error: [Errno 2] No such file or directory: 'snapctl'"
+
+
+class TestConfigurationCache(TestCase):
+    config_backup = None
+    enocean_backup = None
+
+    def test_repeated_reads_from_memory(self):
+        with patch.object(common.python, 'execute_command', return_value=NO_SNAP) as execute_command:
+            config = get_configuration(CUBIE_SYSTEM)
+            assert execute_command.call_count == 2
+
+            for _ in range(10):
+                assert get_configuration(CUBIE_SYSTEM) == config
+            assert execute_command.call_count == 2
+
+    def test_copy_on_read(self):
+        config = get_configuration(CUBIE_SYSTEM)
+        config['mqtt']['server'] = "changed"
+
+        assert get_configuration(CUBIE_SYSTEM)['mqtt']['server'] != "changed"
+
+    def test_set_configuration(self):
+        assert get_configuration(CUBIE_ENOCEAN) == []
+
+        set_configuration(CUBIE_ENOCEAN, [DEVICE_TEST])
+        assert get_configuration(CUBIE_ENOCEAN) == [DEVICE_TEST]
+
+    def test_watch_file(self):
+        assert get_configuration(CUBIE_ENOCEAN) == []
+
+        # changed by another process, e.g. the webtool
+        time.sleep(0.01)
+        set_default_configuration(CUBIE_ENOCEAN, [DEVICE_TEST])
+        assert get_configuration(CUBIE_ENOCEAN) == [DEVICE_TEST]
+
+    def test_invalidate(self):
+        with patch.object(common.python, 'execute_command', return_value=NO_SNAP) as execute_command:
+            get_configuration(CUBIE_SYSTEM)
+            get_configuration(CUBIE_ENOCEAN)
+            assert execute_command.call_count == 4
+
+            invalidate_configuration(CUBIE_ENOCEAN)
+            get_configuration(CUBIE_SYSTEM)
+            get_configuration(CUBIE_ENOCEAN)
+            assert execute_command.call_count == 6
+
+            invalidate_configuration()
+            get_configuration(CUBIE_SYSTEM)
+            get_configuration(CUBIE_ENOCEAN)
+            assert execute_command.call_count == 10
+
+    def test_snap_configuration(self):
+        snap_value = json.dumps([DEVICE_TEST])
+        with patch.object(common.python, 'execute_command', return_value=snap_value) as execute_command:
+            assert get_configuration(CUBIE_ENOCEAN) == [DEVICE_TEST]
+            assert get_configuration(CUBIE_ENOCEAN) == [DEVICE_TEST]
+            execute_command.assert_called_once()
+
+            set_configuration(CUBIE_ENOCEAN, [])
+            assert get_configuration(CUBIE_ENOCEAN) == []
+            assert execute_command.call_count == 2
+
+            set_configuration_cache_max_age(0)
+            assert get_configuration(CUBIE_ENOCEAN) == [DEVICE_TEST]
+            assert execute_command.call_count == 3
+
+    def setUp(self):
+        invalidate_configuration()
+        set_default_configuration(CUBIE_ENOCEAN, [])
+
+    def tearDown(self):
+        set_configuration_cache_max_age(None)
+        invalidate_configuration()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.config_backup = get_default_configuration_for(CUBIE_SYSTEM)
+        cls.enocean_backup = get_default_configuration_for(CUBIE_ENOCEAN)
+
+    @classmethod
+    def tearDownClass(cls):
+        set_default_configuration(CUBIE_SYSTEM, cls.config_backup)
+        set_default_configuration(CUBIE_ENOCEAN, cls.enocean_backup)
+
+
+class TestConfigurationWriter(TestCase):
+    set_configuration_patch = None
+    set_configuration = None
+    writer = None
+
+    def test_coalesce_changes(self):
+        config = [DEVICE_TEST]
+        for _ in range(10):
+            self.writer.schedule(CUBIE_ENOCEAN, config)
+        self.set_configuration.assert_not_called()
+        assert self.writer.has_pending(CUBIE_ENOCEAN)
+
+        time.sleep(0.3)
+        self.set_configuration.assert_called_once_with(CUBIE_ENOCEAN, config)
+        assert not self.writer.has_pending()
+
+    def test_quiet_period(self):
+        self.writer.schedule(CUBIE_ENOCEAN, [])
+        time.sleep(0.05)
+        self.writer.schedule(CUBIE_ENOCEAN, [DEVICE_TEST])
+        time.sleep(0.05)
+        self.set_configuration.assert_not_called()
+
+        time.sleep(0.2)
+        self.set_configuration.assert_called_once_with(CUBIE_ENOCEAN, [DEVICE_TEST])
+
+    def test_max_delay(self):
+        self.writer.max_delay = 0.2
+        for _ in range(6):
+            self.writer.schedule(CUBIE_ENOCEAN, [DEVICE_TEST])
+            time.sleep(0.05)
+        self.set_configuration.assert_called_once()
+
+    def test_flush(self):
+        self.writer.schedule(CUBIE_ENOCEAN, [DEVICE_TEST])
+        self.writer.schedule(CUBIE_SYSTEM, {})
+        self.writer.flush(CUBIE_ENOCEAN)
+        self.set_configuration.assert_called_once_with(CUBIE_ENOCEAN, [DEVICE_TEST])
+
+        self.writer.flush()
+        self.set_configuration.assert_called_with(CUBIE_SYSTEM, {})
+        assert self.set_configuration.call_count == 2
+
+        self.writer.flush()
+        assert self.set_configuration.call_count == 2
+
+    def test_snapshot(self):
+        config = [dict(DEVICE_TEST)]
+        self.writer.schedule(CUBIE_ENOCEAN, config)
+        config[0]['state'] = {'a1': 1}
+        config.append({'id': "changed"})
+
+        self.writer.flush()
+        self.set_configuration.assert_called_once_with(CUBIE_ENOCEAN, [DEVICE_TEST])
+
+    def test_flush_waits_for_write(self):
+        written = []
+        writing = threading.Event()
+
+        def slow_write(config_name, config):
+            writing.set()
+            time.sleep(0.2)
+            written.append(config)
+
+        self.set_configuration.side_effect = slow_write
+        self.writer.schedule(CUBIE_ENOCEAN, [DEVICE_TEST])
+        assert writing.wait(1)
+        self.writer.flush()
+        assert written == [[DEVICE_TEST]]
+
+    def test_discard(self):
+        self.writer.schedule(CUBIE_ENOCEAN, [DEVICE_TEST])
+        self.writer.discard()
+        assert not self.writer.has_pending()
+
+        time.sleep(0.2)
+        self.set_configuration.assert_not_called()
+
+    def test_atomic_write(self):
+        backup = get_default_configuration_for(CUBIE_ENOCEAN)
+        try:
+            set_default_configuration(CUBIE_ENOCEAN, [DEVICE_TEST])
+            assert get_default_configuration_for(CUBIE_ENOCEAN) == [DEVICE_TEST]
+            config_directory = os.path.dirname(os.path.abspath(find_config_file(CUBIE_ENOCEAN)))
+            assert not [name for name in os.listdir(config_directory) if name.endswith(".tmp")]
+        finally:
+            set_default_configuration(CUBIE_ENOCEAN, backup)
+
+    def setUp(self):
+        self.set_configuration_patch = patch.object(common.python, 'set_configuration')
+        self.set_configuration = self.set_configuration_patch.start()
+        self.writer = ConfigurationWriter(0.1)
+
+    def tearDown(self):
+        self.writer.flush()
+        self.set_configuration_patch.stop()
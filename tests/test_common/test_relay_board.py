@@ -0,0 +1,101 @@
+import os
+import time
+from unittest import TestCase
+
+from requests import RequestException
+
+from common.relay_board import RelayBoard, StatusParser, StatusError, parse_status
+from test_common import FakeRelayBoard
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as fixture:
+        return fixture.read()
+
+
+class TestRelayBoard(TestCase):
+    fake_board = None
+
+    def test_read_status(self):
+        board = RelayBoard(self.fake_board.ip)
+        self.fake_board.relays[2] = "1"
+
+        status = board.read_status()
+        assert status == {'0': '0', '1': '0', '2': '1', '3': '0', '4': '0', '5': '0', '6': '0', '7': '0'}
+        board.read_status()
+        # keep-alive, both requests use the same connection
+        assert len(self.fake_board.connections) == 1
+        board.close()
+
+    def test_set_status(self):
+        board = RelayBoard(self.fake_board.ip)
+        board.set_status(3, "1")
+        board.set_status(4, b"1", True)
+        board.set_status(3, "0")
+
+        assert self.fake_board.requests == ["/io.cgi?DOA3", "/io.cgi?DOA4=30", "/io.cgi?DOI3"]
+        assert self.fake_board.relays[:4] == ["0", "0", "0", "1"]
+        board.close()
+
+    def test_backoff(self):
+        stalled_board = FakeRelayBoard(stalled=True)
+        board = RelayBoard(stalled_board.ip, timeout=(0.1, 0.1), backoff=10, max_backoff=15)
+        try:
+            for failures in range(1, 4):
+                start = time.monotonic()
+                self.assertRaises(RequestException, board.read_status)
+                assert board.failures == failures
+                assert not board.is_available()
+                assert board.retry_at - start <= [10, 15, 15][failures - 1] + 1
+        finally:
+            stalled_board.close()
+
+        board.ip = self.fake_board.ip
+        board.read_status()
+        assert board.failures == 0
+        assert board.is_available()
+
+    def test_error_status(self):
+        board = RelayBoard(self.fake_board.ip, backoff=10)
+        for status_code in [401, 500]:
+            self.fake_board.status_code = status_code
+            self.assertRaises(RequestException, board.set_status, 3, "1")
+            self.assertRaises(RequestException, board.read_status)
+        assert board.failures == 4
+        assert not board.is_available()
+        board.close()
+
+    def test_parse_status(self):
+        status = parse_status(read_fixture("eth008_status.xml"))
+        assert status.relays == {'0': '0', '1': '1', '2': '0', '3': '0', '4': '1', '5': '0', '6': '0', '7': '0'}
+        assert status.digital_inputs == {}
+        assert status.analog_inputs == {}
+
+        status = parse_status(read_fixture("eth484_status.xml"))
+        assert status.relays == {'0': '1', '1': '0', '2': '0', '3': '1'}
+        assert status.digital_inputs == {'0': '1', '1': '0', '2': '0', '3': '0'}
+        assert status.analog_inputs == {'0': 512, '1': 0, '2': 1023, '3': 17}
+
+        assert parse_status(b"<response><relay0>x</relay0></response>").relays == {'0': 'unknown'}
+
+    def test_parse_incremental(self):
+        content = read_fixture("eth484_status.xml")
+        parser = StatusParser()
+        for index in range(0, len(content), 7):
+            parser.feed(content[index:index + 7])
+        assert parser.close().analog_inputs == parse_status(content).analog_inputs
+
+    def test_parse_invalid(self):
+        self.assertRaises(StatusError, parse_status, read_fixture("eth008_status_truncated.xml"))
+        self.assertRaises(StatusError, parse_status, b"<html><body>Unauthorized</body></html>")
+        self.assertRaises(StatusError, parse_status, b"<response><relay0>1</relay1></response>")
+        self.assertRaises(StatusError, parse_status, b"<response><relay0><a>1</a></relay0></response>")
+        self.assertRaises(StatusError, parse_status, b"")
+
+    def setUp(self):
+        self.fake_board = FakeRelayBoard()
+
+    def tearDown(self):
+        self.fake_board.close()
@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from common.scheduler import UpdateScheduler, NotifyingQueue
+
+
+class TestUpdateScheduler(TestCase):
+    scheduler = None
+
+    def test_wait_until_deadline(self):
+        start = time.time()
+        ready = self.scheduler.wait(start + 0.2)
+
+        assert ready == []
+        assert time.time() - start >= 0.19
+
+    def test_wait_with_past_deadline(self):
+        start = time.time()
+        self.scheduler.wait(start - 10)
+
+        assert time.time() - start < 0.1
+
+    def test_notify_before_wait(self):
+        self.scheduler.notify()
+
+        start = time.time()
+        self.scheduler.wait(start + 5)
+        assert time.time() - start < 0.1
+
+        # notification has been consumed, next wait blocks again
+        start = time.time()
+        self.scheduler.wait(start + 0.1)
+        assert time.time() - start >= 0.09
+
+    def test_notify_from_thread(self):
+        self.scheduler.wait(time.time())
+        timer = threading.Timer(0.1, self.scheduler.notify)
+        timer.start()
+
+        start = time.time()
+        self.scheduler.wait(start + 5)
+        assert 0.05 < time.time() - start < 1
+
+    def test_readable_file_descriptor(self):
+        reader, writer = os.pipe()
+        try:
+            start = time.time()
+            assert self.scheduler.wait(start + 0.1, [reader]) == []
+
+            os.write(writer, b'data')
+            start = time.time()
+            assert self.scheduler.wait(start + 5, [reader]) == [reader]
+            assert time.time() - start < 0.1
+
+            # file descriptors which are not reported anymore are not watched anymore
+            start = time.time()
+            assert self.scheduler.wait(start + 0.1) == []
+        finally:
+            os.close(reader)
+            os.close(writer)
+
+    def test_close(self):
+        self.scheduler.wait(time.time())
+        self.scheduler.close()
+        self.scheduler.notify()
+
+        start = time.time()
+        self.scheduler.wait(start + 5)
+        assert time.time() - start < 0.1
+
+    def test_notifying_queue(self):
+        callback = MagicMock()
+        notifying_queue = NotifyingQueue(callback)
+
+        notifying_queue.put("packet")
+        callback.assert_called_once()
+        assert notifying_queue.get(block=False) == "packet"
+
+        notifying_queue.put("packet")
+        notifying_queue.put("packet")
+        notifying_queue.get(block=False)
+        assert notifying_queue.max_depth == 2
+
+    def setUp(self):
+        self.scheduler = UpdateScheduler()
+
+    def tearDown(self):
+        self.scheduler.close()
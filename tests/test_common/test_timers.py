@@ -0,0 +1,64 @@
+import threading
+import time
+from unittest import TestCase
+
+from common.timers import TimerScheduler
+
+
+class TestTimerScheduler(TestCase):
+    scheduler = None
+
+    def test_order(self):
+        calls = []
+        done = threading.Event()
+        self.scheduler.schedule(0.1, calls.append, "late")
+        self.scheduler.schedule(0.05, calls.append, "early")
+        self.scheduler.schedule(0.15, done.set)
+
+        assert done.wait(1)
+        assert calls == ["early", "late"]
+
+    def test_earlier_deadline_wakes_up(self):
+        done = threading.Event()
+        self.scheduler.schedule(5, done.set)
+        start = time.monotonic()
+        self.scheduler.schedule(0.05, done.set)
+
+        assert done.wait(1)
+        assert time.monotonic() - start < 0.5
+
+    def test_cancel(self):
+        calls = []
+        done = threading.Event()
+        timer = self.scheduler.schedule(0.05, calls.append, "cancelled")
+        self.scheduler.schedule(0.1, done.set)
+        assert self.scheduler.pending() == 2
+
+        timer.cancel()
+        assert self.scheduler.pending() == 1
+        assert done.wait(1)
+        assert calls == []
+
+    def test_failing_callback(self):
+        done = threading.Event()
+        self.scheduler.schedule(0.01, lambda: 1 / 0)
+        self.scheduler.schedule(0.02, done.set)
+
+        assert done.wait(1)
+
+    def test_shutdown(self):
+        calls = []
+        self.scheduler.schedule(0.05, calls.append, "pending")
+        self.scheduler.shutdown()
+
+        timer = self.scheduler.schedule(0.01, calls.append, "after shutdown")
+        assert timer.cancelled
+        time.sleep(0.1)
+        assert calls == []
+        assert self.scheduler.pending() == 0
+
+    def setUp(self):
+        self.scheduler = TimerScheduler()
+
+    def tearDown(self):
+        self.scheduler.shutdown()
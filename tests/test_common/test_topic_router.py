@@ -0,0 +1,77 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from common.topic_router import TopicRouter
+
+
+class TestTopicRouter(TestCase):
+    router = None
+
+    def test_exact_match(self):
+        handler = MagicMock()
+        self.router.add("cubiemedia/command", handler)
+
+        assert self.router.dispatch("cubiemedia/command", b'{}')
+        handler.assert_called_once_with(("cubiemedia", "command"), b'{}')
+
+        assert not self.router.dispatch("cubiemedia/relay/command", b'{}')
+        assert not self.router.dispatch("cubiemedia", b'{}')
+        handler.assert_called_once()
+
+    def test_single_level_wildcard(self):
+        handler = MagicMock()
+        self.router.add("cubiemedia/relay/10_10_23_20/+/command", handler)
+
+        assert self.router.dispatch("cubiemedia/relay/10_10_23_20/3/command", b'1')
+        handler.assert_called_once_with(("cubiemedia", "relay", "10_10_23_20", "3", "command"), b'1')
+
+        assert not self.router.dispatch("cubiemedia/relay/10_10_23_20/command", b'1')
+        assert not self.router.dispatch("cubiemedia/relay/10_10_23_20/3/4/command", b'1')
+
+    def test_multi_level_wildcard(self):
+        handler = MagicMock()
+        self.router.add("cubiemedia/#", handler)
+
+        assert self.router.dispatch("cubiemedia", b'')
+        assert self.router.dispatch("cubiemedia/relay", b'')
+        assert self.router.dispatch("cubiemedia/relay/10_10_23_20/3/command", b'')
+        assert not self.router.dispatch("homeassistant/status", b'')
+        assert handler.call_count == 3
+
+    def test_system_topics(self):
+        handler = MagicMock()
+        self.router.add("#", handler)
+        self.router.add("+/broker/uptime", handler)
+
+        assert not self.router.dispatch("$SYS/broker/uptime", b'')
+
+        self.router.add("$SYS/#", handler)
+        assert self.router.dispatch("$SYS/broker/uptime", b'')
+        handler.assert_called_once()
+
+    def test_multiple_handlers(self):
+        first, second = MagicMock(side_effect=RuntimeError("failed")), MagicMock()
+        self.router.add("cubiemedia/+/command", first)
+        self.router.add("cubiemedia/gpio/command", second)
+        self.router.add("cubiemedia/gpio/command", second)
+
+        # a failing handler does not stop the others
+        assert self.router.dispatch("cubiemedia/gpio/command", b'')
+        first.assert_called_once()
+        second.assert_called_once()
+
+    def test_remove(self):
+        handler = MagicMock()
+        self.router.add("cubiemedia/+/command", handler)
+        assert self.router.dispatch("cubiemedia/gpio/command", b'')
+
+        # cached matches are dropped
+        self.router.remove("cubiemedia/+/command", handler)
+        assert not self.router.dispatch("cubiemedia/gpio/command", b'')
+
+        self.router.add("cubiemedia/+/command", handler)
+        self.router.clear()
+        assert not self.router.dispatch("cubiemedia/gpio/command", b'')
+
+    def setUp(self):
+        self.router = TopicRouter()
@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from common.balboa import encode_frame, STATUS_UPDATE, FrameReader, Frame
+from system.balboa_system import BalboaSystem, ServiceRateLimiter, STATUS_DECODER, get_state_from
+from system.base_system import BaseSystem
+from test_common import FakeSpa
+from test_common.test_balboa import STATUS_PAYLOAD
+
+SPA_IP = "127.0.0.1"
+STALLED_SPA_IP = "127.0.0.2"
+REFUSING_SPA_IP = "127.0.0.3"
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "test_common", "fixtures")
+
+
+def read_hex_fixture(name: str) -> list:
+    with open(os.path.join(FIXTURES, name)) as fixture:
+        return [bytes.fromhex(line) for line in fixture if line.strip() and not line.startswith("#")]
+
+
+def status_frame(**changes) -> bytes:
+    payload = bytearray(STATUS_PAYLOAD)
+    for index, value in changes.items():
+        payload[int(index[1:])] = value
+    return encode_frame(STATUS_UPDATE, bytes(payload))
+
+
+class TestServiceRateLimiter(TestCase):
+
+    def test_filter(self):
+        limiter = ServiceRateLimiter({'current_temperature': 60})
+
+        assert limiter.filter({'current_temperature': 38.0, 'light': 1}, 0) == {'current_temperature': 38.0,
+                                                                                 'light': 1}
+        # jitter within the limit is held back, switches are not limited
+        assert limiter.filter({'current_temperature': 38.5, 'light': 0}, 1) == {'light': 0}
+        assert limiter.next_release() == 60
+        assert limiter.release(30) == {}
+        assert limiter.filter({'current_temperature': 38.0}, 40) == {}
+        assert limiter.release(60) == {}
+        assert limiter.next_release() == float('inf')
+
+        assert limiter.filter({'current_temperature': 39.0}, 70) == {'current_temperature': 39.0}
+        assert limiter.filter({'current_temperature': 39.5}, 80) == {}
+        assert limiter.release(130) == {'current_temperature': 39.5}
+
+
+class TestStatusDecoder(TestCase):
+
+    def test_decode_fixture(self):
+        reader = FrameReader()
+        frames = [frame for chunk in read_hex_fixture("balboa_status.hex") for frame in reader.feed(chunk)]
+        assert [frame.message_type for frame in frames] == [STATUS_UPDATE, b'\x10\xbf\x06', STATUS_UPDATE,
+                                                            STATUS_UPDATE]
+        assert reader.dropped == 1
+        status = [STATUS_DECODER.decode(frame.payload) for frame in frames if frame.message_type == STATUS_UPDATE]
+
+        assert status[0] == {'light': 1, 'jets': 1, 'blower': 0, 'circulation_pump': 1, 'heating': 'heating',
+                             'temperature_control': 'heat', 'current_temperature': 38.0, 'target_temperature': 38.5,
+                             'priming': 0, 'heating_mode': 'ready', 'pump_1': 'high', 'pump_2': 'off', 'hour': 12,
+                             'minute': 30, 'temperature_scale': '°C', 'time_scale': '24h',
+                             'temperature_range': 'performance'}
+        assert status[1] == {'light': 0, 'jets': 0, 'blower': 0, 'circulation_pump': 0, 'heating': 'off',
+                             'temperature_control': 'off', 'current_temperature': None, 'target_temperature': 37.0,
+                             'priming': 1, 'heating_mode': 'rest', 'pump_1': 'off', 'pump_2': 'off', 'hour': 6,
+                             'minute': 2, 'temperature_scale': '°C', 'time_scale': '24h', 'temperature_range': 'eco'}
+        assert status[2] == {'light': 0, 'jets': 1, 'blower': 1, 'circulation_pump': 0, 'heating': 'off',
+                             'temperature_control': 'off', 'current_temperature': 39.5, 'target_temperature': 40.0,
+                             'priming': 0, 'heating_mode': 'ready_in_rest', 'pump_1': 'high', 'pump_2': 'high',
+                             'hour': 7, 'minute': 5, 'temperature_scale': '°C', 'time_scale': '12h',
+                             'temperature_range': 'eco'}
+
+    def test_get_state_from(self):
+        frames = [frame for chunk in read_hex_fixture("balboa_status.hex") for frame in FrameReader().feed(chunk)]
+        known_device = {'id': SPA_IP, 'state': {'current_temperature': 37.5}}
+
+        assert get_state_from(frames[0].payload, known_device)['clock'] == "12:30"
+        # the priming spa has no temperature, the last one is kept
+        changes = get_state_from(frames[2].payload, known_device)
+        assert 'current_temperature' not in changes and known_device['state']['current_temperature'] == 38.0
+        assert changes == {'light': 0, 'jets': 0, 'circulation_pump': 0, 'heating': 'off',
+                           'temperature_control': 'off', 'target_temperature': 37.0, 'priming': 1,
+                           'heating_mode': 'rest', 'pump_1': 'off', 'clock': "06:02"}
+        assert get_state_from(frames[2].payload, known_device) == {}
+
+
+class TestBalboaSystem(TestCase):
+    fake_spa = None
+    system = None
+
+    def test_push_updates(self):
+        self.fake_spa.send(status_frame())
+        changes = self._wait_for_update()
+        assert changes == {'light': 1, 'jets': 1, 'blower': 0, 'circulation_pump': 1, 'heating': 'heating',
+                           'temperature_control': 'heat', 'current_temperature': 38.0, 'target_temperature': 38.5,
+                           'priming': 0, 'heating_mode': 'ready', 'pump_1': 'high', 'pump_2': 'off',
+                           'clock': "12:30"}
+
+        # repeated frames and temperature jitter within the rate limit are not published
+        self.fake_spa.send(status_frame() + status_frame(b2=0x4d))
+        time.sleep(0.3)
+        assert self.system.update() == {}
+        assert self.system._spa_dict[SPA_IP]['limiter'].held == {'current_temperature': 38.5}
+        assert self.system._spa_dict[SPA_IP]['limiter'].next_release() > time.time() + 50
+
+        self.fake_spa.send(status_frame(b2=0x4d, b14=0x00))
+        assert self._wait_for_update() == {'light': 0}
+        self.system.mqtt_client.publish.assert_any_call(f"cubiemedia/balboa/{SPA_IP.replace('.', '_')}/online",
+                                                        "true")
+
+    def test_apply_on_main_loop(self):
+        self.fake_spa.send(status_frame())
+        deadline = time.monotonic() + 1
+        while not self.system.status_updates and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # the worker only queues the decoded status, the state is changed by update
+        assert self.system.status_updates[0][1]['clock'] == "12:30"
+        assert self.system.config.get(SPA_IP)['state'] == {}
+        assert 'limiter' not in self.system._spa_dict[SPA_IP]
+        assert self._wait_for_update()['light'] == 1
+        assert self.system.config.get(SPA_IP)['state']['light'] == 1
+
+    def test_rate_limit_per_spa(self):
+        self.system.config.get(SPA_IP)['rate_limit'] = {'current_temperature': 0.5}
+        self.fake_spa.send(status_frame())
+        self._wait_for_update()
+
+        self.fake_spa.send(status_frame(b2=0x4d))
+        time.sleep(0.2)
+        assert self.system.update() == {}
+        time.sleep(max(0.0, self.system.next_update() - time.time()))
+        assert self.system.update()['devices'][0]['state'] == {'current_temperature': 38.5}
+
+    def test_send(self):
+        self.fake_spa.send(status_frame())
+        self._wait_for_update()
+
+        self.system.send({'ip': SPA_IP, 'id': 'jets', 'state': 0})
+        self.system.send({'ip': SPA_IP, 'id': 'light', 'state': 0})
+        deadline = time.monotonic() + 1
+        while len(self.fake_spa.received) < 18 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert FrameReader().feed(bytes(self.fake_spa.received)) == [Frame(b'\x0a\xbf\x11', b'\x04\x00'),
+                                                                     Frame(b'\x0a\xbf\x11', b'\x11\x00')]
+        # commands use the connection of the reader
+        assert self.fake_spa.connections == 1
+
+        self.fake_spa.send(status_frame(b11=0x00, b14=0x00))
+        assert self._wait_for_update() == {'light': 0, 'jets': 0, 'pump_1': 'off'}
+
+    def test_send_to_unreachable_spa(self):
+        self.system.config.append({'id': REFUSING_SPA_IP, 'type': 'balboa', 'state': {'light': 1}})
+        self.system._spa_dict[REFUSING_SPA_IP] = {}
+        self.system._start_worker(REFUSING_SPA_IP)
+        deadline = time.monotonic() + 1
+        while self.system._spa_dict[REFUSING_SPA_IP].get('online') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # the command is dropped, the main loop does not connect to a spa in backoff
+        connection = self.system._spa_dict[REFUSING_SPA_IP]['connection']
+        assert connection.retry_at > time.monotonic()
+        with patch("common.balboa.socket.create_connection") as create_connection:
+            assert self.system.send({'ip': REFUSING_SPA_IP, 'id': 'light', 'state': 0})
+        create_connection.assert_not_called()
+        assert not connection.is_connected()
+
+    def test_reload(self):
+        self.fake_spa.send(status_frame())
+        self._wait_for_update()
+        old_worker = self.system._spa_dict[SPA_IP]['worker']
+        self.system.mqtt_client.publish.reset_mock()
+
+        with patch.object(BaseSystem, 'load'):
+            self.system.load()
+        # the old worker is gone before the new one connects, the spa stays online
+        assert not old_worker.is_alive()
+        deadline = time.monotonic() + 1
+        while (self.fake_spa.connections < 2 or len(self.fake_spa.clients) > 1) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert self.fake_spa.connections == 2 and len(self.fake_spa.clients) == 1
+        self.fake_spa.send(status_frame())
+        deadline = time.monotonic() + 1
+        while not self.system._spa_dict[SPA_IP].get('online') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert self.system._spa_dict[SPA_IP]['worker'].is_alive()
+        self.system.mqtt_client.publish.assert_called_once_with(
+            f"cubiemedia/balboa/{SPA_IP.replace('.', '_')}/online", "true")
+
+    def test_unreachable_spa(self):
+        # on the port of the first spa, one spa accepts but never sends and nothing listens for the other one
+        stalled_spa = FakeSpa(STALLED_SPA_IP, self.fake_spa.port)
+        try:
+            for spa_ip in [STALLED_SPA_IP, REFUSING_SPA_IP]:
+                self.system.config.append({'id': spa_ip, 'type': 'balboa', 'state': {}})
+                self.system._spa_dict[spa_ip] = {}
+                self.system._start_worker(spa_ip)
+            assert stalled_spa.wait_for_client()
+
+            # the first spa is read while the others wait for their timeout and backoff
+            for light in [0x00, 0x03, 0x00]:
+                start = time.monotonic()
+                self.fake_spa.send(status_frame(b14=light))
+                assert self._wait_for_update()['light'] == (1 if light else 0)
+                assert time.monotonic() - start < 0.5
+
+            statistics = self.system.get_statistics()
+            assert statistics == {'spas_online': 1, 'spas_in_backoff': 1, 'spa_connects': 2}
+            self.system.mqtt_client.publish.assert_any_call(
+                f"cubiemedia/balboa/{REFUSING_SPA_IP.replace('.', '_')}/online", "false")
+        finally:
+            self._stop_workers()
+            stalled_spa.close()
+
+    def test_found_spa_while_locked(self):
+        self.system.announce = MagicMock()
+        self.system.system_config = {'devices_can_be_added': False}
+        self.system._spa_dict[STALLED_SPA_IP] = {}
+        self.system.last_update = -1
+        self.system.update()
+
+        # a spa which was not added is not read
+        assert self.system.config.get(STALLED_SPA_IP) is None
+        assert 'worker' not in self.system._spa_dict[STALLED_SPA_IP]
+        self.system.announce.assert_not_called()
+
+    def _stop_workers(self):
+        self.system._workers_event.set()
+        for spa_ip, spa in list(self.system._spa_dict.items()):
+            self.system._close_connection(spa_ip)
+            if 'worker' in spa:
+                spa['worker'].join()
+
+    def _wait_for_update(self, timeout: float = 3) -> dict:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            data = self.system.update()
+            if data:
+                return data['devices'][0]['state']
+            time.sleep(0.05)
+        return {}
+
+    def setUp(self):
+        self.fake_spa = FakeSpa()
+        self.port_patch = patch("system.balboa_system.BALBOA_PORT", self.fake_spa.port)
+        self.port_patch.start()
+        self.system = BalboaSystem()
+        self.system.mqtt_client.publish = MagicMock()
+        self.system.config.append({'id': SPA_IP, 'type': 'balboa', 'state': {}})
+        self.system._spa_dict = {SPA_IP: {}}
+        self.system._start_worker(SPA_IP)
+        assert self.fake_spa.wait_for_client()
+
+    def tearDown(self):
+        self._stop_workers()
+        self.fake_spa.close()
+        self.port_patch.stop()
@@ -5,7 +5,7 @@ from unittest.mock import MagicMock
 from common import MQTT_CUBIEMEDIA, DEFAULT_MQTT_SERVER, DEFAULT_MQTT_USERNAME, \
     DEFAULT_MQTT_PASSWORD, CUBIE_SYSTEM
 from common.python import get_default_configuration_for, set_default_configuration
-from system.base_system import BaseSystem
+from system.base_system import BaseSystem, DeviceRegistry, get_spill_file
 from test_common import MQTT_HOST_MOCK, check_mqtt_server, MQTT_LOGIN_MOCK
 
 DEVICE_TEST = {"id": "Test"}
@@ -42,6 +42,12 @@ class TestBaseSystem(TestCase):
         assert self.system.get_mqtt_login()[1] == DEFAULT_MQTT_PASSWORD
         assert self.system.config == []
 
+    def test_get_spill_file(self):
+        assert get_spill_file("/var/snap/offline.jsonl", "enocean") == "/var/snap/offline-enocean.jsonl"
+        assert get_spill_file("offline", "relay") == "offline-relay"
+        assert get_spill_file(None, "relay") is None
+        assert get_spill_file("", "relay") is None
+
     def test_save(self):
         self.system.load()
         self.system.reset()
@@ -87,6 +93,32 @@ class TestBaseSystem(TestCase):
         self.system.reset()
         assert self.system.config == []
 
+    def test_publish_discovery(self):
+        self.system.mqtt_client.publish = MagicMock()
+
+        assert self.system.publish_discovery("config/topic", b'{"name": "Test"}')
+        assert not self.system.publish_discovery("config/topic", b'{"name": "Test"}')
+        self.system.mqtt_client.publish.assert_called_once_with("config/topic", b'{"name": "Test"}', retain=True)
+
+        assert self.system.publish_discovery("config/topic", b'{"name": "Changed"}')
+        assert self.system.publish_discovery("config/other_topic", b'{"name": "Changed"}')
+        assert self.system.mqtt_client.publish.call_count == 3
+
+        self.system.reset_discovery()
+        assert self.system.publish_discovery("config/topic", b'{"name": "Changed"}')
+        assert self.system.mqtt_client.publish.call_count == 4
+
+    def test_announce_unchanged(self):
+        self.system.mqtt_client.publish = MagicMock()
+        self.system.mqtt_client.subscribe = MagicMock()
+
+        self.system.announce()
+        published = self.system.mqtt_client.publish.call_count
+        assert published > 0
+
+        self.system.announce()
+        assert self.system.mqtt_client.publish.call_count == published
+
     def setUp(self):
         self.system = BaseSystem()
         self.system.get_mqtt_server = MQTT_HOST_MOCK
@@ -105,3 +137,69 @@ class TestBaseSystem(TestCase):
         if cls.mqtt_server_process:
             cls.mqtt_server_process.terminate()
             cls.mqtt_server_process.communicate()
+
+
+class TestDeviceRegistry(TestCase):
+
+    def test_get(self):
+        registry = DeviceRegistry([DEVICE_TEST, DEVICE_TEST2, {"id": 17}, {"no_id": True}])
+
+        assert registry.get("test") is DEVICE_TEST
+        assert registry.get("TEST2") is DEVICE_TEST2
+        assert registry.get(17) == {"id": 17}
+        assert registry.get("17") == {"id": 17}
+        assert registry.get("unknown") is None
+        assert registry == [DEVICE_TEST, DEVICE_TEST2, {"id": 17}, {"no_id": True}]
+
+    def test_put(self):
+        registry = DeviceRegistry([DEVICE_TEST, DEVICE_TEST2])
+        altered_device = {"id": "Test", "something": "ihavebeenset"}
+
+        assert registry.put(altered_device) is DEVICE_TEST
+        assert registry == [altered_device, DEVICE_TEST2]
+        assert registry.get("Test") is altered_device
+
+        new_device = {"id": "Test3"}
+        assert registry.put(new_device) is None
+        assert registry == [altered_device, DEVICE_TEST2, new_device]
+
+    def test_list_operations(self):
+        registry = DeviceRegistry()
+        registry.append(DEVICE_TEST)
+        registry += [DEVICE_TEST2]
+        assert registry.get("Test2") is DEVICE_TEST2
+
+        registry.remove(DEVICE_TEST)
+        assert registry.get("Test") is None
+
+        registry.insert(0, DEVICE_TEST)
+        assert registry.pop() is DEVICE_TEST2
+        assert registry.get("Test2") is None
+
+        registry[0] = DEVICE_TEST2
+        assert registry.get("Test") is None
+        assert registry.get("Test2") is DEVICE_TEST2
+
+        del registry[0]
+        assert registry.get("Test2") is None
+
+        registry.extend([DEVICE_TEST, DEVICE_TEST2])
+        registry.clear()
+        assert registry.get("Test") is None
+
+    def test_duplicate_ids(self):
+        duplicate = {"id": "TEST"}
+        registry = DeviceRegistry([DEVICE_TEST, duplicate])
+        assert registry.get("test") is DEVICE_TEST
+
+        assert registry.remove_device("test") is DEVICE_TEST
+        assert registry.get("test") is duplicate
+
+    def test_reindex(self):
+        device = {"id": "Test"}
+        registry = DeviceRegistry([device])
+
+        device['id'] = "Changed"
+        registry.reindex()
+        assert registry.get("Test") is None
+        assert registry.get("changed") is device
@@ -1,13 +1,16 @@
+import json
 import subprocess
 import time
+from datetime import datetime
 from unittest import TestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from enocean.protocol.constants import RORG
-from enocean.protocol.packet import Packet
+from enocean.protocol.constants import PACKET as PACKET_TYPE, RORG
+from enocean.protocol.packet import Packet, RadioPacket
 
 from common import CUBIE_SYSTEM, CUBIE_ENOCEAN
 from common.python import set_default_configuration, get_default_configuration_for, get_mqtt_configuration
+from common.scheduler import NotifyingQueue
 from system.enocean_system import EnoceanSystem
 from test_common import check_mqtt_server, MQTT_HOST_MOCK
 
@@ -17,6 +20,8 @@ ACTION_TEST_OFF = {"id": "Test", "type": "RPS", "state": {'a1': 0}, "dbm": 67}
 ACTION_TEST_ON = {"id": "Test", "type": "RPS", "state": {'a1': 1}, "dbm": 67}
 DATA_TEST = {"ip": "Test", "type": "RPS", "id": 3, "state": b"0"}
 PACKET = Packet.create(0x01, RORG.RPS, 0x02, 0x01)
+SENDER = [0x01, 0x02, 0x03, 0x04]
+OPTIONAL = [0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00]
 
 
 class TestEnoceanSystem(TestCase):
@@ -82,6 +87,43 @@ class TestEnoceanSystem(TestCase):
         data = self.system.update()
         assert len(data['devices']) > 0
 
+    def test_update_batch(self):
+        self.system.communicator = MagicMock()
+        self.system.communicator.receive = NotifyingQueue(self.system.notify_update)
+        self.system.set_availability = MagicMock()
+        self.system.receive_batch = 3
+        for _ in range(4):
+            packet = Packet.create(0x01, RORG.RPS, 0x02, 0x01)
+            packet.received = datetime.now()
+            self.system.communicator.receive.put(packet)
+
+        data = self.system.update()
+        assert len(data['devices']) == 3
+        assert self.system.communicator.receive.qsize() == 1
+        assert self.system.get_statistics()['receive_queue_max_depth'] == 4
+        assert self.system.receive_latency_max > 0
+        self.system.set_availability.assert_called_once_with(True)
+
+        assert len(self.system.update()['devices']) == 1
+        assert self.system.update() == {}
+
+    def test_next_update(self):
+        self.system.load = MagicMock()
+        self.system.mqtt_client.connect = MagicMock()
+        self.system.mqtt_client.publish = MagicMock()
+        self.system._open_communicator = MagicMock()
+        self.system.communicator = MagicMock()
+        self.system.communicator.receive = NotifyingQueue(self.system.notify_update)
+
+        # an idle gateway waits for the next availability refresh
+        self.system.init()
+        assert self.system.next_update() > time.time() + 1
+
+        # the availability is refreshed without any telegram
+        self.system.last_update = 0
+        assert self.system.update() == {}
+        assert self.system.next_update() > time.time() + 1
+
     def test_set_availability(self):
         self.system.init()
         time.sleep(1)
@@ -153,6 +195,113 @@ class TestEnoceanSystem(TestCase):
 
         assert len(self.system.config) == 0
 
+    def test_dimmer_long_push(self):
+        self.system.mqtt_client.publish = MagicMock()
+        self.system.config.append({"id": "Test", "type": "RPS", "dbm": 67, 'client_id': self.system.client_id,
+                                   'channel_config': {'a': "shellies/dimmer/light/0/set"}})
+        channel_topic = "cubiemedia/enocean/test/a1"
+
+        with patch('system.enocean_system.ENOCEAN_LONG_PUSH', 0.01), \
+                patch('system.enocean_system.ENOCEAN_DIMMER_STEP', 0.01):
+            self.system._create_timer_for(channel_topic)
+            time.sleep(0.3)
+            del self.system.timers[channel_topic]
+
+        self.system.mqtt_client.publish.assert_any_call(channel_topic + "/longpush", 1, True)
+        brightness = [json.loads(publish_call.args[1])['brightness']
+                      for publish_call in self.system.mqtt_client.publish.call_args_list
+                      if publish_call.args[0] == "shellies/dimmer/light/0/set"]
+        assert brightness == [5, 15, 25, 35, 45, 55, 65, 75, 85, 95]
+        assert self.system.timer_scheduler.pending() == 0
+
+    def test_long_push_after_release(self):
+        self.system.mqtt_client.publish = MagicMock()
+        channel_topic = "cubiemedia/enocean/test/a1"
+
+        # the timer was due while the button was released, the next press is detected again
+        with patch('system.enocean_system.ENOCEAN_LONG_PUSH', 10):
+            self.system._create_timer_for(channel_topic)
+            del self.system.timers[channel_topic]
+            self.system._long_push_timer(channel_topic)
+            assert channel_topic not in self.system.timers
+
+            self.system._create_timer_for(channel_topic)
+        assert self.system.timers[channel_topic] is not True
+        self.system.timers.pop(channel_topic).cancel()
+        self.system.mqtt_client.publish.assert_not_called()
+
+    def test_arbitration(self):
+        self.system.mqtt_client.publish = MagicMock()
+        self.system.save = MagicMock()
+        self.system.config.append({"id": "Test", "type": "RPS", "dbm": -70, 'client_id': self.system.client_id,
+                                   'state': {'a1': 0}})
+        other_gateway = "10.0.0.2-enocean-client"
+
+        claim = json.dumps({'g': other_gateway, 's': {'TEST': [-50, -50]}, 'c': ['TEST']})
+        self.system.on_arbitration(("cubiemedia", "enocean", "arbitration"), claim.encode())
+        assert self.system.config.get("Test")['client_id'] == other_gateway
+        self.system.save.assert_called_once()
+
+        # readings of a device managed by another gateway are only used for the arbitration
+        assert self.system.action({"id": "Test", "type": "RPS", "dbm": -90, "state": {'a1': 1}})
+        self.system.mqtt_client.publish.assert_not_called()
+        self.system.on_arbitration(("cubiemedia", "enocean", "arbitration"), b"no json")
+
+    def test_learn_device(self):
+        self.system.init()
+        time.sleep(1)
+
+        known_device = DEVICE_TEST_WITH_STATE.copy()
+        known_device['client_id'] = self.system.client_id
+        self.system.save(known_device)
+        self.system.announce()
+
+        self.system.mqtt_client.publish = MagicMock()
+        new_device = {"id": "Test3", "type": "RPS", "dbm": 70, "state": {'a1': 0}}
+        assert not self.system.action(new_device)
+        assert self.system.config.get("Test3") is not None
+
+        # only the discovery configs of the new device are published
+        topics = [publish_call.args[0] for publish_call in self.system.mqtt_client.publish.call_args_list]
+        assert "homeassistant/binary_sensor/Test3-a1/config" in topics
+        assert "homeassistant/binary_sensor/Test3-a1-longpush/config" in topics
+        assert not [topic for topic in topics if "Test2" in topic]
+
+        self.system.delete(known_device)
+        self.system.delete(new_device)
+
+    def test_teach_in(self):
+        self.system.mqtt_client.publish = MagicMock()
+        self.system.save = MagicMock()
+        self.system.config.append({"id": "01020304", "type": "TEMP", "dbm": -70, 'client_id': self.system.client_id,
+                                   'state': {'value': 20.0}})
+
+        # a teach-in with A5-04-01 changes the profile of the known device
+        teach_in = RadioPacket(PACKET_TYPE.RADIO_ERP1, data=[RORG.BS4, 0x10, 0x08, 0x00, 0x80] + SENDER + [0x30],
+                               optional=OPTIONAL)
+        assert self.system._get_sensor_from(teach_in) is None
+        assert self.system.config.get("01020304")['eep'] == "A5-04-01"
+        assert self.system.config.get("01020304")['type'] == "HUMIDITY"
+        self.system.save.assert_called_once()
+
+        packet = RadioPacket(PACKET_TYPE.RADIO_ERP1, data=[RORG.BS4, 0x00, 0x7D, 0xFA, 0x0A] + SENDER + [0x30],
+                             optional=OPTIONAL)
+        sensor = self.system._get_sensor_from(packet)
+        assert sensor['state'] == {'humidity': 50.0, 'temperature': 40.0}
+        assert sensor['eep'] == "A5-04-01"
+
+        assert self.system.action(sensor)
+        topics = [publish_call.args[0] for publish_call in self.system.mqtt_client.publish.call_args_list]
+        assert "cubiemedia/enocean/01020304/humidity" in topics
+        assert "homeassistant/sensor/01020304-humidity/config" in topics
+        assert "homeassistant/sensor/01020304-temperature/config" in topics
+
+        # profiles without decoder are dropped without parsing
+        teach_in = RadioPacket(PACKET_TYPE.RADIO_ERP1, data=[RORG.BS4, 0xFC, 0x08, 0x00, 0x80] + SENDER + [0x30],
+                               optional=OPTIONAL)
+        assert self.system._get_sensor_from(teach_in) is None
+        assert self.system._get_sensor_from(packet) is None
+
     def setUp(self):
         self.system = EnoceanSystem()
         self.system.get_mqtt_server = MQTT_HOST_MOCK
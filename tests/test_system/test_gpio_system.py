@@ -6,13 +6,14 @@ from unittest.mock import MagicMock
 
 from common import CUBIE_SYSTEM, CUBIE_GPIO
 from common.python import set_default_configuration, get_default_configuration_for
-from system.gpio_system import GPIOSystem
-from test_common import check_mqtt_server, MQTT_HOST_MOCK
+from system.gpio_system import GPIOSystem, GPIO
+from test_common import check_mqtt_server, MQTT_HOST_MOCK, GPIOEmulator
 
 DEVICE_TEST = {"id": 18, "type": "out", "value": 0}
 DEVICE_TEST_2 = {"id": 4, "type": "in", "value": 0}
 DEVICE_TEST_3 = {"id": "Test", "type": "gpio"}
 DATA_TEST = {"ip": "Test", "type": "gpio", "id": 3, "state": b"0"}
+DEVICE_COUNTER = {"id": 5, "type": "counter", "impulses": 1000, "pulses": 500}
 
 
 class TestGPIOSystem(TestCase):
@@ -75,11 +76,47 @@ class TestGPIOSystem(TestCase):
         assert len(self.system.config) == 8
 
     def test_update(self):
+        self.system.gpio_control = GPIOEmulator(GPIO)
         self.system.init()
         time.sleep(1)
 
+        self.system.update(True)
+        self.system.gpio_control.fire(4, 1)
         data = self.system.update()
-        assert len(data['devices']) > 0
+        assert [(device['id'], device['value']) for device in data['devices']] == [(4, 1)]
+        assert self.system.update()['devices'] == []
+
+    def test_edge_detection(self):
+        self.system.gpio_control = GPIOEmulator(GPIO)
+        self.system.init()
+        time.sleep(1)
+        self.system.update(True)
+
+        # a pulse which is over before the main loop wakes up is published with both edges
+        self.system.gpio_control.fire(17, 1, now=0)
+        self.system.gpio_control.fire(17, 0, now=0.1)
+        data = self.system.update()
+        assert [device['value'] for device in data['devices']] == [1, 0]
+        assert self.system.config.get(17)['value'] == 0
+
+        # bouncing contact
+        assert self.system.gpio_control.fire(17, 1, now=1)
+        assert not self.system.gpio_control.fire(17, 0, now=1.005)
+        assert not self.system.gpio_control.fire(17, 1, now=1.010)
+        assert [device['value'] for device in self.system.update()['devices']] == [1]
+        assert self.system.next_update() > time.time() + 1
+
+    def test_polling_fallback(self):
+        self.system.gpio_control = GPIOEmulator(GPIO, fail_pins=[22])
+        self.system.init()
+        time.sleep(1)
+        self.system.update(True)
+
+        assert self.system.polled_pins == [22]
+        self.system.gpio_control.levels[22] = 1
+        data = self.system.update()
+        assert [(device['id'], device['value']) for device in data['devices']] == [(22, 1)]
+        assert self.system.next_update() < time.time() + 1
 
     def test_set_availability(self):
         self.system.init()
@@ -122,6 +159,37 @@ class TestGPIOSystem(TestCase):
         self.system.mqtt_client.mqtt_client.subscribe.assert_called()
         self.system.set_availability.assert_called()
 
+    def test_counter(self):
+        self.system.gpio_control = GPIOEmulator(GPIO)
+        self.system.init()
+        time.sleep(1)
+        self.system.save = MagicMock()
+        self.system.mqtt_client.publish = MagicMock()
+        device = DEVICE_COUNTER.copy()
+        self.system.config.append(device)
+        self.system._add_counter(device)
+        counter = self.system.counters[5]
+
+        for index in range(100):
+            self.system.gpio_control.fire(5, 1, now=index)
+            self.system.gpio_control.fire(5, 0, now=index + 0.5)
+        assert counter.pulses == 600
+        # nothing is published before the interval is over
+        assert self.system.update()['devices'] == []
+
+        counter.published_at -= 60
+        counter.saved_at -= 600
+        devices = self.system.update()['devices']
+        assert devices[0]['value']['energy'] == 0.6
+        assert abs(devices[0]['value']['power'] - 6000) < 10
+        assert device['pulses'] == 600
+        self.system.save.assert_called_once()
+
+        self.system.action(devices[0])
+        topics = [publish_call.args[0] for publish_call in self.system.mqtt_client.publish.call_args_list]
+        assert topics == [f"cubiemedia/gpio/{self.system.string_ip}/5/energy",
+                          f"cubiemedia/gpio/{self.system.string_ip}/5/power"]
+
     def setUp(self):
         self.system = GPIOSystem()
         self.system.get_mqtt_server = MQTT_HOST_MOCK
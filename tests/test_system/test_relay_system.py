@@ -7,7 +7,7 @@ from unittest.mock import MagicMock
 from common import CUBIE_SYSTEM, CUBIE_RELAY
 from common.python import set_default_configuration, get_default_configuration_for
 from system.relay_system import RelaySystem
-from test_common import check_mqtt_server, MQTT_HOST_MOCK, MQTT_LOGIN_MOCK
+from test_common import check_mqtt_server, MQTT_HOST_MOCK, MQTT_LOGIN_MOCK, FakeRelayBoard
 
 DEVICE_TEST = {"id": "Test", "type": "relay", "state": {1: 0, 2: 0, 3: 0}}
 DATA_TEST = {"ip": "Test", "type": "relay", "id": 3, "state": "1"}
@@ -41,10 +41,49 @@ class TestRelaySystem(TestCase):
         self.system.config.append(DEVICE_TEST)
         self.system._set_status = MagicMock()
         self.system.send(DATA_TEST)
+        # commands are sent after the window of the coalescer
+        time.sleep(0.3)
 
         self.system._set_status.assert_called_with("Test", 3, "1", False)
         self.system.config.clear()
 
+    def test_send_coalesced(self):
+        board = FakeRelayBoard()
+        try:
+            self.system.mqtt_client.publish = MagicMock()
+            self.system.save = MagicMock()
+            self.system.config.append({'id': board.ip, 'type': 'relay', 'state': {str(index): "0" for index in
+                                                                                   range(8)}})
+            self.system.relay_board_list = [board.ip]
+            self.system.last_update = time.time()
+
+            # a scene switches all relays, the first relay twice
+            self.system.send({'ip': board.ip, 'id': 1, 'state': "0"})
+            for relay_id in range(1, 9):
+                self.system.send({'ip': board.ip, 'id': relay_id, 'state': "1"})
+            self._wait_for_refresh()
+
+            assert board.requests == [f"/io.cgi?DOA{relay_id}" for relay_id in range(1, 9)]
+            assert len(board.connections) == 1
+            assert self.system.refresh_boards == {board.ip}
+
+            # only the touched board is read again, once
+            data = self.system.update()
+            assert board.requests[8:] == ["/status.xml"]
+            assert data['devices'][0]['state'] == {str(index): "1" for index in range(8)}
+            assert self.system.update() == {}
+
+            # firmware which accepts several commands in one request
+            board.requests.clear()
+            self.system.config.get(board.ip)['combine_commands'] = True
+            for relay_id in range(1, 4):
+                self.system.send({'ip': board.ip, 'id': relay_id, 'state': "0"})
+            self._wait_for_refresh()
+            assert board.requests == ["/io.cgi?DOI1&DOI2&DOI3"]
+        finally:
+            board.close()
+            self.system.config.clear()
+
     def test_update(self):
         data = self.system.update()
         assert data == {}, "Fast Check failed, did i really find Relay Boards?"
@@ -58,6 +97,68 @@ class TestRelaySystem(TestCase):
             assert len(
                 self.system.relay_board_list) == 0, f"module list [{self.system.relay_board_list}] is not empty!"
 
+    def test_update_parallel(self):
+        boards = [FakeRelayBoard(delay=0.2) for _ in range(4)]
+        stalled_board = FakeRelayBoard(stalled=True)
+        try:
+            self.system.mqtt_client.publish = MagicMock()
+            self.system.save = MagicMock()
+            self.system.sweep_deadline = 0.5
+            self.system.config.append({'id': boards[0].ip, 'type': 'relay', 'state': {str(index): "0" for index in
+                                                                                       range(8)}})
+            self.system.relay_board_list = [board.ip for board in boards] + [stalled_board.ip]
+            boards[0].relays[1] = "1"
+
+            start = time.monotonic()
+            data = self.system.update()
+            # all boards at once, the stalled board does not hold back the main loop
+            assert time.monotonic() - start < 1.0
+            assert data['devices'] == [{'id': boards[0].ip, 'type': 'relay', 'client_id': self.system.client_id,
+                                        'state': {'1': "1"}}]
+            assert self.system.save.call_count == 3
+            assert list(self.system.pending_polls) == [stalled_board.ip]
+
+            # the failed poll is collected by the next update, the board backs off
+            stalled_board.close()
+            self.system.pending_polls[stalled_board.ip].result(timeout=5)
+            self.system.mqtt_client.publish.reset_mock()
+            self.system.update()
+            assert not self.system.pending_polls
+            self.system.mqtt_client.publish.assert_any_call(
+                f"cubiemedia/relay/{stalled_board.ip.replace('.', '_')}/online", 'false')
+            assert not self.system.relay_boards[stalled_board.ip].is_available()
+        finally:
+            stalled_board.close()
+            for board in boards:
+                board.close()
+            self.system.config.clear()
+
+    def test_update_slow_board(self):
+        boards = [FakeRelayBoard() for _ in range(3)]
+        slow_board = FakeRelayBoard(delay=1.0)
+        try:
+            self.system.mqtt_client.publish = MagicMock()
+            self.system.save = MagicMock()
+            self.system.sweep_deadline = 0.2
+            self.system.relay_board_list = [board.ip for board in boards] + [slow_board.ip]
+
+            self.system.update()
+            assert list(self.system.pending_polls) == [slow_board.ip]
+
+            # later updates only collect the slow board, without waiting or polling the others again
+            while self.system.pending_polls:
+                start = time.monotonic()
+                self.system.update()
+                assert time.monotonic() - start < 0.1
+                time.sleep(0.05)
+            assert [board.requests for board in boards] == [["/status.xml"]] * 3
+            assert slow_board.requests == ["/status.xml"]
+            assert not self.system.sweeping
+        finally:
+            slow_board.close()
+            for board in boards:
+                board.close()
+
     def test_set_availability(self):
         self.system.mqtt_client.publish = MagicMock()
 
@@ -97,6 +198,12 @@ class TestRelaySystem(TestCase):
         self.system.mqtt_client.mqtt_client.subscribe.assert_called()
         self.system.set_availability.assert_called()
 
+    def _wait_for_refresh(self):
+        for _ in range(50):
+            if self.system.refresh_boards:
+                return
+            time.sleep(0.1)
+
     def setUp(self):
         self.system = RelaySystem()
         self.system.get_mqtt_server = MQTT_HOST_MOCK
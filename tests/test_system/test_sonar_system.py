@@ -95,6 +95,11 @@ class TestSonarSystem(TestCase):
 
         self.system.mqtt_client = MagicMock()
         self.system.announce()
+        # nothing changed since the announce on connect
+        assert len(self.system.mqtt_client.publish.mock_calls) == 0
+
+        self.system.reset_discovery()
+        self.system.announce()
         assert len(self.system.mqtt_client.publish.mock_calls) == 3
 
     def setUp(self):